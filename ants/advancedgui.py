@@ -1,8 +1,14 @@
 #!/usr/bin/python3
 
+import concurrent.futures
+import itertools
 import math
 import os
 import analyzer
+import instrumentation
+import monitor
+import noise_floor
+import sigmf_capture
 from PyQt5.QtWidgets import QWidget, QDialog, QMenuBar, QCheckBox, QAction
 from PyQt5.QtWidgets import QApplication, QComboBox, QMessageBox, QPushButton
 from PyQt5.QtWidgets import QMainWindow, QLineEdit, QSlider, QLabel, QGridLayout
@@ -133,27 +139,77 @@ class ANTS_Results_Tab(QWidget):
         self.txop_button.clicked.connect(self.txop_button_clicked)
         self.layout.addWidget(self.txop_button, 6, 3, 1, 1)
 
+        # The plots are filled in by show_plot as they are drawn, a button does nothing until its plot is ready
+        self.bin_pixmap, self.bin_pixmap_path = QPixmap(), None
+        self.interframe_pixmap, self.interframe_pixmap_path = QPixmap(), None
+        self.raw_signal_pixmap, self.raw_signal_pixmap_path = QPixmap(), None
+        self.txop_pixmap, self.txop_pixmap_path = QPixmap(), None
+        self.showing_plot = False
+        self.plot_run = 0
+
         self.setLayout(self.layout)
 
+    # Forget the plots of the previous results. Only plots of the given run are shown from now on
+    def clear_plots(self, plot_run):
+        self.plot_run = plot_run
+        self.bin_pixmap_path = None
+        self.interframe_pixmap_path = None
+        self.raw_signal_pixmap_path = None
+        self.txop_pixmap_path = None
+        self.showing_plot = False
+
+    # Called as each plot of the results is written. The bin distribution is shown as soon as it is ready, any other plot
+    # only while nothing is shown yet. Plots of earlier runs that were still being drawn are ignored
+    def show_plot(self, plot_run, name, file_name):
+        if plot_run != self.plot_run:
+            return
+        if name == "bin_probability":
+            self.bin_pixmap_path = file_name
+            self.bin_button_clicked()
+        elif name == "interframe_spacing":
+            self.interframe_pixmap_path = file_name
+            if not self.showing_plot:
+                self.interframe_button_clicked()
+        elif name == "signal":
+            self.raw_signal_pixmap_path = file_name
+            if not self.showing_plot:
+                self.raw_signal_button_clicked()
+        elif name == "txop_durations":
+            self.txop_pixmap_path = file_name
+            if not self.showing_plot:
+                self.txop_button_clicked()
+
     # When the bin distribution button is clicked, display the bin distribution QPixmap contents
     def bin_button_clicked(self):
+        if self.bin_pixmap_path is None:
+            return
         self.bin_pixmap.load(self.bin_pixmap_path)
         self.graphic_label.setPixmap(self.bin_pixmap)
+        self.showing_plot = True
 
     # When the interframe spacing button is clicked, display the bin distribution QPixmap contents
     def interframe_button_clicked(self):
+        if self.interframe_pixmap_path is None:
+            return
         self.interframe_pixmap.load(self.interframe_pixmap_path)
         self.graphic_label.setPixmap(self.interframe_pixmap)
+        self.showing_plot = True
 
     # When the raw signal button is clicked display the raw signal data QPixmap contents
     def raw_signal_button_clicked(self):
+        if self.raw_signal_pixmap_path is None:
+            return
         self.raw_signal_pixmap.load(self.raw_signal_pixmap_path)
         self.graphic_label.setPixmap(self.raw_signal_pixmap)
+        self.showing_plot = True
 
     # When the TXOP button is clicked, display the transmission opportunity distribution QPixmap contents
     def txop_button_clicked(self):
+        if self.txop_pixmap_path is None:
+            return
         self.txop_pixmap.load(self.txop_pixmap_path)
         self.graphic_label.setPixmap(self.txop_pixmap)
+        self.showing_plot = True
 
 class ANTS_Thread(QThread):
     signal = pyqtSignal(analyzer.ANTS_Analyzer.Results, str)
@@ -166,13 +222,106 @@ class ANTS_Thread(QThread):
         self.wait()
 
     def run(self):
+        # record the stages of this run only
+        instrumentation.reset()
         iq_sample_files = self._antsController.start_usrp_iperf()
         self.antsAnalyzer = analyzer.ANTS_Analyzer(self._antsController.UUT_type, sample_rate=20e6)
-        for iq_sample_file in iq_sample_files:
-            self.antsAnalyzer.loadIqSamples(iq_sample_file)
+        if iq_sample_files and all(iq_sample_file in self._antsController.iq_packet_indices for iq_sample_file in iq_sample_files):
+            # the packets were already detected while the IQ samples were being captured
+            for iq_sample_file in iq_sample_files:
+                self.antsAnalyzer.addIqFile(analyzer.IQSamplesFile(iq_sample_file, sample_rate=20e6, packet_indices=self._antsController.iq_packet_indices[iq_sample_file],
+                    sample_format=self._antsController.sample_format))
+        else:
+            self.antsAnalyzer.loadIqSamplesParallel(iq_sample_files, threshold=self._antsController.get_detection_threshold(),
+                sample_format=self._antsController.sample_format)
+        self.antsAnalyzer.exportPacketEvents(os.path.join(self._antsController.data_dir, "packet_events_{}.npz".format(self._antsController.access_category_name)))
+        if self._antsController.burst_gating:
+            # drop the idle air between the packets, the captures are read the same way afterwards
+            pre_guard, post_guard = self._antsController.gating_guard
+            for run in self.antsAnalyzer.packet_events:
+                if sigmf_capture.is_sigmf(run["file_name"]):
+                    print("WARNING: Keeping all the samples of {}, SigMF recordings cannot be gated".format(run["file_name"]))
+                    continue
+                analyzer.gate_capture(run["file_name"], run["packet_start_indices"], run["packet_end_indices"], pre_guard=pre_guard,
+                    post_guard=post_guard, sample_format=run["sample_format"])
         self.results = self.antsAnalyzer.get_results()
         self.signal.emit(self.results, self._antsController.data_dir)
 
+# Calibrates the noise floor at the current gain and center frequency, which waits for the USRP to start and capture, and
+# signals the new detection threshold or why the calibration failed
+class ANTS_Calibration_Thread(QThread):
+    calibrated = pyqtSignal(float)
+    failed = pyqtSignal(str)
+
+    def __init__(self, antsController):
+        QThread.__init__(self)
+        self._antsController = antsController
+
+    def run(self):
+        try:
+            profile = self._antsController.calibrate_noise_floor()
+        except Exception as e:
+            self.failed.emit(str(e))
+            return
+        self.calibrated.emit(noise_floor.get_threshold(profile, self._antsController.noise_floor_margin))
+
+# Monitors the medium until the monitoring time has passed or it is stopped. Reports the latest results of every window
+# as they are updated, and signals the results of the longest window that has any once it is done
+class ANTS_Monitor_Thread(QThread):
+    signal = pyqtSignal(analyzer.ANTS_Analyzer.Results, str)
+    report = pyqtSignal(str)
+
+    def __init__(self, antsController):
+        QThread.__init__(self)
+        self._antsController = antsController
+
+    def run(self):
+        instrumentation.reset()
+        try:
+            results = self._antsController.start_usrp_monitor(on_report=self.on_report)
+        except Exception as e:
+            print(e)
+            self.report.emit(str(e))
+            return
+        for window in sorted(results, reverse=True):
+            if results[window] is not None:
+                self.signal.emit(results[window], self._antsController.data_dir)
+                return
+        self.report.emit("No complete TXOPs were monitored")
+
+    def on_report(self, elapsed, results):
+        self.report.emit("\n".join(monitor.format_window(elapsed, window, results[window]) for window in sorted(results)))
+
+# Draws the plots of the results in the worker processes of executor, so the GUI stays responsive, and signals each plot
+# as soon as its file is written, along with plot_run to tell it from the plots of other runs. Once all of them are
+# drawn, writes the instrumentation of the run, if it is instrumented, with the stages of the plots
+class ANTS_Plot_Thread(QThread):
+    plot_ready = pyqtSignal(int, str, str)
+
+    def __init__(self, plot_run, results, data_dir, image_format, executor):
+        QThread.__init__(self)
+        self._plot_run = plot_run
+        self._results = results
+        self._data_dir = data_dir
+        self._image_format = image_format
+        self._executor = executor
+
+    def run(self):
+        futures = self._results.plot_concurrently(self._data_dir, self._executor, self._image_format)
+        names = {future: name for name, future in futures.items()}
+        for future in concurrent.futures.as_completed(names):
+            try:
+                file_name, record = future.result()
+            except Exception as e:
+                print("WARNING: Could not plot the {}: {}".format(names[future].replace("_", " "), e))
+                continue
+            if record is not None:
+                self._results.instrumentation.append(record)
+            self.plot_ready.emit(self._plot_run, names[future], file_name)
+        print("Plots are saved as .{} files at {}.".format(self._image_format, self._data_dir))
+        if self._results.instrumentation is not None:
+            instrumentation.write_stages(os.path.join(self._data_dir, "instrumentation_{}.json".format(self._results.access_category)), self._results.instrumentation)
+
 # The catch-all tab widget for settings related to ANTS. Data entered here should be passed to the ANTS controller object
 class ANTS_Settings_Tab(QWidget):
     def __init__(self, tabs_object, results_tab, ants_controller, ants_table, showOverlay, hideOverlay):
@@ -360,16 +509,109 @@ class ANTS_Settings_Tab(QWidget):
         self.usrp_run_delay_text = "Run delay: " + str(self.usrp_run_delay_slider.value()) + " seconds"
         self.usrp_run_delay_label.setText(self.usrp_run_delay_text)
 
+        # Combo box for the format the USRP writes the samples in, which is also the format captures are analyzed in
+        self.sample_format_field = QComboBox(self)
+        self.sample_format_field.addItem("fc32")
+        self.sample_format_field.addItem("sc16")
+        self.sample_format_field.addItem("sc8")
+        self.sample_format_field_label = QLabel("Sample Format", self)
+        self.sample_format_field.setToolTip("fc32 takes 8 bytes per sample, sc16 4 bytes and sc8 2 bytes with less dynamic range")
+        self.sample_format_field.activated[str].connect(self.on_sample_format_change)
+        self.ants_controller.sample_format = "fc32"
+
+        # The checkbox for detecting packets while the USRP is still capturing
+        self.follow_capture_checkbox = QCheckBox("Analyze While Capturing", self)
+        self.follow_capture_checkbox.setToolTip("Detect packets in the IQ samples while the USRP is writing them, so results are ready as soon as it stops. Needs a calibrated noise floor.")
+        self.follow_capture_checkbox.stateChanged.connect(self.configure_follow_capture)
+
+        # The checkbox for keeping only the samples around the packets of each capture
+        self.burst_gating_checkbox = QCheckBox("Keep Only Bursts", self)
+        self.burst_gating_checkbox.setToolTip("Once analyzed, keep only the IQ samples around the packets of each capture, which takes far less disk space on a lightly used channel.")
+        self.burst_gating_checkbox.stateChanged.connect(self.configure_burst_gating)
+
+        # The checkbox for writing captures as SigMF recordings, with their metadata next to them
+        self.sigmf_checkbox = QCheckBox("Save as SigMF", self)
+        self.sigmf_checkbox.setToolTip("Write each capture as a .sigmf-data file with a .sigmf-meta file that records its sample rate, format, center frequency, gain, access category, run and start time.")
+        self.sigmf_checkbox.stateChanged.connect(self.configure_capture_container)
+
+        # The checkbox for keeping the USRP open between runs
+        self.capture_daemon_checkbox = QCheckBox("Keep USRP Open", self)
+        self.capture_daemon_checkbox.setToolTip("Keep the USRP configured and streaming between runs, so each run starts capturing at once instead of after reopening it.")
+        self.capture_daemon_checkbox.stateChanged.connect(self.configure_capture_daemon)
+
+        # The button for measuring the noise floor at the current gain and center frequency
+        self.calibrate_btn = QPushButton("Calibrate Noise Floor", self)
+        self.calibrate_btn.setToolTip("Capture the idle channel to set the detection threshold for this gain and center frequency. Stop any traffic on the channel first.")
+        self.calibrate_btn.clicked.connect(self.calibrate_button_clicked)
+
+        self.usrp_gridbox.addWidget(self.sample_format_field_label, 0, 0)
+        self.usrp_gridbox.addWidget(self.sample_format_field, 0, 1)
         self.usrp_gridbox.addWidget(self.usrp_gain_label, 1, 0)
         self.usrp_gridbox.addWidget(self.usrp_gain_slider, 1, 1)
         self.usrp_gridbox.addWidget(self.usrp_run_delay_label, 2, 0)
         self.usrp_gridbox.addWidget(self.usrp_run_delay_slider, 2, 1)
+        self.usrp_gridbox.addWidget(self.follow_capture_checkbox, 3, 0)
+        self.usrp_gridbox.addWidget(self.burst_gating_checkbox, 3, 1)
+        self.usrp_gridbox.addWidget(self.calibrate_btn, 4, 0)
+        self.usrp_gridbox.addWidget(self.sigmf_checkbox, 4, 1)
+        self.usrp_gridbox.addWidget(self.capture_daemon_checkbox, 5, 0)
 
         # Create the plotting groupbox and fill it
         self.plotting_groupbox = QGroupBox("Plot Settings")
         self.plotting_gridbox = QGridLayout(self)
         self.plotting_groupbox.setLayout(self.plotting_gridbox)
 
+        # Combo box for the image format of the plots, vector or raster
+        self.plot_format_field = QComboBox(self)
+        self.plot_format_field.addItem("SVG")
+        self.plot_format_field.addItem("PNG")
+        self.plot_format_field_label = QLabel("Image Format", self)
+        self.plot_format_field.setToolTip("PNG plots are smaller and faster to display than SVG plots of long captures")
+        self.plot_format_field.activated[str].connect(self.on_plot_format_change)
+        self.ants_controller.plot_format = "svg"
+        self.plotting_gridbox.addWidget(self.plot_format_field_label, 0, 0)
+        self.plotting_gridbox.addWidget(self.plot_format_field, 0, 1)
+
+        # Create the monitoring groupbox and fill it
+        self.monitoring_groupbox = QGroupBox("Monitoring")
+        self.monitoring_gridbox = QGridLayout(self)
+        self.monitoring_groupbox.setLayout(self.monitoring_gridbox)
+
+        # Text box for the lengths of the sliding windows that the compliance is reported over
+        self.monitor_windows_lineedit = QLineEdit(self)
+        self.monitor_windows_lineedit.setToolTip("Comma-separated lengths of the windows in seconds, e.g. 10, 60")
+        self.monitor_windows_lineedit.setValidator(QRegExpValidator(QRegExp("^\\s*[1-9][0-9]*(\\s*,\\s*[1-9][0-9]*)*\\s*$"), self))
+        self.monitor_windows_lineedit_label = QLabel("Windows (seconds)", self)
+        self.monitor_windows_lineedit.textChanged[str].connect(self.on_monitor_windows)
+        self.monitor_windows_lineedit.setText(", ".join(str(window) for window in self.ants_controller.monitor_windows))
+
+        # Text box for how long to monitor the medium for
+        self.monitor_time_lineedit = QLineEdit(self)
+        self.monitor_time_lineedit.setToolTip("Please enter an integer")
+        self.monitor_time_lineedit.setValidator(QIntValidator(1, 10**6, self))
+        self.monitor_time_lineedit_label = QLabel("Duration (seconds)", self)
+        self.monitor_time_lineedit.textChanged[str].connect(self.on_monitor_time)
+        self.monitor_time_lineedit.setText(str(self.ants_controller.monitor_time))
+
+        # The button for monitoring the medium, which stops the monitoring while it runs
+        self.monitor_btn = QPushButton("Monitor", self)
+        self.monitor_btn.setToolTip("Monitor the compliance of the medium over sliding windows, without writing the IQ samples to disk")
+        self.monitor_btn.clicked.connect(self.monitor_button_clicked)
+        self.monitor_thread = None
+
+        self.monitoring_gridbox.addWidget(self.monitor_windows_lineedit_label, 0, 0)
+        self.monitoring_gridbox.addWidget(self.monitor_windows_lineedit, 0, 1)
+        self.monitoring_gridbox.addWidget(self.monitor_time_lineedit_label, 1, 0)
+        self.monitoring_gridbox.addWidget(self.monitor_time_lineedit, 1, 1)
+        self.monitoring_gridbox.addWidget(self.monitor_btn, 2, 0)
+
+        # The worker processes that draw the plots, started with the first results, the threads that wait for them and
+        # the latest of those, and the number of the latest results whose plots are shown
+        self.plot_executor = None
+        self.plot_threads = []
+        self.plot_thread = None
+        self.plot_run = 0
+
         # Create the general (i.e. system-level) settings groupbox
         self.general_settings_groupbox = QGroupBox("General Settings")
         self.general_settings_gridbox = QGridLayout(self)
@@ -384,6 +626,13 @@ class ANTS_Settings_Tab(QWidget):
         self.gs_number_of_runs_lineedit.textChanged[str].connect(self.on_num_runs)
         self.gs_number_of_runs_lineedit.setText('1')
 
+        # The checkbox for recording the time and memory taken by each stage of the analysis, on by default when
+        # ANTS_INSTRUMENT=1 is set
+        self.instrument_checkbox = QCheckBox("Record Timings", self)
+        self.instrument_checkbox.setToolTip("Write the time and memory taken by each stage of the analysis to instrumentation_<access category>.json next to the results.")
+        self.instrument_checkbox.stateChanged.connect(self.configure_instrumentation)
+        self.instrument_checkbox.setChecked(instrumentation.enabled)
+
         # Add the general settings tools to the groupbox
         self.general_settings_gridbox.addWidget(self.test_name_label, 0, 0)
         self.general_settings_gridbox.addWidget(self.test_name_lineedit, 0, 1)
@@ -391,6 +640,7 @@ class ANTS_Settings_Tab(QWidget):
         self.general_settings_gridbox.addWidget(self.runtime_slider, 1, 1)
         self.general_settings_gridbox.addWidget(self.gs_number_of_runs_lineedit_label, 2, 0)
         self.general_settings_gridbox.addWidget(self.gs_number_of_runs_lineedit, 2, 1)
+        self.general_settings_gridbox.addWidget(self.instrument_checkbox, 3, 0)
         self.general_settings_gridbox.addWidget(self.run_btn, 4, 0)
         self.general_settings_groupbox.setLayout(self.general_settings_gridbox)
 
@@ -398,6 +648,8 @@ class ANTS_Settings_Tab(QWidget):
         self.layout.addWidget(self.usrp_groupbox, 0, 2, 2, 1)
         self.layout.addWidget(self.network_groupbox, 0, 1, 2, 1)
         self.layout.addWidget(self.general_settings_groupbox, 0, 0, 2, 1)
+        self.layout.addWidget(self.plotting_groupbox, 2, 0, 1, 1)
+        self.layout.addWidget(self.monitoring_groupbox, 2, 1, 1, 1)
 
     # Controls changing the value pointed to by the slider. The slider should
     # allow ranges between 0.5 and 10, but since the class only supports
@@ -495,6 +747,63 @@ class ANTS_Settings_Tab(QWidget):
         else:
             self.ants_controller.configure_routing = False
 
+    def on_sample_format_change(self, text):
+        self.ants_controller.sample_format = text
+
+    def on_plot_format_change(self, text):
+        self.ants_controller.plot_format = text.lower()
+
+    def calibrate_button_clicked(self):
+        self.showOverlay()
+        self.calibrate_btn.setEnabled(False)
+        self.calibration_thread = ANTS_Calibration_Thread(self.ants_controller)
+        self.calibration_thread.calibrated.connect(self.calibration_done)
+        self.calibration_thread.failed.connect(self.calibration_failed)
+        self.calibration_thread.start()
+
+    def calibration_done(self, threshold):
+        self.hideOverlay()
+        self.calibrate_btn.setEnabled(True)
+        print("Detection threshold set to {}".format(threshold))
+
+    def calibration_failed(self, message):
+        self.hideOverlay()
+        self.calibrate_btn.setEnabled(True)
+        print(message)
+        QMessageBox.warning(self, "Calibration Failed", message)
+
+    def configure_burst_gating(self, state):
+        if state == Qt.Checked:
+            self.ants_controller.burst_gating = True
+        else:
+            self.ants_controller.burst_gating = False
+
+    def configure_capture_container(self, state):
+        if state == Qt.Checked:
+            self.ants_controller.capture_container = "sigmf"
+        else:
+            self.ants_controller.capture_container = "bin"
+
+    def configure_capture_daemon(self, state):
+        if state == Qt.Checked:
+            self.ants_controller.capture_daemon = True
+        else:
+            self.ants_controller.capture_daemon = False
+            self.ants_controller.stop_capture_daemon()
+
+    def configure_instrumentation(self, state):
+        if state == Qt.Checked:
+            self.ants_controller.instrument = True
+        else:
+            self.ants_controller.instrument = False
+        instrumentation.enable(self.ants_controller.instrument)
+
+    def configure_follow_capture(self, state):
+        if state == Qt.Checked:
+            self.ants_controller.follow_capture = True
+        else:
+            self.ants_controller.follow_capture = False
+
     def scan_button_clicked(self):
         self.ants_controller.eth_name, self.ants_controller.eth_mac, self.ants_controller.wlan_name, self.ants_controller.wlan_mac, self.ants_controller.wlan_internal_name = interfaces_scan()
         networks = get_frequency_networks(self.ants_controller.wlan_name, self.ants_controller.center_frequency)
@@ -515,36 +824,48 @@ class ANTS_Settings_Tab(QWidget):
         self.control_thread.signal.connect(self.show_results)
         self.control_thread.start()
 
+    def on_monitor_windows(self, text):
+        if self.monitor_windows_lineedit.hasAcceptableInput():
+            self.ants_controller.monitor_windows = tuple(int(window) for window in text.split(","))
+
+    def on_monitor_time(self, text):
+        if self.monitor_time_lineedit.hasAcceptableInput():
+            self.ants_controller.monitor_time = int(text)
+
+    # Starts monitoring the medium, or stops it if it is being monitored. The results tab shows the latest results of every
+    # window while it runs, and the results of the longest window once it is done
+    def monitor_button_clicked(self):
+        if self.monitor_thread is not None and self.monitor_thread.isRunning():
+            self.monitor_btn.setEnabled(False)
+            self.ants_controller.stop_usrp_monitor()
+            return
+        if self.ants_controller.get_detection_threshold() is None:
+            QMessageBox.warning(self, "Monitoring Needs Calibration",
+                "Calibrate the noise floor at this gain and center frequency before monitoring, the packets are detected above it.")
+            return
+        self.run_btn.setEnabled(False)
+        self.monitor_btn.setText("Stop Monitoring")
+        self.monitor_thread = ANTS_Monitor_Thread(self.ants_controller)
+        self.monitor_thread.report.connect(self.results_tab.results_label.setText)
+        self.monitor_thread.signal.connect(self.show_results)
+        self.monitor_thread.finished.connect(self.monitoring_finished)
+        self.monitor_thread.start()
+        self.ants_table.setCurrentIndex(1)
+
+    def monitoring_finished(self):
+        self.monitor_btn.setText("Monitor")
+        self.monitor_btn.setEnabled(True)
+        self.run_btn.setEnabled(True)
+
     def show_results(self, results, data_dir):
         self.hideOverlay()
 
-        results.plot(data_dir)
         with open(os.path.join(data_dir, "results_{}.txt".format(results.access_category)), "w") as outfile:
             outfile.write(results.to_string())
 
         self.results_tab.results_label.setText(results.to_string())    
 
-        # Set up the graphics for the main display
-
-        # The path for the bin distribution image
-        self.results_tab.bin_pixmap_path = os.path.join(data_dir, "bin_probability_{}.svg".format(self.ants_controller.access_category_name))
-        self.results_tab.bin_pixmap = QPixmap(self.results_tab.bin_pixmap_path)
-
-        # The path for the interframe spacing image
-        self.results_tab.interframe_pixmap_path = os.path.join(data_dir, "interframe_spacing_histogram_{}.svg".format(self.ants_controller.access_category_name))
-        self.results_tab.interframe_pixmap = QPixmap(self.results_tab.interframe_pixmap_path)
-
-        # The path for the raw signal image
-        self.results_tab.raw_signal_pixmap_path = os.path.join(data_dir, "signal_magnitude_plot_{}.svg".format(self.ants_controller.access_category_name))
-        self.results_tab.raw_signal_pixmap = QPixmap(self.results_tab.raw_signal_pixmap_path)
-
-        # The path for the transmission opportunity image
-        self.results_tab.txop_pixmap_path = os.path.join(data_dir, "txop_durations_histogram_{}.svg".format(self.ants_controller.access_category_name))
-        self.results_tab.txop_pixmap = QPixmap(self.results_tab.txop_pixmap_path)
-
-        print("Plots are saved as .svg files at {0}.".format(data_dir))
-
-        # Set the pixmap window to be a gray background if there is no data from a previous run
+        # Set the pixmap window to be a gray background until the plots are ready
         self.results_tab.graphic_label.setStyleSheet("""
             background-color: grey;
             color: white;
@@ -555,7 +876,22 @@ class ANTS_Settings_Tab(QWidget):
             border-radius: 1px;
             border-color: white;
         """)
-        self.results_tab.graphic_label.setPixmap(self.results_tab.bin_pixmap)
+        self.results_tab.graphic_label.clear()
+        self.plot_run += 1
+        self.results_tab.clear_plots(self.plot_run)
+
+        # Draw the plots off the GUI thread, the results tab shows each of them as soon as it is written. The plots of
+        # earlier results that are still being drawn are no longer shown, but their threads are kept until they finish
+        if self.plot_executor is None:
+            self.plot_executor = analyzer.create_process_executor()
+        if self.plot_thread is not None:
+            self.plot_thread.plot_ready.disconnect()
+        plot_thread = ANTS_Plot_Thread(self.plot_run, results, data_dir, self.ants_controller.plot_format, self.plot_executor)
+        plot_thread.plot_ready.connect(self.results_tab.show_plot)
+        plot_thread.finished.connect(lambda: self.plot_threads.remove(plot_thread))
+        self.plot_threads.append(plot_thread)
+        self.plot_thread = plot_thread
+        plot_thread.start()
 
         self.ants_table.setCurrentIndex(1)
         self.ants_controller.configure_routing = False
@@ -660,18 +996,29 @@ class Advanced_GUI(QMainWindow):
         QMessageBox.about(self, 'About', aboutText)    
 
     def plotIQSamplesFile(self):
-        fileName, _ = QFileDialog.getOpenFileName(self, "Plot IQ Sample File", "", "IQ Samples Files (*.bin);;All Files (*)")
+        fileName, _ = QFileDialog.getOpenFileName(self, "Plot IQ Sample File", "", "IQ Samples Files (*.bin *.sigmf-data *.sigmf-meta);;All Files (*)")
         if fileName:
             print("Open {}".format(fileName))
-            iqFile = analyzer.IQSamplesFile(fileName)
+            # the whole capture is drawn from its power pyramid, which is kept next to it for the next time it is plotted
+            iqFile = analyzer.IQSamplesFile(fileName, pyramid=True, sample_format=self.ants_controller.sample_format)
             iqFile.plot()
 
     def analyzeIQSamples(self):
-        iq_sample_files, _ = QFileDialog.getOpenFileNames(self, "Analyze IQ Sample Files", "IQ Samples Files (*.bin);;All Files (*)")
+        iq_sample_files, _ = QFileDialog.getOpenFileNames(self, "Analyze IQ Sample Files", "", "IQ Samples Files (*.bin *.sigmf-data *.sigmf-meta);;Packet Event Files (*.npz);;All Files (*)")
         if iq_sample_files and len(iq_sample_files) > 0:
+            # record the stages of this analysis only
+            instrumentation.reset()
             antsAnalyzer = analyzer.ANTS_Analyzer(self.ants_controller.UUT_type, sample_rate=20e6)
-            for iq_sample_file in iq_sample_files:
-                antsAnalyzer.loadIqSamples(iq_sample_file)
+            # packet event files exported by earlier runs are re-analyzed without touching the raw captures. The files are added
+            # in the order they were selected, and the packets of consecutive captures are detected in parallel, with the same
+            # threshold as when they are run
+            threshold = self.ants_controller.get_detection_threshold()
+            for packet_events, file_names in itertools.groupby(iq_sample_files, key=lambda f: f.endswith(".npz")):
+                if packet_events:
+                    for packet_event_file in file_names:
+                        antsAnalyzer.loadPacketEvents(packet_event_file)
+                else:
+                    antsAnalyzer.loadIqSamplesParallel(list(file_names), threshold=threshold, sample_format=self.ants_controller.sample_format)
             results = antsAnalyzer.get_results()
             dir = os.path.dirname(iq_sample_files[0])
             self.table_widget.settings_tab.show_results(results, dir)
@@ -692,6 +1039,16 @@ class Advanced_GUI(QMainWindow):
                 print("WARNING: Could not turn on network manager")
                 pass
 
+            settings_tab = self.table_widget.settings_tab
+            if settings_tab.plot_executor is not None:
+                settings_tab.plot_executor.shutdown(wait=False)
+            # a QThread that is destroyed while it runs aborts the process, so the plots already being drawn are waited for
+            for plot_thread in list(settings_tab.plot_threads):
+                plot_thread.wait()
+            if settings_tab.monitor_thread is not None:
+                settings_tab.ants_controller.stop_usrp_monitor()
+                settings_tab.monitor_thread.wait()
+            settings_tab.ants_controller.stop_capture_daemon()
             event.accept()
         else:
             event.ignore()
@@ -1,82 +1,640 @@
+import collections
+import concurrent.futures
+import json
 import math
+import multiprocessing
 import os
 import re
 import sys
 from textwrap import dedent
-import matplotlib
+from matplotlib.figure import Figure
 import matplotlib.pyplot as plt
 import numpy as np
+import burst_gating
+import instrumentation
+import power_pyramid
+import sigmf_capture
+
+# The formats a capture can be recorded in, as UHD names them (the cpu_format of writeIQ.py), and the type of one sample.
+# fc32 samples are float32 in-phase/quadrature pairs, which is exactly the complex64 layout, while sc16 and sc8 samples
+# are pairs of int16 and int8 values, which take a half and a quarter of the space
+SAMPLE_FORMATS = {
+    "fc32": np.dtype(np.complex64),
+    "sc16": np.dtype((np.int16, (2,))),
+    "sc8": np.dtype((np.int8, (2,))),
+}
+
+# The integer value that UHD converts to 1.0 in fc32, for each integer sample type
+FULL_SCALE = {np.dtype(np.int16): 32767, np.dtype(np.int8): 127}
+
+# The quantiles of the IFSs and TXOP durations reported by the online analyzer, which keeps quantile sketches of them
+REPORTED_QUANTILES = (0.5, 0.9, 0.99)
+
+# Integer samples are squared in blocks of this many samples, so that their float32 squares only take a small buffer
+POWER_BLOCK_SIZE = 2**14
+
+def get_sample_dtype(sample_format):
+    if sample_format not in SAMPLE_FORMATS:
+        raise Exception("ERROR: Unknown sample format {}, expected one of {}".format(sample_format, ", ".join(SAMPLE_FORMATS)))
+    return SAMPLE_FORMATS[sample_format]
+
+def open_iq_samples(iq_samples_file_name, sample_format = "fc32"):
+    """Maps a capture into memory without copying it, as complex64 samples for fc32 or as (I, Q) integer rows otherwise
+
+    A burst-gated capture (see gate_capture) is read through burst_gating.GatedSamples, which can be sliced and indexed
+    like the samples of the full capture."""
+    # A trailing incomplete pair is ignored, as is a trailing unpaired in-phase value
+    sample_dtype = get_sample_dtype(sample_format)
+    gated_samples = burst_gating.load_gated_samples(iq_samples_file_name, sample_format, sample_dtype)
+    if gated_samples is not None:
+        return gated_samples
+    data_length = os.path.getsize(iq_samples_file_name) // sample_dtype.itemsize
+    if data_length == 0:
+        raise Exception("ERROR: {} does not contain any IQ samples".format(iq_samples_file_name))
+    return np.memmap(iq_samples_file_name, dtype=sample_dtype, mode='r', shape=(data_length,))
+
+def power_envelope(samples, out = None):
+    """Returns the power I^2 + Q^2 of complex64 samples, or of an interleaved float32 IQ buffer, as float32
+
+    sc16 and sc8 samples, as (I, Q) rows or interleaved int16 or int8 values, are scaled to the full scale of fc32 as UHD
+    converts them, so the power of a capture does not depend on the format it was recorded in. The power is written to out
+    if given, which must have one float32 element per sample, so that a chunked reader can reuse a single buffer and no
+    full-length temporary is allocated."""
+    if samples.dtype in FULL_SCALE:
+        # a trailing unpaired in-phase value is ignored, as in open_iq_samples
+        iq = samples.reshape(-1)[:samples.size // 2 * 2].reshape(-1, 2)
+        if out is None:
+            out = np.empty(len(iq), dtype=np.float32)
+        squares = np.empty((min(POWER_BLOCK_SIZE, len(iq)), 2), dtype=np.float32)
+        for block_start in range(0, len(iq), POWER_BLOCK_SIZE):
+            block_squares = squares[:min(POWER_BLOCK_SIZE, len(iq) - block_start)]
+            np.square(iq[block_start:block_start + len(block_squares)], out=block_squares, dtype=np.float32)
+            np.add(block_squares[:, 0], block_squares[:, 1], out=out[block_start:block_start + len(block_squares)])
+        # the scaling is only applied to the power, never to the samples
+        out *= np.float32(1/FULL_SCALE[samples.dtype]**2)
+        return out
+    if samples.dtype == np.float32:
+        # a trailing unpaired in-phase value is ignored, as in open_iq_samples
+        samples = samples[:len(samples) // 2 * 2].view(np.complex64)
+    if out is None:
+        out = np.empty(len(samples), dtype=np.float32)
+    # NumPy computes |x| of complex64 with a vectorized hypot, which is faster than squaring and adding the strided I and
+    # Q values, so the magnitude is squared in place rather than avoiding the square root
+    np.abs(samples, out=out)
+    np.square(out, out=out)
+    return out
+
+# Bytes of working memory per sample while streaming a capture: the complex64 read buffer, its float32 power, the
+# threshold mask and its edge mask. The edge indices scale with the number of bursts rather than samples
+STREAMING_BYTES_PER_SAMPLE = 8 + 4 + 1 + 1
+
+# Number of samples each worker thread processes at a time when detecting packets in segments of a memory-mapped capture
+SEGMENT_CHUNK_SIZE = 2**20
+
+def iter_power_chunks(iq_samples_file_name, chunk_size, sample_format = "fc32"):
+    """Yields the power of consecutive chunks of a capture, read through a fixed-size buffer"""
+    # The same buffers are reused for every chunk, so a yielded chunk is only valid until the next one is requested
+    sample_dtype = get_sample_dtype(sample_format)
+    samples = np.empty(chunk_size, dtype=sample_dtype)
+    power = np.empty(chunk_size, dtype=np.float32)
+    with open(iq_samples_file_name, mode='rb') as file:
+        while True:
+            num_samples = file.readinto(samples) // sample_dtype.itemsize
+            if num_samples == 0:
+                break
+            yield power_envelope(samples[:num_samples], out=power[:num_samples])
+
+def find_runs(mask):
+    """Returns the first and last index of every run of True values in a boolean array"""
+    # rising edges are where a run starts and falling edges are one past where it ends
+    edges = np.flatnonzero(mask[1:] != mask[:-1]) + 1
+    rising_edges = edges[mask[edges]]
+    falling_edges = edges[~mask[edges]]
+    if len(mask) > 0 and mask[0]:
+        rising_edges = np.concatenate(([0], rising_edges))
+    if len(mask) > 0 and mask[-1]:
+        falling_edges = np.concatenate((falling_edges, [len(mask)]))
+    return rising_edges.astype(np.int64), falling_edges.astype(np.int64) - 1
+
+def merge_packets(packet_start_indices, packet_end_indices, window_size):
+    """Merges consecutive packets (or runs of above-threshold samples) separated by at most window_size samples"""
+    if len(packet_start_indices) == 0:
+        return packet_start_indices, packet_end_indices
+    temp_indices = np.flatnonzero((packet_start_indices[1:] - packet_end_indices[:-1]) > window_size)
+    return (packet_start_indices[np.concatenate(([0], temp_indices + 1))],
+        packet_end_indices[np.concatenate((temp_indices, [len(packet_end_indices) - 1]))])
+
+class BurstDetector():
+    """Finds packets in power data that is fed in consecutive chunks"""
+    def __init__(self, threshold, window_size, offset = 0):
+        self.threshold = threshold
+        self.window_size = window_size
+        # absolute sample index of the start of the next chunk
+        self.offset = offset
+
+        # the last packet found so far is kept open, since it may continue in the next chunk
+        self.open_packet_start = None
+        self.open_packet_end = None
+        self.packet_start_indices = []
+        self.packet_end_indices = []
+
+    def feed(self, power_chunk):
+        # disregard the fluctuations of the signal in the packet: only the runs of above-threshold samples matter, and a
+        # packet is a group of runs separated by gaps that are too short to end it
+        run_starts, run_ends = find_runs(power_chunk > self.threshold)
+        run_starts += self.offset
+        run_ends += self.offset
+        self.offset += len(power_chunk)
+        if len(run_starts) == 0:
+            return
+        packet_start_indices, packet_end_indices = merge_packets(run_starts, run_ends, self.window_size)
+
+        if self.open_packet_end is not None:
+            # the open packet carries on into this chunk if the gap to its last sample is short enough
+            if packet_start_indices[0] - self.open_packet_end > self.window_size:
+                self.packet_start_indices.append([self.open_packet_start])
+                self.packet_end_indices.append([self.open_packet_end])
+            else:
+                packet_start_indices[0] = self.open_packet_start
+
+        self.packet_start_indices.append(packet_start_indices[:-1])
+        self.packet_end_indices.append(packet_end_indices[:-1])
+        self.open_packet_start = packet_start_indices[-1]
+        self.open_packet_end = packet_end_indices[-1]
+
+    def pop_packets(self):
+        """Returns the start and end indices of the packets closed since the last call and forgets them"""
+        # lets a detector that runs indefinitely hand its packets on instead of accumulating them
+        packet_start_indices = np.concatenate([np.zeros(0, dtype=np.int64)] + self.packet_start_indices).astype(np.int64)
+        packet_end_indices = np.concatenate([np.zeros(0, dtype=np.int64)] + self.packet_end_indices).astype(np.int64)
+        self.packet_start_indices = []
+        self.packet_end_indices = []
+        return packet_start_indices, packet_end_indices
+
+    def finish(self):
+        """Closes the last packet and returns the start and end indices of all packets"""
+        if self.open_packet_end is not None:
+            self.packet_start_indices.append([self.open_packet_start])
+            self.packet_end_indices.append([self.open_packet_end])
+            self.open_packet_start = None
+            self.open_packet_end = None
+        packet_start_indices = np.concatenate([np.zeros(0, dtype=np.int64)] + self.packet_start_indices).astype(np.int64)
+        packet_end_indices = np.concatenate([np.zeros(0, dtype=np.int64)] + self.packet_end_indices).astype(np.int64)
+        return packet_start_indices, packet_end_indices
+
+def iter_power_segment(samples, start, stop, chunk_size):
+    """Yields the power of consecutive chunks of samples[start:stop], computed in a fixed-size buffer"""
+    # As with iter_power_chunks, a yielded chunk is only valid until the next one is requested
+    power = np.empty(max(min(chunk_size, stop - start), 0), dtype=np.float32)
+    for chunk_start in range(start, stop, chunk_size):
+        chunk_power = power[:min(chunk_size, stop - chunk_start)]
+        yield power_envelope(samples[chunk_start:chunk_start + len(chunk_power)], out=chunk_power)
+
+def detect_packets_in_segments(samples, noise_threshold, window_size, workers, chunk_size, pyramid_builder = None, threshold = None):
+    """Detects the packets in memory-mapped samples split into one segment per worker thread, relative to their mean power
+    unless an absolute threshold is given"""
+    # NumPy releases the GIL while computing the power and the threshold mask, so the segments are processed concurrently
+    boundaries = np.linspace(0, len(samples), workers + 1).astype(np.int64)
+    if pyramid_builder is not None:
+        # each segment fills its own buckets of the pyramid, which takes segments that start on a bucket boundary of every
+        # level. Short captures may end up with fewer segments than workers
+        alignment = pyramid_builder.alignment()
+        boundaries = np.unique(np.concatenate(([0], boundaries[1:-1] // alignment * alignment, [len(samples)])))
+    segments = list(zip(boundaries[:-1], boundaries[1:]))
+
+    def segment_power_sum(segment):
+        power_sum = 0.0
+        for power_chunk in iter_power_segment(samples, segment[0], segment[1], chunk_size):
+            power_sum += np.sum(power_chunk, dtype=np.float64)
+        return power_sum
+
+    def segment_packets(segment):
+        detector = BurstDetector(threshold, window_size, offset=segment[0])
+        pyramid_segment = None if pyramid_builder is None else pyramid_builder.segment(segment[0])
+        for power_chunk in iter_power_segment(samples, segment[0], segment[1], chunk_size):
+            detector.feed(power_chunk)
+            if pyramid_segment is not None:
+                pyramid_segment.feed(power_chunk)
+        if pyramid_segment is not None:
+            pyramid_segment.finish()
+        return detector.finish()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        if threshold is None:
+            # the segment sums are added up in segment order, so the threshold does not depend on thread scheduling
+            threshold = noise_threshold * sum(executor.map(segment_power_sum, segments)) / len(samples)
+        packets = list(executor.map(segment_packets, segments))
+
+    # A packet crossing a segment boundary is found as the last packet of one segment and the first of the next. The gaps
+    # between packets of the same segment are already longer than window_size, so merging again only rejoins those
+    packet_start_indices = np.concatenate([packet_start_indices for packet_start_indices, _ in packets])
+    packet_end_indices = np.concatenate([packet_end_indices for _, packet_end_indices in packets])
+    return merge_packets(packet_start_indices, packet_end_indices, window_size)
+
+# Version of the file format written by ANTS_Analyzer.exportPacketEvents
+PACKET_EVENTS_VERSION = 1
+
+# Bump when the detection changes in a way that invalidates previously cached packets
+PACKET_CACHE_VERSION = 1
+
+def get_packet_cache_file_name(iq_samples_file_name):
+    return iq_samples_file_name + ".packets.npz"
+
+def get_packet_cache_key(iq_samples_file_name, sample_rate, noise_threshold, wait_time, threshold = None, sample_format = "fc32"):
+    """Returns the key identifying the packets detected in a capture: the file identity and the detection parameters"""
+    stat = os.stat(iq_samples_file_name)
+    key = {"version": PACKET_CACHE_VERSION, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+        "sample_rate": sample_rate, "noise_threshold": noise_threshold, "wait_time": wait_time}
+    if threshold is not None:
+        # packets detected with an absolute threshold do not depend on noise_threshold. Keys without one stay as they
+        # were, so existing caches remain valid
+        key["threshold"] = threshold
+        del key["noise_threshold"]
+    if sample_format != "fc32":
+        key["sample_format"] = sample_format
+    return json.dumps(key, sort_keys=True)
+
+def load_packet_cache(iq_samples_file_name, cache_key):
+    """Returns the cached packet start and end indices of a capture, or None if the sidecar is missing or stale"""
+    try:
+        with np.load(get_packet_cache_file_name(iq_samples_file_name)) as cache:
+            if str(cache["key"]) != cache_key:
+                return None
+            return cache["packet_start_indices"], cache["packet_end_indices"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+def save_packet_cache(iq_samples_file_name, cache_key, packet_start_indices, packet_end_indices):
+    # write to a temporary file first so that an interrupted write never leaves a truncated sidecar behind
+    cache_file_name = get_packet_cache_file_name(iq_samples_file_name)
+    try:
+        with open(cache_file_name + ".tmp", mode='wb') as file:
+            np.savez(file, key=np.array(cache_key), packet_start_indices=packet_start_indices, packet_end_indices=packet_end_indices)
+        os.replace(cache_file_name + ".tmp", cache_file_name)
+    except OSError as e:
+        print("WARNING: Could not write the packet cache {}: {}".format(cache_file_name, e))
+
+# Samples kept before and after every packet by gate_capture, 20 microseconds at 20 MS/s
+DEFAULT_GUARD = 400
+
+def gate_capture(iq_samples_file_name, packet_start_indices, packet_end_indices, pre_guard = DEFAULT_GUARD, post_guard = DEFAULT_GUARD,
+        sample_format = "fc32", chunk_size = SEGMENT_CHUNK_SIZE):
+    """Replaces a capture with only the segments around its packets and returns the fraction of its samples that were kept
+
+    The packets must be the ones detected in the full capture. Every sample above the threshold lies within one, and the
+    mean power of the full capture is kept, so detecting the packets of the gated capture finds exactly the same ones.
+
+    SigMF recordings are not gated, since their metadata describes the samples as one stream from the first sample on."""
+    if sigmf_capture.is_sigmf(iq_samples_file_name):
+        raise Exception("ERROR: {} is a SigMF recording, which cannot be gated".format(iq_samples_file_name))
+    samples = open_iq_samples(iq_samples_file_name, sample_format)
+    if isinstance(samples, burst_gating.GatedSamples):
+        raise Exception("ERROR: {} is already gated".format(iq_samples_file_name))
+    data_length = len(samples)
+    segment_starts, segment_lengths = burst_gating.get_segments(packet_start_indices, packet_end_indices, data_length, pre_guard, post_guard)
+    segment_ends = segment_starts + segment_lengths
+
+    # a single pass over the full capture for its mean power and the samples of the segments, written to a temporary file
+    # that only takes the place of the capture once its sidecar is written
+    gated_file_name = iq_samples_file_name + ".gated.tmp"
+    power = np.empty(chunk_size, dtype=np.float32)
+    power_sum = 0.0
+    with open(gated_file_name, mode='wb') as file:
+        for chunk_start in range(0, data_length, chunk_size):
+            chunk_stop = min(chunk_start + chunk_size, data_length)
+            chunk = samples[chunk_start:chunk_stop]
+            power_sum += np.sum(power_envelope(chunk, out=power[:len(chunk)]), dtype=np.float64)
+            for segment in range(np.searchsorted(segment_ends, chunk_start, side='right'), np.searchsorted(segment_starts, chunk_stop)):
+                chunk[max(segment_starts[segment], chunk_start) - chunk_start:min(segment_ends[segment], chunk_stop) - chunk_start].tofile(file)
+    del samples
+    burst_gating.save_segments(iq_samples_file_name, gated_file_name, sample_format, segment_starts, segment_lengths, data_length,
+        power_sum / data_length)
+    os.replace(gated_file_name, iq_samples_file_name)
+
+    kept = np.sum(segment_lengths) / data_length
+    print("Gated {} to {} segments, keeping {:.1%} of its {} samples".format(iq_samples_file_name, len(segment_starts), kept, data_length))
+    return kept
+
+def detect_packets(iq_samples_file_name, sample_rate, noise_threshold, max_memory, workers=None, cache=True, threshold=None, sample_format="fc32"):
+    """Detects the packets in a capture and returns only their start and end indices, so that it can run in a worker process"""
+    iqFile = IQSamplesFile(iq_samples_file_name, sample_rate=sample_rate, noise_threshold=noise_threshold, max_memory=max_memory, workers=workers, cache=cache, threshold=threshold, sample_format=sample_format)
+    return iqFile.packet_start_indices, iqFile.packet_end_indices
 
 class IQSamplesFile():
-    def __init__(self, iq_samples_file_name, sample_rate = 20e6, noise_threshold = 0.02):
-        match = re.search("iqsamples_(video|voice|best_effort|background)_run(\d+)\.bin", iq_samples_file_name)
-        if not match:
-            raise Exception("ERROR: Could not parse file name {} to ac and run#".format(iq_samples_file_name))
-        self.access_category = match.group(1)
-        self.run = match.group(2)
+    def __init__(self, iq_samples_file_name, sample_rate = 20e6, noise_threshold = 0.02, wait_time = 4e-6, max_memory = None, workers = None, packet_indices = None, cache = True, pyramid = False, threshold = None, sample_format = "fc32"):
+        self.metadata = None
+        if sigmf_capture.is_sigmf(iq_samples_file_name):
+            # a SigMF recording describes itself, so its samples are read as it says rather than as the caller assumes
+            iq_samples_file_name, _ = sigmf_capture.get_sigmf_file_names(iq_samples_file_name)
+            self.metadata = sigmf_capture.load_metadata(iq_samples_file_name)
+            if self.metadata["access_category"] is None or self.metadata["run"] is None:
+                raise Exception("ERROR: {} does not give the ac and run#".format(iq_samples_file_name))
+            if self.metadata["sample_rate"] != sample_rate:
+                raise Exception("ERROR: {} was recorded at a sample rate of {}, not {}".format(iq_samples_file_name, self.metadata["sample_rate"], sample_rate))
+            if self.metadata["sample_format"] != sample_format:
+                print("WARNING: {} was recorded in {}, not {}".format(iq_samples_file_name, self.metadata["sample_format"], sample_format))
+                sample_format = self.metadata["sample_format"]
+            self.access_category = self.metadata["access_category"]
+            self.run = str(self.metadata["run"])
+        else:
+            match = re.search("iqsamples_(video|voice|best_effort|background)_run(\d+)\.bin", iq_samples_file_name)
+            if not match:
+                raise Exception("ERROR: Could not parse file name {} to ac and run#".format(iq_samples_file_name))
+            self.access_category = match.group(1)
+            self.run = match.group(2)
+        self.file_name = iq_samples_file_name
 
         print("Loading {}...".format(iq_samples_file_name))
-        with open(iq_samples_file_name, mode='rb') as file:
-            raw_data = np.fromfile(file, dtype=np.float32)
-        file_length = len(raw_data)
-        
-        # In-phase data is at the even indices, quadrature is at the odd ones
-        in_phase_data = raw_data[0:file_length:2]
-        quadrature_data = raw_data[1:file_length:2]
-        # Find the common length of the two data subsets to ensure proper plots
-        data_length = min(len(in_phase_data), len(quadrature_data))
-        duration = data_length/sample_rate
-
-        in_phase_data = in_phase_data[0:data_length]
-        quadrature_data = quadrature_data[0:data_length]
-
-        print("Found {} samples, corresponding to a duration of {}s".format(data_length, duration))
-
-        # set the time axis from the data length and the total duration
-        self.time = np.linspace(0, duration, num=data_length)
-        # combine inphase and quadrature components as a complex number, cos(wt) + 1j*sin(wt)
-        complex_data = in_phase_data + (1j*quadrature_data)
-        self.power_data = abs(complex_data)**2
-        #self.power_data = power_data[int(len(power_data)/100):-1]
-        threshold = noise_threshold * np.mean(self.power_data)
-
-        # disregard the fluctuations of the signal in the packet
-        packet_indices = np.concatenate(np.where(self.power_data > threshold))
-        # possible wait time between packets in seconds
-        wait_time = 4e-6
-        # number of samples from the start of the packet to safely assume that the packet is complete but before the arrival of the next packet
+        # the sample format is whatever the capture was recorded in (see writeIQ.py), a raw .bin capture does not record it
+        self.sample_format = sample_format
+        with instrumentation.stage("open"):
+            self.samples = open_iq_samples(iq_samples_file_name, sample_format)
+        self.sample_rate = sample_rate
+        self.data_length = len(self.samples)
+        self.duration = self.data_length/sample_rate
+
+        print("Found {} samples, corresponding to a duration of {}s".format(self.data_length, self.duration))
+
+        # wait_time is the possible wait time between packets in seconds, and window_size the number of samples from the start of the packet
+        # to safely assume that the packet is complete but before the arrival of the next packet
         window_size = int(sample_rate*wait_time)
-        temp_vector = np.diff(packet_indices)
-        temp_indices = np.concatenate(np.where(temp_vector > window_size))
-
-        # an array to store the indices of the end of the packet
-        self.packet_end_indices = np.array([0]*(len(temp_indices)+1))
-        self.packet_end_indices[0:(len(temp_indices))] = packet_indices[temp_indices]
-        self.packet_end_indices[len(temp_indices)] = packet_indices[-1]
-
-        # an array to store the indices of the start of the packet
-        self.packet_start_indices = np.array([0]*(len(temp_indices)+1))
-        self.packet_start_indices[1:(len(temp_indices)+1)] = packet_indices[temp_indices+1]
-        self.packet_start_indices[0] = packet_indices[0]
-
-        self.packet_indicator = np.zeros([data_length, 1])
-        self.packet_indicator[self.packet_start_indices] = 1
-        self.packet_indicator[self.packet_end_indices] = 1
+
+        # The threshold is noise_threshold times the mean power of the whole capture, unless an absolute threshold is given,
+        # e.g. from the noise floor of the rig (see noise_floor.py). Then the packets are found without a pass over the
+        # capture for its mean power first
+
+        # the packets detected in a capture are cached in a sidecar file, which is used as long as neither the capture nor
+        # the detection parameters have changed
+        cache_key = None
+        if packet_indices is None and cache:
+            with instrumentation.stage("load packet cache"):
+                cache_key = get_packet_cache_key(iq_samples_file_name, sample_rate, noise_threshold, wait_time, threshold, sample_format)
+                packet_indices = load_packet_cache(iq_samples_file_name, cache_key)
+            if packet_indices is not None:
+                print("Loaded {} packets from {}".format(len(packet_indices[0]), get_packet_cache_file_name(iq_samples_file_name)))
+                cache_key = None
+
+        # a burst-gated capture keeps the mean power of the full capture, so even a relative threshold is known upfront
+        self.gated = isinstance(self.samples, burst_gating.GatedSamples)
+        if self.gated and threshold is None:
+            threshold = noise_threshold * self.samples.mean_power
+
+        # with pyramid, the min/max/mean power pyramid of the capture is loaded from its sidecar, or otherwise built while
+        # the packets are detected
+        self.pyramid = None
+        pyramid_builder = None
+        if pyramid:
+            self.pyramid = power_pyramid.load_pyramid(iq_samples_file_name)
+            if self.pyramid is None:
+                pyramid_builder = power_pyramid.PyramidBuilder(iq_samples_file_name, self.data_length)
+
+        if packet_indices is not None:
+            # the packets were already detected, e.g. by a worker process or in an earlier session, so there is nothing to compute
+            self.power_data = None
+            self.packet_start_indices, self.packet_end_indices = packet_indices
+        elif workers is not None and workers > 1:
+            # split the memory-mapped capture into segments that are processed concurrently, with max_memory shared
+            # between the workers
+            self.power_data = None
+            if max_memory is None:
+                chunk_size = SEGMENT_CHUNK_SIZE
+            else:
+                chunk_size = max(1, int(max_memory // (workers * STREAMING_BYTES_PER_SAMPLE)))
+            with instrumentation.stage("segment detection") as record:
+                self.packet_start_indices, self.packet_end_indices = detect_packets_in_segments(self.samples, noise_threshold,
+                    window_size, workers, chunk_size, pyramid_builder, threshold)
+                # one pass for the mean power, unless the threshold is absolute, and one for the packets
+                record["bytes_read"] = (1 if threshold is not None else 2) * self.samples.nbytes
+        elif max_memory is None:
+            # only a single float32 array is allocated for the power of the whole capture
+            with instrumentation.stage("power") as record:
+                if self.gated:
+                    # the samples between the segments are not stored, so they are filled in a chunk at a time
+                    self.power_data = np.empty(self.data_length, dtype=np.float32)
+                    for chunk_start in range(0, self.data_length, SEGMENT_CHUNK_SIZE):
+                        chunk_stop = min(chunk_start + SEGMENT_CHUNK_SIZE, self.data_length)
+                        power_envelope(self.samples[chunk_start:chunk_stop], out=self.power_data[chunk_start:chunk_stop])
+                else:
+                    self.power_data = power_envelope(self.samples)
+                record["bytes_read"] = self.samples.nbytes
+            if threshold is None:
+                with instrumentation.stage("threshold"):
+                    threshold = noise_threshold * np.mean(self.power_data, dtype=np.float64)
+
+            with instrumentation.stage("detection"):
+                detector = BurstDetector(threshold, window_size)
+                detector.feed(self.power_data)
+                self.packet_start_indices, self.packet_end_indices = detector.finish()
+            if pyramid_builder is not None:
+                with instrumentation.stage("power pyramid"):
+                    pyramid_segment = pyramid_builder.segment()
+                    pyramid_segment.feed(self.power_data)
+                    pyramid_segment.finish()
+        else:
+            # stream the capture in chunks that fit in max_memory bytes, keeping no per-sample data afterwards
+            self.power_data = None
+            chunk_size = max(1, int(max_memory // STREAMING_BYTES_PER_SAMPLE))
+
+            # a threshold relative to the mean power of the whole capture takes a first pass over the file
+            if threshold is None:
+                with instrumentation.stage("streaming threshold") as record:
+                    power_sum = 0.0
+                    for power_chunk in self.iter_power(chunk_size):
+                        power_sum += np.sum(power_chunk, dtype=np.float64)
+                    threshold = noise_threshold * power_sum / self.data_length
+                    record["bytes_read"] = self.samples.nbytes
+
+            with instrumentation.stage("streaming detection") as record:
+                detector = BurstDetector(threshold, window_size)
+                pyramid_segment = None if pyramid_builder is None else pyramid_builder.segment()
+                for power_chunk in self.iter_power(chunk_size):
+                    detector.feed(power_chunk)
+                    if pyramid_segment is not None:
+                        pyramid_segment.feed(power_chunk)
+                if pyramid_segment is not None:
+                    pyramid_segment.finish()
+                self.packet_start_indices, self.packet_end_indices = detector.finish()
+                record["bytes_read"] = self.samples.nbytes
+
+        if pyramid_builder is not None:
+            if packet_indices is not None:
+                # nothing was detected, so the power takes a pass of its own
+                with instrumentation.stage("power pyramid") as record:
+                    pyramid_segment = pyramid_builder.segment()
+                    for power_chunk in self.iter_power(SEGMENT_CHUNK_SIZE):
+                        pyramid_segment.feed(power_chunk)
+                    pyramid_segment.finish()
+                    record["bytes_read"] = self.samples.nbytes
+            self.pyramid = pyramid_builder.save()
+
+        if cache_key is not None:
+            with instrumentation.stage("save packet cache"):
+                save_packet_cache(iq_samples_file_name, cache_key, self.packet_start_indices, self.packet_end_indices)
+
+    def iter_power(self, chunk_size):
+        """Yields the power of consecutive chunks of the capture, as iter_power_chunks does"""
+        if self.gated:
+            return iter_power_segment(self.samples, 0, self.data_length, chunk_size)
+        return iter_power_chunks(self.file_name, chunk_size, self.sample_format)
+
+    def get_time(self, indices):
+        """Returns the time of the samples at the given indices"""
+        # the time axis spans the total duration, as np.linspace(0, duration, num=data_length) would
+        return np.asarray(indices) * (self.duration / max(self.data_length - 1, 1))
+
+    def get_sample_index(self, time_offset):
+        """Returns the index of the sample recorded time_offset seconds into the capture, without reading any samples"""
+        if self.metadata is not None:
+            # the capture segments of a SigMF recording say where the samples after a gap, e.g. of dropped samples, start
+            return min(sigmf_capture.get_sample_index(self.metadata, time_offset), self.data_length)
+        return min(int(round(time_offset*self.sample_rate)), self.data_length)
+
+    def get_packet_markers(self, start, stop):
+        """Returns the sorted indices of the first and last sample of every packet within [start:stop]"""
+        markers = []
+        for packet_indices in (self.packet_start_indices, self.packet_end_indices):
+            # the packet indices are sorted, so only the ones inside the window need to be looked at
+            first, last = np.searchsorted(packet_indices, [start, stop])
+            markers.append(packet_indices[first:last])
+        return np.sort(np.concatenate(markers))
+
+    def get_envelope(self, start, stop, num_buckets):
+        """Returns the indices and power of the weakest and strongest sample of each of up to num_buckets equal buckets of [start:stop]"""
+        # Keeping both extremes of every bucket preserves the peaks and the noise floor however many samples a bucket holds.
+        # They are read from the pyramid if there is one and it has a level that is fine enough, and otherwise the buckets
+        # are processed a chunk at a time, so any window takes the same memory
+        envelope = None if self.pyramid is None else self.pyramid.get_envelope(start, stop, num_buckets)
+        if envelope is not None:
+            centers, weakest, strongest, _ = envelope
+            return np.repeat(centers, 2), np.column_stack((weakest, strongest)).ravel()
+        bucket_size = -(-(stop - start) // num_buckets)
+        if bucket_size <= 2:
+            return np.arange(start, stop), self.get_power(start, stop)
+        chunk_size = bucket_size * max(1, SEGMENT_CHUNK_SIZE // bucket_size)
+        indices = []
+        for chunk_start in range(start, stop, chunk_size):
+            power = self.get_power(chunk_start, min(chunk_start + chunk_size, stop))
+            # only the last bucket of the window can be partial. It is padded with its own first sample, which changes
+            # neither of its extremes, since argmin and argmax return the first of equal values
+            num_chunk_buckets = -(-len(power) // bucket_size)
+            padding = num_chunk_buckets * bucket_size - len(power)
+            if padding > 0:
+                power = np.concatenate((power, np.full(padding, power[(num_chunk_buckets - 1) * bucket_size])))
+            buckets = power.reshape(num_chunk_buckets, bucket_size)
+            offsets = chunk_start + np.arange(num_chunk_buckets) * bucket_size
+            weakest = offsets + np.argmin(buckets, axis=1)
+            strongest = offsets + np.argmax(buckets, axis=1)
+            # in the order they occur, so that the line is drawn through them as it would be through all the samples
+            indices.append(np.column_stack((np.minimum(weakest, strongest), np.maximum(weakest, strongest))).ravel())
+        indices = np.concatenate(indices)
+        return indices, power_envelope(self.samples[indices])
+
+    def get_power(self, start, stop):
+        """Returns the power of the samples in [start:stop]"""
+        if self.power_data is not None:
+            return self.power_data[start:stop]
+        return power_envelope(self.samples[start:stop])
     
-    def plot(self, start = 0, num_samples = -1, filename = None):
-        matplotlib.rcParams['agg.path.chunksize'] = 10000
-        plt.figure()
-        plt.plot(self.time[start:num_samples], np.sqrt(self.power_data[start:num_samples]), 'b-', self.time[start:num_samples], self.packet_indicator[start:num_samples], 'r-')
-        plt.title("Plot of the magnitude of the signal vs Time")
-        plt.xlabel("Time (sec)")
-        plt.ylabel("Signal magnitude") #find out if the power is in Watts or dB?
+    def plot(self, start = 0, num_samples = -1, filename = None, num_buckets = 2000):
+        """Plots the magnitude of num_samples samples from start (all of them by default) with the start and end of every packet"""
+        start, stop, _ = slice(start, None if num_samples < 0 else start + num_samples).indices(self.data_length)
+        # the signal is drawn through the min/max envelope of num_buckets buckets, so any window takes at most
+        # 2 * num_buckets points, while the packet markers are drawn at their exact samples as a single path of
+        # vertical lines, separated by NaNs
+        indices, power = self.get_envelope(start, stop, num_buckets)
+        markers = self.get_time(self.get_packet_markers(start, stop))
+        marker_time = np.column_stack((markers, markers, np.full(len(markers), np.nan))).ravel()
+        marker_height = np.tile([0, 1, np.nan], len(markers))
+
+        # shown through pyplot, but saved from a Figure of its own, like the figures of Results.plot
+        figure = plt.figure() if filename is None else Figure()
+        axes = figure.gca()
+        axes.plot(self.get_time(indices), np.sqrt(power), 'b-', marker_time, marker_height, 'r-')
+        axes.set_title("Plot of the magnitude of the signal vs Time")
+        axes.set_xlabel("Time (sec)")
+        axes.set_ylabel("Signal magnitude") #find out if the power is in Watts or dB?
 
         if filename is None:
             plt.show()
         else:
-            plt.draw()
-            plt.savefig(filename)
-            plt.close()    
+            figure.savefig(filename)
+
+# The time from the start of the last capture that the signal plot shows, in seconds
+SIGNAL_PLOT_TIME = 5e-3
+
+# The file names of the figures written by Results.plot, formatted with the access category and the image format
+PLOT_FILE_NAMES = {
+    "interframe_spacing": "interframe_spacing_histogram_{}.{}",
+    "txop_durations": "txop_durations_histogram_{}.{}",
+    "bin_probability": "bin_probability_{}.{}",
+    "signal": "signal_magnitude_plot_{}.{}",
+}
+
+def get_plot_file_name(path, plot, access_category, image_format = "svg"):
+    return os.path.join(path, PLOT_FILE_NAMES[plot].format(access_category, image_format))
+
+def create_process_executor(processes = None):
+    """Returns a process pool for the packet detection of loadIqSamplesParallel or the figures of Results.plot_concurrently"""
+    # the workers are started afresh rather than forked, since forking a process that runs a Qt event loop is not safe
+    return concurrent.futures.ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn"))
+
+# The figures are drawn on their own Figure rather than through pyplot, which keeps global state and is not meant to be
+# used from several threads
+def plot_interframe_spacing_histogram(interframe_spacing, file_name):
+    figure = Figure()
+    axes = figure.gca()
+    axes.set_xlim((0,250))
+    axes.hist(interframe_spacing, bins=750)
+    axes.set_title("Histogram of the inter-frame spacing")
+    axes.set_xlabel("Inter-frame spacing (microsecond)")
+    axes.set_ylabel("Frequency")
+    figure.savefig(file_name)
+    return file_name
+
+def plot_txop_durations_histogram(txop_durations, txop_limit, file_name):
+    figure = Figure()
+    axes = figure.gca()
+    compliant_txop_durations = txop_durations[txop_durations < txop_limit*1e3]
+    violating_txop_durations = txop_durations[txop_durations >= txop_limit*1e3]
+    axes.hist(compliant_txop_durations, bins=50)
+    axes.hist(violating_txop_durations, bins=50, color='red')
+    axes.set_title("Histogram of the Txop durations")
+    axes.set_xlabel("Txop duration (milli second)")
+    axes.set_ylabel("Frequency")
+    Gender = ['Compliant Txop', 'Violating Txop']
+    axes.legend(Gender, loc=2)
+    figure.savefig(file_name)
+    return file_name
+
+def plot_bin_probability(backoff_bin_probabilities, p_max, kp1, file_name):
+    figure = Figure()
+    axes = figure.gca()
+    t = np.linspace(0, kp1-1, num=kp1)
+    axes.bar(t, backoff_bin_probabilities, color='b', width=0.25)
+    axes.bar(t+0.25, p_max, color='r', width=0.25)
+    axes.set_title("Bin Probability and Threshold")
+    axes.set_xlabel("Bin")
+    axes.set_ylabel("Probability")
+    Gender = ['Bin Probability', 'Compliance Upper threshold']
+    axes.legend(Gender, loc=2)
+    figure.savefig(file_name)
+    return file_name
+
+def plot_signal(iq_samples_file_name, sample_rate, sample_format, packet_indices, start, num_samples, file_name):
+    iqFile = IQSamplesFile(iq_samples_file_name, sample_rate=sample_rate, packet_indices=packet_indices, sample_format=sample_format)
+    iqFile.plot(start=start, num_samples=num_samples, filename=file_name)
+    return file_name
+
+def draw_plot(name, function, args, instrument = False):
+    """Draws one figure of Results.get_plots, e.g. in a worker process, and returns its file name and, if instrument is
+    set, the record of its stage"""
+    # a worker process has instrumentation switched off unless ANTS_INSTRUMENT is set, so the stage is recorded regardless
+    if not instrument:
+        return function(*args), None
+    records = []
+    with instrumentation.record_stage("plot " + name.replace("_", " "), records):
+        file_name = function(*args)
+    return file_name, records[0]
 
 class ANTS_Analyzer():
     class Stats():
@@ -87,14 +645,22 @@ class ANTS_Analyzer():
             self.max = max
             self.violations = violations
         
+    # One row per TXOP: the indices of its first and last packet, the number of packets, their total airtime and the
+    # TXOP duration including the IFSs between the packets (both in microseconds)
+    TXOP_DTYPE = np.dtype([('start', np.int64), ('end', np.int64), ('packets', np.int64), ('airtime', np.float64), ('duration', np.float64)])
+
     class Results():
         def __init__(self):
             self.interframe_spacing = None
             self.number_of_packets = None
             self.txop_durations = None
+            self.txops = None
             self.txop_stats = None
             self.backoff_stats = None
             self.backoff_bin_probabilities = None
+            # quantile sketches of the IFSs and TXOP durations, set by ANTS_Online_Analyzer instead of the full arrays
+            self.interframe_spacing_sketch = None
+            self.txop_sketch = None
 
             self.access_category = None
             self.txop_limit = None
@@ -109,6 +675,9 @@ class ANTS_Analyzer():
             self.geometric_factor = None
 
             self.last_iq_file = None
+
+            # the stages recorded by instrumentation up to the analysis, and those of plot, or None if it was disabled
+            self.instrumentation = None
         
         def to_string(self):
             results = dedent("""\
@@ -145,7 +714,7 @@ class ANTS_Analyzer():
                 results = results + "Backoff bin probability violation.\n"
             else:
                 results = results + "Backoff bin probability compliant.\n"
-            if any(self.txop_durations > self.txop_limit*1e3):
+            if self.txop_stats.violations > 0:
                 results = results + "Txop duration violation.\n"
             else:
                 results = results + "Txop duration compliant.\n"        
@@ -157,48 +726,56 @@ class ANTS_Analyzer():
             else:
                 submission = abs(self.aggressiveness_factor)*100
                 results = results + "{:.3f}% submissive / {:.3f}% compliant".format(submission, norm_factor_percent)
+
+            if self.txop_sketch is not None:
+                # known to within the relative accuracy of the sketches
+                percentiles = "/".join("{:g}th".format(100*q) for q in REPORTED_QUANTILES)
+                results = results + "\n\n{0} percentile IFS: {1}\n{0} percentile Txop: {2}".format(percentiles,
+                    " ".join("{:.3f}µs".format(self.interframe_spacing_sketch.quantile(q)) for q in REPORTED_QUANTILES),
+                    " ".join("{:.3f}µs".format(self.txop_sketch.quantile(q)) for q in REPORTED_QUANTILES))
             
             return results
         
-        def plot(self, path):
-            plt.figure(1)
-            plt.xlim((0,250))
-            plt.hist(self.interframe_spacing, bins=750)
-            plt.title("Histogram of the inter-frame spacing")
-            plt.xlabel("Inter-frame spacing (microsecond)")
-            plt.ylabel("Frequency")
-            plt.draw()
-            plt.savefig(os.path.join(path, 'interframe_spacing_histogram_{}.svg'.format(self.access_category)))
-            plt.close()
-        
-            plt.figure(2)
-            compliant_txop_durations = self.txop_durations[self.txop_durations < self.txop_limit*1e3]
-            violating_txop_durations = self.txop_durations[self.txop_durations >= self.txop_limit*1e3]
-            plt.hist(compliant_txop_durations, bins=50)
-            plt.hist(violating_txop_durations, bins=50, color='red')
-            plt.title("Histogram of the Txop durations")
-            plt.xlabel("Txop duration (milli second)")
-            plt.ylabel("Frequency")
-            Gender = ['Compliant Txop', 'Violating Txop']
-            plt.legend(Gender, loc=2)
-            plt.draw()
-            plt.savefig(os.path.join(path, 'txop_durations_histogram_{}.svg'.format(self.access_category)))
-            plt.close()
-
-            plt.figure(3)
-            t = np.linspace(0, self.kp1-1, num=self.kp1)
-            plt.bar(t, self.backoff_bin_probabilities, color='b', width=0.25)
-            plt.bar(t+0.25, self.p_max, color='r', width=0.25)
-            plt.title("Bin Probability and Threshold")
-            plt.xlabel("Bin")
-            plt.ylabel("Probability")
-            Gender = ['Bin Probability', 'Compliance Upper threshold']
-            plt.legend(Gender, loc=2)
-            plt.draw()
-            plt.savefig(os.path.join(path, 'bin_probability_{}.svg'.format(self.access_category)))
-            plt.close()
-
-            self.last_iq_file.plot(start = 0, num_samples = 100000, filename = os.path.join(path, "signal_magnitude_plot_{}.svg".format(self.access_category)))
+        def get_plots(self, path, image_format = "svg"):
+            """Returns the figures that plot writes, as a dict from their name to the function that draws one and its arguments"""
+            # the functions are module-level and their arguments plain data, so that they can also run in a worker process
+            plots = {}
+            if self.interframe_spacing is None or self.txop_durations is None:
+                # results computed from summaries only have the bin probabilities and the signal to plot
+                print("No IFS and TXOP durations available, skipping their histograms")
+            else:
+                plots["interframe_spacing"] = (plot_interframe_spacing_histogram, (self.interframe_spacing,
+                    get_plot_file_name(path, "interframe_spacing", self.access_category, image_format)))
+                plots["txop_durations"] = (plot_txop_durations_histogram, (self.txop_durations, self.txop_limit,
+                    get_plot_file_name(path, "txop_durations", self.access_category, image_format)))
+
+            plots["bin_probability"] = (plot_bin_probability, (self.backoff_bin_probabilities, self.p_max, self.kp1,
+                get_plot_file_name(path, "bin_probability", self.access_category, image_format)))
+
+            if self.last_iq_file is None:
+                print("No IQ samples available, skipping the signal magnitude plot")
+            else:
+                # only the packets within the plotted samples are handed over. The window is given in time and looked up in
+                # the index of the capture, which for a SigMF recording with gaps is not simply the time times the sample rate
+                start, stop = 0, self.last_iq_file.get_sample_index(SIGNAL_PLOT_TIME)
+                first = np.searchsorted(self.last_iq_file.packet_end_indices, start)
+                last = np.searchsorted(self.last_iq_file.packet_start_indices, stop)
+                packet_indices = (self.last_iq_file.packet_start_indices[first:last], self.last_iq_file.packet_end_indices[first:last])
+                plots["signal"] = (plot_signal, (self.last_iq_file.file_name, self.last_iq_file.sample_rate, self.last_iq_file.sample_format, packet_indices,
+                    start, stop - start, get_plot_file_name(path, "signal", self.access_category, image_format)))
+            return plots
+
+        def plot(self, path, image_format = "svg"):
+            """Writes the figures of the results to path, one after the other"""
+            for name, (function, args) in self.get_plots(path, image_format).items():
+                with instrumentation.stage("plot " + name.replace("_", " "), self.instrumentation):
+                    function(*args)
+
+        def plot_concurrently(self, path, executor, image_format = "svg"):
+            """Submits the figures of plot to executor, e.g. from create_process_executor, and returns a dict from their name to
+            the future of their file name and the record of their stage, which is None unless the results are instrumented"""
+            instrument = self.instrumentation is not None
+            return {name: executor.submit(draw_plot, name, function, args, instrument) for name, (function, args) in self.get_plots(path, image_format).items()}
             
     def __init__(self, uut_type, sample_rate = 20e6):
         self.uut_type = uut_type
@@ -207,31 +784,126 @@ class ANTS_Analyzer():
 
         self.packet_duration = None
         self.interframe_spacing = None
+        self.last_iq_file = None
+
+        # the packets of every capture added so far, in order, as dicts with the capture's file_name, run, data_length,
+        # packet_start_indices and packet_end_indices
+        self.packet_events = []
 
         self.sifs = 25
         self.slot = 9
 
-    def loadIqSamples(self, iq_samples_file_name, noise_threshold=0.02):
-        iqFile = IQSamplesFile(iq_samples_file_name, sample_rate=self.sample_rate, noise_threshold=noise_threshold)
+    def loadIqSamples(self, iq_samples_file_name, noise_threshold=0.02, max_memory=None, workers=None, threshold=None, sample_format="fc32"):
+        iqFile = IQSamplesFile(iq_samples_file_name, sample_rate=self.sample_rate, noise_threshold=noise_threshold, max_memory=max_memory, workers=workers, threshold=threshold, sample_format=sample_format)
+        self.addIqFile(iqFile)
+
+    def loadIqSamplesParallel(self, iq_samples_file_names, noise_threshold=0.02, max_memory=None, processes=None, threshold=None, sample_format="fc32"):
+        """Loads several captures like loadIqSamples, detecting the packets of each one in a separate worker process"""
+        # max_memory applies to each worker. The captures are still added in the given order, so the results are the same as
+        # loading them one by one. The stages of the workers are not recorded, only the time the detection and adding take in
+        # total. Each capture is added as soon as it and those before it are detected, and only as many captures as there
+        # are workers are detected ahead, so the packet indices of no more captures than that are held at once, which keeps
+        # the memory of ANTS_Online_Analyzer constant however many captures there are
+        # The workers are spawned, so a script that calls this must do so under if __name__ == "__main__"
+        num_ahead = processes or os.cpu_count() or 1
+        with create_process_executor(processes) as executor:
+            with instrumentation.stage("parallel detection") as record:
+                futures = collections.deque()
+                def add_next():
+                    detected_file_name, future = futures.popleft()
+                    self.addIqFile(IQSamplesFile(detected_file_name, sample_rate=self.sample_rate, packet_indices=future.result(),
+                        sample_format=sample_format))
+                for iq_samples_file_name in iq_samples_file_names:
+                    futures.append((iq_samples_file_name, executor.submit(detect_packets, iq_samples_file_name, self.sample_rate,
+                        noise_threshold, max_memory, threshold=threshold, sample_format=sample_format)))
+                    if len(futures) > num_ahead:
+                        add_next()
+                while futures:
+                    add_next()
+                record["bytes_read"] = sum(os.path.getsize(iq_samples_file_name) for iq_samples_file_name in iq_samples_file_names)
+
+    def addIqFile(self, iqFile):
+        self.addPackets(iqFile.access_category, iqFile.packet_start_indices, iqFile.packet_end_indices,
+            file_name=iqFile.file_name, run=int(iqFile.run), data_length=iqFile.data_length, sample_format=iqFile.sample_format)
+        self.last_iq_file = iqFile
+
+    def addPackets(self, access_category, packet_start_indices, packet_end_indices, file_name="", run=-1, data_length=-1, sample_format="fc32"):
+        """Adds the packets detected in one capture, given as their start and end sample indices"""
         if self.access_category is not None:
-            if self.access_category != iqFile.access_category:
+            if self.access_category != access_category:
                 raise Exception("ERROR: Cannot mix samples from different access categories")
         else:
-            self.set_access_category(iqFile.access_category)
+            self.set_access_category(access_category)
         
-        # calculate the interframe spacing by finding the time difference between the end and the start of each consecutive packets (in microseconds)
-        interframe_spacing = (1e6/self.sample_rate)*(iqFile.packet_start_indices[1:]-iqFile.packet_end_indices[0:-1])
-        packet_duration = (1e6/self.sample_rate)*(iqFile.packet_end_indices-iqFile.packet_start_indices)
-
-        print("Found {} packets with {} IFSs in between".format(len(packet_duration), len(interframe_spacing)))
-        if self.packet_duration is not None:
-            self.packet_duration = np.concatenate([self.packet_duration, packet_duration])
-            self.interframe_spacing = np.concatenate([self.interframe_spacing, [2 * self.sifs], interframe_spacing])
-        else:
-            self.packet_duration = packet_duration
-            self.interframe_spacing = interframe_spacing
+        with instrumentation.stage("interframe spacing"):
+            # calculate the interframe spacing by finding the time difference between the end and the start of each consecutive packets (in microseconds)
+            interframe_spacing = (1e6/self.sample_rate)*(packet_start_indices[1:]-packet_end_indices[0:-1])
+            packet_duration = (1e6/self.sample_rate)*(packet_end_indices-packet_start_indices)
 
-        self.last_iq_file = iqFile
+            print("Found {} packets with {} IFSs in between".format(len(packet_duration), len(interframe_spacing)))
+            if self.packet_duration is not None:
+                self.packet_duration = np.concatenate([self.packet_duration, packet_duration])
+                self.interframe_spacing = np.concatenate([self.interframe_spacing, [2 * self.sifs], interframe_spacing])
+            else:
+                self.packet_duration = packet_duration
+                self.interframe_spacing = interframe_spacing
+
+        self.packet_events.append({"file_name": file_name, "run": run, "data_length": data_length, "sample_format": sample_format,
+            "packet_start_indices": packet_start_indices, "packet_end_indices": packet_end_indices})
+
+    def exportPacketEvents(self, events_file_name):
+        """Writes the packets of all captures added so far to a compact columnar file that loadPacketEvents can read"""
+        # The packets of all runs are stored back to back, with run_offsets[i]:run_offsets[i+1] selecting the packets of run i.
+        # A packet is stored as its int64 start index and uint32 length in samples
+        packet_start_indices = np.concatenate([np.zeros(0, dtype=np.int64)] + [run["packet_start_indices"] for run in self.packet_events])
+        packet_end_indices = np.concatenate([np.zeros(0, dtype=np.int64)] + [run["packet_end_indices"] for run in self.packet_events])
+        packet_lengths = packet_end_indices - packet_start_indices
+        if len(packet_lengths) > 0 and np.max(packet_lengths) > np.iinfo(np.uint32).max:
+            raise Exception("ERROR: Packets longer than {} samples cannot be exported".format(np.iinfo(np.uint32).max))
+        run_offsets = np.cumsum([0] + [len(run["packet_start_indices"]) for run in self.packet_events])
+
+        with open(events_file_name, mode='wb') as file:
+            np.savez_compressed(file,
+                format_version=np.array(PACKET_EVENTS_VERSION),
+                sample_rate=np.array(self.sample_rate),
+                access_category=np.array(self.access_category),
+                uut_type=np.array(self.uut_type),
+                file_name=np.array([run["file_name"] for run in self.packet_events], dtype=str),
+                run=np.array([run["run"] for run in self.packet_events], dtype=np.int64),
+                data_length=np.array([run["data_length"] for run in self.packet_events], dtype=np.int64),
+                sample_format=np.array([run["sample_format"] for run in self.packet_events], dtype=str),
+                run_offsets=run_offsets.astype(np.int64),
+                packet_start=packet_start_indices.astype(np.int64),
+                packet_length=packet_lengths.astype(np.uint32))
+        print("Exported {} packets of {} runs to {}".format(len(packet_start_indices), len(self.packet_events), events_file_name))
+
+    def loadPacketEvents(self, events_file_name):
+        """Adds the runs of a file written by exportPacketEvents, as if their captures had been loaded in the same order"""
+        with np.load(events_file_name) as events:
+            if int(events["format_version"]) != PACKET_EVENTS_VERSION:
+                raise Exception("ERROR: Unsupported packet events format version {} in {}".format(int(events["format_version"]), events_file_name))
+            if float(events["sample_rate"]) != self.sample_rate:
+                raise Exception("ERROR: Packet events in {} were detected at a sample rate of {}, not {}".format(events_file_name, float(events["sample_rate"]), self.sample_rate))
+
+            access_category = str(events["access_category"])
+            run_offsets = events["run_offsets"]
+            packet_start = events["packet_start"]
+            packet_end = packet_start + events["packet_length"]
+            # files exported before captures could be recorded in other formats than fc32 do not list their formats
+            sample_formats = events["sample_format"] if "sample_format" in events.files else ["fc32"] * (len(run_offsets) - 1)
+            for i in range(len(run_offsets) - 1):
+                run_packets = slice(run_offsets[i], run_offsets[i+1])
+                self.addPackets(access_category, packet_start[run_packets], packet_end[run_packets],
+                    file_name=str(events["file_name"][i]), run=int(events["run"][i]), data_length=int(events["data_length"][i]),
+                    sample_format=str(sample_formats[i]))
+
+        # the raw capture of the last run is only needed for the signal plot, and may well have been deleted
+        last_run = self.packet_events[-1] if self.packet_events else None
+        if last_run is not None and os.path.exists(last_run["file_name"]):
+            self.last_iq_file = IQSamplesFile(last_run["file_name"], sample_rate=self.sample_rate,
+                packet_indices=(last_run["packet_start_indices"], last_run["packet_end_indices"]), sample_format=last_run["sample_format"])
+        else:
+            self.last_iq_file = None
 
     def get_results(self):        
         if self.packet_duration is None:
@@ -249,72 +921,52 @@ class ANTS_Analyzer():
             return
         results.number_of_packets = number_of_packets
 
-        COT = np.where(self.interframe_spacing > self.sifs)
-        COT = np.asarray(COT).T
+        with instrumentation.stage("txops"):
+            COT = np.flatnonzero(self.interframe_spacing > self.sifs)
 
-        print("Analyzing {} packets, {} IFSs, {} COTs".format(number_of_packets, interframe_spacing_length, len(COT)))
+            print("Analyzing {} packets, {} IFSs, {} COTs".format(number_of_packets, interframe_spacing_length, len(COT)))
 
-        max_packet_duration = max(self.packet_duration)
-        print("Max packet duration: {:.3f}µs".format(max_packet_duration))
-        txop_durations = []
-        # leave out last COT, it might be incomplete
-        for i in range(0, len(COT)-1):
-            start = COT[i][0]
-            end = COT[i+1][0]
-            # sum the packets and the IFSs _within_ the txop
-            txop_duration = np.sum(self.packet_duration[start+1 : end+1]) + np.sum(self.interframe_spacing[start+1 : end])
-            txop_durations.append(txop_duration)
-        txop_durations = np.array(txop_durations)
-        results.txop_durations = txop_durations
-
-        mean_txop = np.mean(txop_durations)
-        max_txop = np.max(txop_durations)
-        min_txop = np.min(txop_durations)
-        print("TXOP Min/Mean/Max: {:.3f}µs / {:.3f}µs / {:.3f}µs".format(min_txop, mean_txop, max_txop))
+            max_packet_duration = max(self.packet_duration)
+            print("Max packet duration: {:.3f}µs".format(max_packet_duration))
+            results.txops = self.get_txops(COT)
+            txop_durations = results.txops['duration']
+            results.txop_durations = txop_durations
+
+            mean_txop = np.mean(txop_durations)
+            max_txop = np.max(txop_durations)
+            min_txop = np.min(txop_durations)
+            print("TXOP Min/Mean/Max: {:.3f}µs / {:.3f}µs / {:.3f}µs".format(min_txop, mean_txop, max_txop))
         
-        if self.txop_limit == 0:
-            # no txop limit, no violations
-        	violating_durations = 0
-        else:
-        	violating_durations = np.count_nonzero(txop_durations > self.txop_limit * 1e3)
+            if self.txop_limit == 0:
+                # no txop limit, no violations
+            	violating_durations = 0
+            else:
+            	violating_durations = np.count_nonzero(txop_durations > self.txop_limit * 1e3)
 
-        results.txop_stats = ANTS_Analyzer.Stats(len(txop_durations), min_txop, mean_txop, max_txop, violating_durations)
-        txop_factor = violating_durations/len(txop_durations)
-        print("Found {:d} violating durations (> {:d}ms)".format(violating_durations, self.txop_limit))
+            results.txop_stats = ANTS_Analyzer.Stats(len(txop_durations), min_txop, mean_txop, max_txop, violating_durations)
+            txop_factor = violating_durations/len(txop_durations)
+            print("Found {:d} violating durations (> {:d}ms)".format(violating_durations, self.txop_limit))
 
-        if self.uut_type == "Supervising" and (self.access_category == "voice" or self.access_category == "video") :
-            correct_back_off = np.concatenate(np.where(self.interframe_spacing > self.sifs))
-        else:
-            correct_back_off = np.concatenate(np.where(self.interframe_spacing > (self.sifs + 2)))
-        
-        BFmin = self.aifs - self.slot/2
-        BFmax = self.aifs + self.slot*(self.n-1) + self.slot/2
-        BFmid = (BFmax + BFmin)/2
-
-        back_offs = self.interframe_spacing[correct_back_off]
-        results.backoff_stats = ANTS_Analyzer.Stats(len(back_offs), np.min(back_offs), np.mean(back_offs), np.max(back_offs), np.count_nonzero(back_offs > BFmax))
-        blen = len(back_offs)
-        b = np.asarray(np.zeros(self.n))
-        b2 = np.asarray(np.zeros(self.kp1))
-
-        for i in range(0, blen):
-        	x = back_offs[i]
-        	if x <= BFmin:
-        		b[0] = b[0] + 1
-        	elif x >= BFmax:
-        		b[self.n-1] = b[self.n-1] + 1
-        	else:
-        		index = math.ceil((x-BFmin)/self.slot)-1
-        		b[index] = b[index] + 1
-
-        	if x < self.mind:
-        		b2[0] = b2[0] + 1
-        	elif x >= self.maxd:
-        		b2[self.kp1-1] = b2[self.kp1-1] + 1
-        	else:
-        		index = math.ceil((x-self.mind)/self.slot)
-        		b2[index] = b2[index] + 1
+        with instrumentation.stage("backoffs"):
+            correct_back_off = np.concatenate(np.where(self.interframe_spacing > self.get_back_off_threshold()))
+
+            BFmin = self.aifs - self.slot/2
+            BFmax = self.aifs + self.slot*(self.n-1) + self.slot/2
+            BFmid = (BFmax + BFmin)/2
+
+            back_offs = self.interframe_spacing[correct_back_off]
+            results.backoff_stats = ANTS_Analyzer.Stats(len(back_offs), np.min(back_offs), np.mean(back_offs), np.max(back_offs), np.count_nonzero(back_offs > BFmax))
+            blen = len(back_offs)
+            b, b2 = self.bin_back_offs(back_offs)
 
+        with instrumentation.stage("compliance factors"):
+            self.set_compliance_factors(results, b, b2, blen, txop_factor)
+        results.instrumentation = instrumentation.get_stages()
+
+        return results
+
+    def set_compliance_factors(self, results, b, b2, blen, txop_factor):
+        """Computes the backoff distribution and compliance factors from the backoff bin counts and stores them in results"""
         prob = b/sum(b)
         nz_prob = prob[np.where(prob > 0)]
         backoff_kullback_leibler_divergence = sum(np.multiply(nz_prob, np.log10(nz_prob/(1/self.n))))
@@ -333,9 +985,7 @@ class ANTS_Analyzer():
 
         # Calculate the observed cumulative probabilities (p)
         e = blen  # total observed periods
-        p = np.asarray(np.zeros(self.kp1))
-        for i in range(0, self.kp1):
-            p[i] = ANTS_Analyzer.sum_range(b2, 0, i)/e
+        p = np.cumsum(b2)/e
 
         results.backoff_bin_probabilities = p    
         results.access_category = self.access_category
@@ -349,13 +999,48 @@ class ANTS_Analyzer():
         results.norm_factor = norm_factor
         results.geometric_factor = geometric_factor
 
-        return results
+    def get_txops(self, COT):
+        """Returns a TXOP_DTYPE table of the TXOPs between consecutive COTs (indices of IFSs longer than SIFS)"""
+        # cumulative sums with a leading 0, so that the sum of x[i:j] is x_sum[j] - x_sum[i]
+        packet_duration_sum = np.concatenate(([0], np.cumsum(self.packet_duration)))
+        interframe_spacing_sum = np.concatenate(([0], np.cumsum(self.interframe_spacing)))
+
+        # leave out last COT, it might be incomplete
+        start = COT[:-1] + 1
+        end = COT[1:]
+
+        txops = np.zeros(len(start), dtype=ANTS_Analyzer.TXOP_DTYPE)
+        txops['start'] = start
+        txops['end'] = end
+        txops['packets'] = end - start + 1
+        # sum the packets and the IFSs _within_ the txop
+        txops['airtime'] = packet_duration_sum[end + 1] - packet_duration_sum[start]
+        txops['duration'] = txops['airtime'] + interframe_spacing_sum[end] - interframe_spacing_sum[start]
+        return txops
+
+    def get_back_off_threshold(self):
+        """Returns the IFS (in microseconds) above which an IFS counts as a backoff"""
+        if self.uut_type == "Supervising" and (self.access_category == "voice" or self.access_category == "video") :
+            return self.sifs
+        else:
+            return self.sifs + 2
+
+    def bin_back_offs(self, back_offs):
+        """Counts the backoffs per contention window slot (b) and per cumulative probability bin (b2)"""
+        BFmin = self.aifs - self.slot/2
+        BFmax = self.aifs + self.slot*(self.n-1) + self.slot/2
+
+        # backoffs up to BFmin go to the first slot and backoffs from BFmax on to the last one
+        index = np.ceil((back_offs - BFmin)/self.slot) - 1
+        index = np.where(back_offs <= BFmin, 0, np.where(back_offs >= BFmax, self.n - 1, index))
+        b = np.bincount(index.astype(np.int64), minlength=self.n)
+
+        # backoffs below mind go to the first bin and backoffs from maxd on to the last one
+        index = np.ceil((back_offs - self.mind)/self.slot)
+        index = np.where(back_offs < self.mind, 0, np.where(back_offs >= self.maxd, self.kp1 - 1, index))
+        b2 = np.bincount(index.astype(np.int64), minlength=self.kp1)
 
-    def sum_range(l,a,b):
-        sum = 0
-        for i in range(a, b+1,1):
-            sum += l[i]
-        return sum
+        return b, b2
 
     def set_access_category(self, access_category):
         """Sets the parameters that depend on the access category"""
@@ -0,0 +1,98 @@
+import json
+import os
+import numpy as np
+
+# A burst-gated capture only stores the samples of segments around its packets, back to back in place of the full capture,
+# and a .segments.npz sidecar maps them back to their positions in the full capture. It also keeps the mean power of the
+# full capture, which the detection threshold is relative to. The sidecar identifies the gated file it belongs to, so a
+# capture that is recorded again under the same name is read in full
+GATED_VERSION = 1
+
+def get_segments_file_name(iq_samples_file_name):
+    return iq_samples_file_name + ".segments.npz"
+
+def get_gated_key(iq_samples_file_name):
+    stat = os.stat(iq_samples_file_name)
+    return json.dumps({"version": GATED_VERSION, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}, sort_keys=True)
+
+def get_segments(packet_start_indices, packet_end_indices, data_length, pre_guard, post_guard):
+    """Returns the start and length of the segments that keep pre_guard samples before and post_guard samples after every
+    packet, with segments that overlap or touch merged"""
+    segment_starts = np.maximum(np.asarray(packet_start_indices, dtype=np.int64) - pre_guard, 0)
+    segment_ends = np.minimum(np.asarray(packet_end_indices, dtype=np.int64) + 1 + post_guard, data_length)
+    if len(segment_starts) == 0:
+        return segment_starts, segment_ends
+    # the packets are in order, so a segment only overlaps a later one if it reaches past its start
+    segment_ends = np.maximum.accumulate(segment_ends)
+    new_segment = np.concatenate(([True], segment_starts[1:] > segment_ends[:-1]))
+    last_of_segment = np.concatenate((new_segment[1:], [True]))
+    segment_starts = segment_starts[new_segment]
+    return segment_starts, segment_ends[last_of_segment] - segment_starts
+
+class GatedSamples():
+    """The samples of a burst-gated capture, read like the memory-mapped samples of the full capture. The samples between
+    the segments read as zeros"""
+    def __init__(self, data, segment_starts, segment_lengths, data_length, mean_power):
+        self.data = data
+        self.segment_starts = segment_starts
+        self.segment_ends = segment_starts + segment_lengths
+        self.segment_offsets = np.concatenate(([0], np.cumsum(segment_lengths)[:-1])).astype(np.int64)
+        self.mean_power = mean_power
+        self.dtype = data.dtype
+        self.shape = (data_length,) + data.shape[1:]
+        # only the stored samples are ever read
+        self.nbytes = data.nbytes
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                raise Exception("ERROR: Gated samples can only be sliced contiguously")
+            samples = np.zeros((max(stop - start, 0),) + self.shape[1:], dtype=self.dtype)
+            for segment in range(np.searchsorted(self.segment_ends, start, side='right'), np.searchsorted(self.segment_starts, stop)):
+                copy_start = max(start, self.segment_starts[segment])
+                copy_stop = min(stop, self.segment_ends[segment])
+                offset = self.segment_offsets[segment] + copy_start - self.segment_starts[segment]
+                samples[copy_start - start:copy_stop - start] = self.data[offset:offset + copy_stop - copy_start]
+            return samples
+        indices = np.asarray(key, dtype=np.int64)
+        segments = np.maximum(np.searchsorted(self.segment_starts, indices, side='right') - 1, 0)
+        in_segment = (indices >= self.segment_starts[segments]) & (indices < self.segment_ends[segments]) if len(self.segment_starts) > 0 else np.zeros(len(indices), dtype=bool)
+        samples = np.zeros((len(indices),) + self.shape[1:], dtype=self.dtype)
+        segments = segments[in_segment]
+        samples[in_segment] = self.data[self.segment_offsets[segments] + indices[in_segment] - self.segment_starts[segments]]
+        return samples
+
+def load_gated_samples(iq_samples_file_name, sample_format, sample_dtype):
+    """Returns the samples of a burst-gated capture, or None if it is not gated or its sidecar does not belong to it"""
+    try:
+        with np.load(get_segments_file_name(iq_samples_file_name)) as segments:
+            if str(segments["key"]) != get_gated_key(iq_samples_file_name):
+                return None
+            if str(segments["sample_format"]) != sample_format:
+                raise Exception("ERROR: {} was gated in {}, not {}".format(iq_samples_file_name, str(segments["sample_format"]), sample_format))
+            segment_starts = segments["segment_starts"]
+            segment_lengths = segments["segment_lengths"]
+            data_length = int(segments["data_length"])
+            mean_power = float(segments["mean_power"])
+    except (OSError, ValueError, KeyError):
+        return None
+    num_stored = int(np.sum(segment_lengths))
+    if num_stored == 0:
+        data = np.zeros((0,) + sample_dtype.shape, dtype=sample_dtype.base)
+    else:
+        data = np.memmap(iq_samples_file_name, dtype=sample_dtype, mode='r', shape=(num_stored,))
+    return GatedSamples(data, segment_starts, segment_lengths, data_length, mean_power)
+
+def save_segments(iq_samples_file_name, gated_file_name, sample_format, segment_starts, segment_lengths, data_length, mean_power):
+    """Writes the sidecar of gated_file_name, which will take the place of iq_samples_file_name"""
+    # renaming keeps the size and modification time of the gated file, so the key already matches it once it is in place
+    segments_file_name = get_segments_file_name(iq_samples_file_name)
+    with open(segments_file_name + ".tmp", mode='wb') as file:
+        np.savez(file, key=np.array(get_gated_key(gated_file_name)), sample_format=np.array(sample_format),
+            segment_starts=segment_starts, segment_lengths=segment_lengths, data_length=np.array(data_length),
+            mean_power=np.array(mean_power))
+    os.replace(segments_file_name + ".tmp", segments_file_name)
@@ -0,0 +1,93 @@
+import datetime
+import json
+import os
+import select
+import socket
+import time
+from sigmf_capture import DATETIME_FORMAT
+
+# Requests captures from capture_daemon.py, which keeps the USRP streaming between them
+
+class DaemonConnection():
+    """One command sent to the daemon, and its replies, each a line of JSON"""
+    def __init__(self, socket_name, command):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(socket_name)
+        self.socket.sendall((json.dumps(command) + "\n").encode())
+        self.buffer = b""
+
+    def read_reply(self, block = True):
+        """Returns the next reply, or None if block is False and it has not arrived yet"""
+        while b"\n" not in self.buffer:
+            if not block and not select.select([self.socket], [], [], 0)[0]:
+                return None
+            data = self.socket.recv(4096)
+            if not data:
+                raise Exception("ERROR: The capture daemon closed the connection without replying")
+            self.buffer += data
+        line, self.buffer = self.buffer.split(b"\n", 1)
+        reply = json.loads(line.decode())
+        if reply["status"] == "error":
+            self.close()
+            raise Exception(reply["message"])
+        return reply
+
+    def close(self):
+        self.socket.close()
+
+class Capture():
+    """A capture in progress in the daemon, which is polled like the writeIQ.py subprocess it replaces"""
+    def __init__(self, connection):
+        self.connection = connection
+        started = connection.read_reply()
+        self.start_time = datetime.datetime.strptime(started["start_time"], DATETIME_FORMAT)
+        self.result = None
+
+    def poll(self):
+        """Returns None while the capture is running, and then the reply of the daemon, with the number of samples written"""
+        if self.result is None:
+            self.result = self.connection.read_reply(block=False)
+            if self.result is not None:
+                self.connection.close()
+        return self.result
+
+    def wait(self):
+        if self.result is None:
+            self.result = self.connection.read_reply()
+            self.connection.close()
+        return self.result
+
+def send_command(socket_name, command):
+    connection = DaemonConnection(socket_name, command)
+    try:
+        return connection.read_reply()
+    finally:
+        connection.close()
+
+def start_capture(socket_name, file_name, duration = None, num_samples = None, center_frequency = None, gain = None, sample_format = None):
+    """Starts writing the next duration seconds or num_samples samples to file_name, at center_frequency (in GHz) and gain
+    unless they are None, and returns the Capture once the file is open"""
+    command = {"command": "capture", "file_name": os.path.abspath(file_name)}
+    for key, value in (("duration", duration), ("num_samples", num_samples), ("center_frequency", center_frequency), ("gain", gain), ("sample_format", sample_format)):
+        if value is not None:
+            command[key] = value
+    return Capture(DaemonConnection(socket_name, command))
+
+def get_status(socket_name):
+    """Returns the source, sample format, center frequency and gain of the daemon"""
+    return send_command(socket_name, {"command": "status"})
+
+def shutdown(socket_name):
+    send_command(socket_name, {"command": "shutdown"})
+
+def wait_for_daemon(socket_name, is_running, timeout = 60):
+    """Waits until the daemon takes commands, which is once it has opened and configured the USRP"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if not is_running():
+            raise Exception("ERROR: The capture daemon stopped before taking any commands")
+        try:
+            return get_status(socket_name)
+        except (FileNotFoundError, ConnectionRefusedError):
+            time.sleep(0.1)
+    raise Exception("ERROR: The capture daemon did not take commands within {}s".format(timeout))
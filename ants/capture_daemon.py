@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+
+# The capture daemon keeps one GNU Radio flowgraph running from the USRP, configured once, and only writes its samples to
+# a file while a capture is requested. writeIQ.py instead imports GNU Radio, opens the USRP and sets its frequency, gain
+# and bandwidth again for every run, which takes seconds each time. Captures are requested over a Unix socket with one
+# JSON command per connection, and the daemon replies with one JSON line when the capture starts and another when its
+# file is complete (see capture_client.py)
+
+import argparse
+import datetime
+import json
+import os
+import socket
+import time
+from gnuradio import gr
+from gnuradio import blocks
+from sigmf_capture import DATETIME_FORMAT
+from writeIQ import ITEM_SIZES, SAMPLE_RATE, make_usrp_source
+
+# How often the size of a capture file is checked while waiting for it
+POLL_INTERVAL = 0.01
+
+class CaptureFlowgraph(gr.top_block):
+    """Streams the samples of a source into a file sink that has no file open between captures
+
+    The source is the USRP, or for testing without one, a null source or a file source played back in a loop, both
+    throttled to the sample rate of the USRP."""
+    def __init__(self, source, center_frequency, gain, sample_format = "fc32", source_file_name = None):
+        gr.top_block.__init__(self)
+        if sample_format not in ITEM_SIZES:
+            raise Exception("ERROR: Unknown sample format {}".format(sample_format))
+        self.source_name = source
+        self.sample_format = sample_format
+        self.item_size = ITEM_SIZES[sample_format]
+        self.center_frequency = None
+        self.gain = None
+
+        if source == "usrp":
+            self.source = make_usrp_source(sample_format)
+        elif source == "null":
+            self.source = blocks.null_source(self.item_size)
+        elif source == "file":
+            if source_file_name is None:
+                raise Exception("ERROR: A file source needs the name of the file to play back")
+            self.source = blocks.file_source(self.item_size, source_file_name, True)
+        else:
+            raise Exception("ERROR: Unknown source {}, expected usrp, null or file".format(source))
+        self.configure(center_frequency, gain)
+
+        # the file sink drops the samples while it has no file open, so it is opened on a dummy file and closed again
+        self.fileSnk = blocks.file_sink(self.item_size, os.devnull, False)
+        self.fileSnk.close()
+        if source == "usrp":
+            self.connect((self.source, 0), (self.fileSnk, 0))
+        else:
+            self.throttle = blocks.throttle(self.item_size, SAMPLE_RATE)
+            self.connect((self.source, 0), (self.throttle, 0), (self.fileSnk, 0))
+
+    def configure(self, center_frequency = None, gain = None):
+        """Tunes the USRP to center_frequency (in GHz) and sets its gain (in dB), unless they are None or already set"""
+        if center_frequency is not None and float(center_frequency) != self.center_frequency:
+            self.center_frequency = float(center_frequency)
+            print("Set center frequency to {} GHz".format(self.center_frequency))
+            if self.source_name == "usrp":
+                self.source.set_center_freq(self.center_frequency*1e9, 0)
+        if gain is not None and float(gain) != self.gain:
+            self.gain = float(gain)
+            print("Set gain to {}".format(self.gain))
+            if self.source_name == "usrp":
+                self.source.set_gain(self.gain, 0)
+
+    def capture(self, file_name, duration = None, num_samples = None, on_start = None):
+        """Writes the samples of the next duration seconds, or exactly the next num_samples samples, to file_name and
+        returns the number of samples written. on_start is called with the UTC start time once the file is open"""
+        if (duration is None) == (num_samples is None):
+            raise Exception("ERROR: A capture needs either a duration or a number of samples")
+        self.fileSnk.open(file_name)
+        start_time = datetime.datetime.utcnow()
+        if on_start is not None:
+            on_start(start_time)
+        if duration is not None:
+            time.sleep(duration)
+        else:
+            while os.path.getsize(file_name) < num_samples*self.item_size:
+                time.sleep(POLL_INTERVAL)
+        self.fileSnk.close()
+        wait_until_complete(file_name)
+        if num_samples is not None:
+            # the sink writes whole buffers, so the capture ends with a few samples too many
+            with open(file_name, "r+b") as capture_file:
+                capture_file.truncate(num_samples*self.item_size)
+        return os.path.getsize(file_name) // self.item_size
+
+def wait_until_complete(file_name):
+    # The sink closes the file the next time it is handed samples, which at the sample rate of the USRP is well within a
+    # poll interval, so once the file stops growing it is complete
+    size = -1
+    while os.path.getsize(file_name) != size:
+        size = os.path.getsize(file_name)
+        time.sleep(POLL_INTERVAL)
+
+def send_reply(connection, reply):
+    connection.sendall((json.dumps(reply) + "\n").encode())
+
+def handle_command(flowgraph, connection, command):
+    """Carries out one command and sends its replies, and returns False once the daemon is to shut down"""
+    name = command.get("command")
+    if name == "capture":
+        sample_format = command.get("sample_format", flowgraph.sample_format)
+        if sample_format != flowgraph.sample_format:
+            raise Exception("ERROR: The capture daemon writes {} samples, not {}".format(flowgraph.sample_format, sample_format))
+        flowgraph.configure(command.get("center_frequency"), command.get("gain"))
+        print("Write IQ samples to {}".format(command["file_name"]))
+        on_start = lambda start_time: send_reply(connection, {"status": "started", "start_time": start_time.strftime(DATETIME_FORMAT)})
+        num_samples = flowgraph.capture(command["file_name"], command.get("duration"), command.get("num_samples"), on_start)
+        print("Finished writing {} samples to {}".format(num_samples, command["file_name"]))
+        send_reply(connection, {"status": "done", "file_name": command["file_name"], "num_samples": num_samples})
+    elif name == "status":
+        send_reply(connection, {"status": "idle", "source": flowgraph.source_name, "sample_format": flowgraph.sample_format,
+            "center_frequency": flowgraph.center_frequency, "gain": flowgraph.gain})
+    elif name == "shutdown":
+        send_reply(connection, {"status": "stopped"})
+        return False
+    else:
+        raise Exception("ERROR: Unknown command {}".format(name))
+    return True
+
+def serve(flowgraph, socket_name):
+    """Carries out the commands sent to socket_name one connection at a time, until told to shut down"""
+    if os.path.exists(socket_name):
+        os.remove(socket_name)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_name)
+    server.listen(1)
+    print("Waiting for captures on {}".format(socket_name))
+    try:
+        running = True
+        while running:
+            connection, _ = server.accept()
+            try:
+                command = json.loads(connection.makefile("r").readline())
+                running = handle_command(flowgraph, connection, command)
+            except Exception as e:
+                print(e)
+                send_reply(connection, {"status": "error", "message": str(e)})
+            finally:
+                connection.close()
+    finally:
+        server.close()
+        os.remove(socket_name)
+
+def main():
+    # e.g. ./capture_daemon.py /tmp/ants_capture.sock --center-frequency 5.180 --gain 40 --sample-format sc16
+    parser = argparse.ArgumentParser(description="Keeps the USRP streaming and writes its samples to a file on request.")
+    parser.add_argument("socket_name", help="the Unix socket to take capture commands on")
+    parser.add_argument("--center-frequency", type=float, default=5.18, help="in GHz (default: %(default)s)")
+    parser.add_argument("--gain", type=float, default=40, help="in dB (default: %(default)s)")
+    parser.add_argument("--sample-format", choices=sorted(ITEM_SIZES), default="fc32")
+    parser.add_argument("--source", choices=["usrp", "null", "file"], default="usrp",
+        help="the USRP, or a null source or a file played back in a loop to test without one (default: %(default)s)")
+    parser.add_argument("--source-file", help="the samples to play back with --source file")
+    args = parser.parse_args()
+
+    flowgraph = CaptureFlowgraph(args.source, args.center_frequency, args.gain, args.sample_format, args.source_file)
+    flowgraph.start()
+    try:
+        serve(flowgraph, args.socket_name)
+    finally:
+        flowgraph.stop()
+        flowgraph.wait()
+
+if __name__ == "__main__":
+    main()
@@ -9,6 +9,11 @@ import queue
 import os
 import datetime
 import statistics as stat
+import noise_floor
+import capture_client
+import sigmf_capture
+from follow_capture import CaptureFollower
+from monitor import ANTS_Monitor
 from network_connect import *
 from setup_routing import *
 from ipaddress import *
@@ -44,6 +49,8 @@ class ANTS_Controller():
 
         # The sample rate in 20MS/s
         self.usrp_sample_rate = '20'
+        # The format the USRP writes the samples in: "fc32", or "sc16" and "sc8" for a half and a quarter of the disk space
+        self.sample_format = "fc32"
         self.ursp_gain = '40'
 
         # Output/conversion file name. Set to "no_name" as default in case the
@@ -65,6 +72,48 @@ class ANTS_Controller():
         self.num_runs = 1
         self.ping_max = 10
 
+        # Whether to detect packets while the USRP is still writing the IQ samples, and the packet start and end indices
+        # found that way for each IQ sample file
+        self.follow_capture = False
+        self.iq_packet_indices = {}
+
+        # Whether to replace each capture with only the samples around its packets once they are detected, and the number of
+        # samples kept before and after every packet
+        self.burst_gating = False
+        self.gating_guard = (400, 400)
+
+        # The container the captures are written in: "bin" for the raw samples alone, or "sigmf" for the samples in a
+        # .sigmf-data file next to a .sigmf-meta file that records how and when they were captured (see sigmf_capture.py)
+        self.capture_container = "bin"
+
+        # Whether to capture through capture_daemon.py, which keeps the USRP open and configured between runs, instead of
+        # starting writeIQ.py for every run. The daemon reads from the USRP unless capture_source is "null" or "file"
+        self.capture_daemon = False
+        self.capture_daemon_socket = os.path.join(self.working_dir, "capture_daemon.sock")
+        self.capture_source = "usrp"
+        self.capture_source_file = None
+        self.capture_daemon_proc = None
+
+        # The sliding windows, in seconds, over which continuous monitoring reports compliance
+        self.monitor_windows = (10, 60)
+        # How long the medium is monitored for, in seconds, unless the monitor is stopped before, and the running monitor
+        self.monitor_time = 600
+        self.monitor = None
+
+        # Whether to record the time and memory taken by each stage of the analysis, written to the data directory
+        self.instrument = False
+
+        # The image format of the plots of the results, "svg" or "png"
+        self.plot_format = "svg"
+
+        # The noise-floor profiles of the rig, by gain and center frequency. Once the current gain and center frequency
+        # are calibrated, packets are detected with an absolute threshold above the noise floor instead of one relative
+        # to the mean power of each capture
+        self.rig_name = noise_floor.get_rig_name()
+        self.noise_floor_file_name = os.path.abspath(os.path.join(self.working_dir, "..", "tests", "noise_floor.json"))
+        self.noise_floor_margin = noise_floor.DEFAULT_MARGIN_DB
+        self.calibration_time = 0.1
+
     def __set_access_category(self, x):
         if x == 0:
             self.access_category_name = "voice"
@@ -117,7 +166,7 @@ class ANTS_Controller():
         print("The binary data file will be written to {0}.".format(self.data_dir))
 
         # Create the argument list to pass to the USRP subprocess that will be instantiated
-        usrp_control_args = ["python", self.working_dir + "/writeIQ.py", self.get_iq_file_name(self.data_dir), str(self.run_time), self.center_frequency, self.usrp_gain]
+        usrp_control_args = ["python", self.working_dir + "/writeIQ.py", self.get_iq_file_name(self.data_dir), str(self.run_time), self.center_frequency, self.usrp_gain, self.sample_format]
         # Run the USRP process with the necessary arguments
         self.usrp_proc = subprocess.Popen(usrp_control_args)
         while self.usrp_proc.poll() is None:
@@ -125,6 +174,81 @@ class ANTS_Controller():
 
         print("Done sensing medium\n")
 
+    # Captures calibration_time seconds of the idle channel, without any iperf traffic, and saves its noise floor as the
+    # profile of the rig at the current gain and center frequency
+    def calibrate_noise_floor(self):
+        print("Calibrating the noise floor at {} GHz with a gain of {}...\n".format(self.center_frequency, self.usrp_gain))
+
+        calibration_dir = os.path.dirname(self.noise_floor_file_name)
+        if not os.path.exists(calibration_dir):
+            os.makedirs(calibration_dir)
+        iq_file_name = os.path.join(calibration_dir, "noise_floor.bin")
+        usrp_control_args = ["python", self.working_dir + "/writeIQ.py", iq_file_name, str(self.calibration_time), self.center_frequency, self.usrp_gain, self.sample_format]
+        self.usrp_proc = subprocess.Popen(usrp_control_args)
+        if self.usrp_proc.wait() != 0 or not os.path.exists(iq_file_name):
+            raise Exception("ERROR: The USRP did not capture the idle channel, writeIQ.py exited with {}".format(self.usrp_proc.returncode))
+
+        profile = noise_floor.measure_noise_floor(iq_file_name, self.rig_name, self.usrp_gain, self.center_frequency,
+            sample_rate=float(self.usrp_sample_rate)*1e6, sample_format=self.sample_format)
+        noise_floor.save_profile(self.noise_floor_file_name, profile)
+        os.remove(iq_file_name)
+        return profile
+
+    # Returns the absolute detection threshold from the noise floor of the current gain and center frequency, or None if
+    # they were never calibrated, in which case the threshold is relative to the mean power of each capture
+    def get_detection_threshold(self):
+        profile = noise_floor.get_profile(self.noise_floor_file_name, self.rig_name, self.usrp_gain, self.center_frequency)
+        if profile is None:
+            print("No noise floor calibrated for {}, the detection threshold is relative to the mean power of each capture".format(
+                noise_floor.get_profile_key(self.rig_name, self.usrp_gain, self.center_frequency)))
+            return None
+        return noise_floor.get_threshold(profile, self.noise_floor_margin)
+
+    # Runs the USRP for monitor_time seconds and monitors the compliance of the medium over sliding windows while it runs,
+    # calling on_report with the latest results of every window. The IQ samples go through a FIFO instead of a file, so
+    # nothing but the latest results is written to disk
+    def start_usrp_monitor(self, on_report = None):
+        print("Monitoring the medium with the USRP...\n")
+
+        # the monitor runs unattended, so it only runs with an absolute threshold above the calibrated noise floor
+        threshold = self.get_detection_threshold()
+        if threshold is None:
+            raise Exception("ERROR: Calibrate the noise floor at {} GHz with a gain of {} before monitoring".format(self.center_frequency, self.usrp_gain))
+
+        self.data_dir = self.make_data_dir()
+        fifo_name = os.path.join(self.data_dir, "iqsamples_" + self.access_category_name + ".fifo")
+        os.mkfifo(fifo_name)
+        status_file_name = os.path.join(self.data_dir, "monitor_status_" + self.access_category_name + ".json")
+        print("The monitoring status will be written to {0}.".format(status_file_name))
+
+        # the monitor exists before the USRP starts, so that stop_usrp_monitor can always stop it
+        self.monitor = ANTS_Monitor(self.UUT_type, self.access_category_name, threshold, sample_rate=float(self.usrp_sample_rate)*1e6,
+            windows=self.monitor_windows, status_file_name=status_file_name,
+            sample_format=self.sample_format, on_report=on_report)
+        try:
+            usrp_control_args = ["python", self.working_dir + "/writeIQ.py", fifo_name, str(self.monitor_time), self.center_frequency, self.usrp_gain, self.sample_format]
+            self.usrp_proc = color_subprocess.Popen(usrp_control_args, prefix='USRP:        ', color=color_subprocess.colors.fg.lightgreen)
+            # if writeIQ.py fails before it opens the FIFO, the monitor stops waiting for it once it has exited
+            self.monitor.run(fifo_name, is_writing=lambda: self.usrp_proc.getProcess().poll() is None)
+            results = self.monitor.results
+        finally:
+            self.monitor = None
+            if self.usrp_proc is not None and self.usrp_proc.getProcess().poll() is None:
+                self.usrp_proc.terminate()
+            os.remove(fifo_name)
+
+        print("Done monitoring the medium\n")
+        return results
+
+    # Stops monitoring the medium before monitor_time has passed. The USRP is stopped, which ends the stream of samples
+    def stop_usrp_monitor(self):
+        monitor = self.monitor
+        if monitor is None:
+            return
+        monitor.stop()
+        if self.usrp_proc is not None and self.usrp_proc.getProcess().poll() is None:
+            self.usrp_proc.terminate()
+
     # Runs the USRP and iperf tools simultaneously
     def start_usrp_iperf(self):
         print("Running USRP with interference injected using iperf...")
@@ -193,6 +317,11 @@ class ANTS_Controller():
         # The arguments to run the iperf server
         iperf_server_args = ["iperf", "-B", "{0}".format(str(self.iperf_server_addr)), "-s", "-u", "-t 1000000000000000", "-i 1"]
         iq_sample_files = []
+        # Captures can only be followed with an absolute threshold above the calibrated noise floor, otherwise they are
+        # detected once they are analyzed, relative to the mean power of the whole capture
+        follow_threshold = self.get_detection_threshold() if self.follow_capture else None
+        if self.follow_capture and follow_threshold is None:
+            print("WARNING: Not analyzing while capturing, calibrate the noise floor to do so. The captures are analyzed once they are complete")
         if self.communication_success:
             # Run the iperf commands and print debug information
             print("iperf server IP is {0}".format(self.iperf_server_addr))
@@ -205,15 +334,33 @@ class ANTS_Controller():
                 time.sleep(self.usrp_run_delay)
                 iq_file_name = self.get_iq_file_name(self.data_dir, run)
                 # Set the arguments to be used to run the USRP
-                usrp_control_args = ["python", self.working_dir + "/writeIQ.py", iq_file_name, str(self.run_time), self.center_frequency, self.usrp_gain]
-                # Start the USRP
-                self.usrp_proc = color_subprocess.Popen(usrp_control_args, prefix='USRP:        ', color=color_subprocess.colors.fg.lightgreen)
+                if self.capture_daemon:
+                    # the daemon starts writing the samples as soon as it is asked to, and knows when it did
+                    capture = self.start_daemon_capture(iq_file_name)
+                    start_time = capture.start_time
+                    usrp_running = lambda: capture.poll() is None
+                else:
+                    # Set the arguments to be used to run the USRP
+                    usrp_control_args = ["python", self.working_dir + "/writeIQ.py", iq_file_name, str(self.run_time), self.center_frequency, self.usrp_gain, self.sample_format]
+                    # the start time is taken just before the USRP starts, which is as close as the controller gets to its first sample
+                    start_time = datetime.datetime.utcnow()
+                    # Start the USRP
+                    self.usrp_proc = color_subprocess.Popen(usrp_control_args, prefix='USRP:        ', color=color_subprocess.colors.fg.lightgreen)
+                    usrp_running = lambda: self.usrp_proc.getProcess().poll() is None
+                if self.capture_container == "sigmf":
+                    sigmf_capture.write_metadata(iq_file_name, float(self.usrp_sample_rate)*1e6, self.sample_format, self.center_frequency,
+                        self.usrp_gain, self.access_category_name, run, start_time=start_time)
+                if follow_threshold is not None:
+                    # Detect packets in the IQ samples as they are written, until the USRP has stopped
+                    follower = CaptureFollower(iq_file_name, follow_threshold, sample_rate=float(self.usrp_sample_rate)*1e6,
+                        sample_format=self.sample_format)
+                    self.iq_packet_indices[iq_file_name] = follower.follow(usrp_running)
+                    iq_sample_files.append(iq_file_name)
+                    continue
                 # Continuously check to see if the USRP is running, then break out when it has stopped
-                while True:
-                    self.usrp_proc.getProcess().poll()
-                    if self.usrp_proc.getProcess().returncode is not None:
-                        iq_sample_files.append(iq_file_name)
-                        break
+                while usrp_running():
+                    continue
+                iq_sample_files.append(iq_file_name)
 
             # Close the iperf processes as soon as the USRP is done sensing the medium
             iperf_server_proc.terminate()
@@ -223,5 +370,38 @@ class ANTS_Controller():
         
         return iq_sample_files
 
+    # Starts capture_daemon.py unless it is already running, and restarts it if it writes samples in another format than
+    # the current one. It opens and configures the USRP once, and keeps it streaming until stop_capture_daemon is called
+    def start_capture_daemon(self):
+        if self.capture_daemon_proc is not None and self.capture_daemon_proc.getProcess().poll() is None:
+            if capture_client.get_status(self.capture_daemon_socket)["sample_format"] == self.sample_format:
+                return
+            self.stop_capture_daemon()
+        capture_daemon_args = ["python", self.working_dir + "/capture_daemon.py", self.capture_daemon_socket, "--center-frequency", str(self.center_frequency),
+            "--gain", str(self.usrp_gain), "--sample-format", self.sample_format, "--source", self.capture_source]
+        if self.capture_source_file is not None:
+            capture_daemon_args += ["--source-file", self.capture_source_file]
+        self.capture_daemon_proc = color_subprocess.Popen(capture_daemon_args, prefix='USRP:        ', color=color_subprocess.colors.fg.lightgreen)
+        capture_client.wait_for_daemon(self.capture_daemon_socket, lambda: self.capture_daemon_proc.getProcess().poll() is None)
+
+    def stop_capture_daemon(self):
+        if self.capture_daemon_proc is None:
+            return
+        if self.capture_daemon_proc.getProcess().poll() is None:
+            try:
+                capture_client.shutdown(self.capture_daemon_socket)
+            except Exception as e:
+                print("WARNING: Could not shut down the capture daemon: {}".format(e))
+                self.capture_daemon_proc.terminate()
+            self.capture_daemon_proc.getProcess().wait()
+        self.capture_daemon_proc = None
+
+    # Has the capture daemon write the next run_time seconds to iq_file_name, at the current center frequency and gain
+    def start_daemon_capture(self, iq_file_name):
+        self.start_capture_daemon()
+        return capture_client.start_capture(self.capture_daemon_socket, iq_file_name, duration=self.run_time,
+            center_frequency=float(self.center_frequency), gain=float(self.usrp_gain), sample_format=self.sample_format)
+
     def get_iq_file_name(self, data_dir, run):
-        return os.path.join(data_dir, "iqsamples_" + self.access_category_name + "_run" + str(run) + ".bin")
\ No newline at end of file
+        extension = sigmf_capture.SIGMF_DATA_EXTENSION if self.capture_container == "sigmf" else ".bin"
+        return os.path.join(data_dir, "iqsamples_" + self.access_category_name + "_run" + str(run) + extension)
\ No newline at end of file
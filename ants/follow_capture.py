@@ -0,0 +1,91 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import time
+import numpy as np
+import analyzer
+
+class CaptureFollower():
+    """Detects packets in a capture while it is still being written, e.g. by writeIQ.py"""
+    def __init__(self, iq_samples_file_name, threshold, sample_rate = 20e6, wait_time = 4e-6, chunk_size = 2**20, sample_format = "fc32"):
+        self.iq_samples_file_name = iq_samples_file_name
+        self.window_size = int(sample_rate*wait_time)
+        self.chunk_size = chunk_size
+
+        # The mean power of the whole capture is not known until it is complete, and that of its first samples says nothing
+        # about it if the channel happens to be idle then, so the threshold has to be an absolute one above the noise floor
+        if threshold is None:
+            raise Exception("ERROR: Following {} needs an absolute detection threshold, calibrate the noise floor first".format(iq_samples_file_name))
+        self.threshold = threshold
+        self.detector = analyzer.BurstDetector(threshold, self.window_size)
+
+        self.file = None
+        self.sample_size = analyzer.get_sample_dtype(sample_format).itemsize
+        self.samples = np.empty(chunk_size, dtype=analyzer.get_sample_dtype(sample_format))
+        self.power = np.empty(chunk_size, dtype=np.float32)
+        self.data_length = 0
+
+    def poll(self):
+        """Detects packets in the samples written since the last poll and returns how many samples that was"""
+        if self.file is None:
+            if not os.path.exists(self.iq_samples_file_name):
+                return 0
+            self.file = open(self.iq_samples_file_name, mode='rb')
+
+        # only read whole samples, the writer may be in the middle of one
+        num_samples = os.fstat(self.file.fileno()).st_size // self.sample_size - self.data_length
+        num_polled = 0
+        while num_samples > 0:
+            count = min(num_samples, self.chunk_size)
+            count = self.file.readinto(self.samples[:count]) // self.sample_size
+            if count == 0:
+                break
+            self.detector.feed(analyzer.power_envelope(self.samples[:count], out=self.power[:count]))
+            self.data_length += count
+            num_polled += count
+            num_samples -= count
+        return num_polled
+
+    def follow(self, is_running, poll_interval = 0.01):
+        """Keeps detecting packets while is_running() returns True, then returns the start and end indices of all packets"""
+        while is_running():
+            if self.poll() == 0:
+                time.sleep(poll_interval)
+        # pick up whatever was written after the last poll
+        self.poll()
+        return self.finish()
+
+    def finish(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if self.data_length == 0:
+            raise Exception("ERROR: No IQ samples were written to {}".format(self.iq_samples_file_name))
+        print("Followed {} samples of {}".format(self.data_length, self.iq_samples_file_name))
+        return self.detector.finish()
+
+def main():
+    # Follow a capture until it has not grown for idle_timeout seconds, e.g. to try follow mode against a local writer, with
+    # the detection threshold that noise_floor.py prints. utils/follow_check.py runs such a writer at the rate of the USRP
+    # and checks the packets found against IQSamplesFile
+    if len(sys.argv) < 3:
+        print("Usage: follow_capture.py iq_samples_file_name threshold [idle_timeout]")
+        return
+    iq_samples_file_name = sys.argv[1]
+    threshold = float(sys.argv[2])
+    idle_timeout = float(sys.argv[3]) if len(sys.argv) > 3 else 1.0
+
+    follower = CaptureFollower(iq_samples_file_name, threshold)
+    last_growth = time.time()
+    def is_running():
+        nonlocal last_growth
+        if follower.poll() > 0:
+            last_growth = time.time()
+        return time.time() - last_growth < idle_timeout
+
+    packet_start_indices, packet_end_indices = follower.follow(is_running)
+    print("Found {} packets".format(len(packet_start_indices)))
+
+if __name__ == "__main__":
+    main()
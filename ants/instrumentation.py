@@ -0,0 +1,55 @@
+import contextlib
+import json
+import os
+import resource
+import time
+
+# Records the wall time, CPU time, bytes read and peak RSS growth of the stages of the analysis. It is off unless enable()
+# is called or ANTS_INSTRUMENT=1 is set, and then a stage costs no more than checking this flag
+enabled = os.environ.get("ANTS_INSTRUMENT", "0") != "0"
+
+# the stages recorded since the last reset, in the order they finished
+stages = []
+
+def enable(on = True):
+    global enabled
+    enabled = on
+
+def reset():
+    del stages[:]
+
+def get_stages():
+    """Returns a copy of the stages recorded since the last reset, or None while instrumentation is disabled"""
+    if not enabled:
+        return None
+    return list(stages)
+
+def stage(name, records = None):
+    """Returns a context manager that records the stage it wraps in records (by default the module's stages)
+
+    The context manager yields the stage's record, to which the stage adds the number of bytes it read."""
+    if not enabled:
+        return contextlib.nullcontext({})
+    return record_stage(name, stages if records is None else records)
+
+@contextlib.contextmanager
+def record_stage(name, records):
+    record = {"stage": name, "bytes_read": 0}
+    # the peak RSS only ever grows, so its growth is the memory the stage needed beyond what earlier stages had used
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield record
+    finally:
+        record["wall"] = time.perf_counter() - wall_start
+        record["cpu"] = time.process_time() - cpu_start
+        record["peak_rss_delta"] = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - peak_rss)*1024
+        records.append(record)
+
+def write_stages(file_name, records):
+    """Writes the records of the stages and their totals to a JSON file"""
+    total = {key: sum(record[key] for record in records) for key in ("wall", "cpu", "bytes_read", "peak_rss_delta")}
+    with open(file_name, "w") as file:
+        json.dump({"stages": records, "total": total}, file, indent=4)
+    print("Wrote the timing of {} stages to {}".format(len(records), file_name))
@@ -0,0 +1,227 @@
+#!/usr/bin/python3
+
+import collections
+import json
+import math
+import os
+import queue
+import select
+import stat
+import sys
+import threading
+import numpy as np
+import analyzer
+import online_analyzer
+
+class ANTS_Monitor():
+    """Monitors the compliance of an endless stream of samples, e.g. from a FIFO written by writeIQ.py, over sliding windows"""
+    def __init__(self, uut_type, access_category, threshold, sample_rate = 20e6, wait_time = 4e-6, windows = (10, 60), bucket_time = 1.0,
+            chunk_size = 2**18, num_chunks = 16, status_file_name = None, sample_format = "fc32", on_report = None):
+        self.analyzer = online_analyzer.ANTS_Online_Analyzer(uut_type, sample_rate)
+        self.analyzer.set_access_category(access_category)
+        self.window_size = int(sample_rate*wait_time)
+        self.windows = windows
+        self.status_file_name = status_file_name
+        # called with the elapsed time and the latest results of every window whenever they are reported, e.g. by the GUI
+        self.on_report = on_report
+
+        # As in CaptureFollower, the stream has no mean power to take the threshold relative to, and that of its first
+        # samples is only that of the noise if the channel happens to be idle then, so it has to be above the noise floor
+        if threshold is None:
+            raise Exception("ERROR: Monitoring needs an absolute detection threshold, calibrate the noise floor first")
+        self.threshold = threshold
+        self.detector = analyzer.BurstDetector(threshold, self.window_size)
+
+        # The samples go through a ring of num_chunks preallocated chunks: the reader thread fills free chunks and the
+        # analysis hands them back once their power is computed, so the raw samples are dropped as soon as they are processed
+        self.sample_size = analyzer.get_sample_dtype(sample_format).itemsize
+        self.ring = np.empty((num_chunks, chunk_size), dtype=analyzer.get_sample_dtype(sample_format))
+        self.power = np.empty(chunk_size, dtype=np.float32)
+        self.free_chunks = queue.Queue()
+        self.filled_chunks = queue.Queue()
+        for chunk in range(num_chunks):
+            self.free_chunks.put(chunk)
+        self.stopped = threading.Event()
+        self.data_length = 0
+
+        # Packets are summarized per bucket of bucket_time seconds once no later packet can start in the bucket, and only
+        # the buckets of the longest window are kept. The windows are joined from those summaries
+        self.bucket_length = int(round(sample_rate*bucket_time))
+        self.bucket_time = bucket_time
+        self.buckets = collections.deque(maxlen=int(math.ceil(max(windows)/bucket_time)))
+        self.next_bucket = 0
+        self.pending_start_indices = np.zeros(0, dtype=np.int64)
+        self.pending_end_indices = np.zeros(0, dtype=np.int64)
+
+        # the latest results of every window, None while the window has no complete TXOPs
+        self.results = {}
+
+    def read(self, iq_file):
+        """Fills the free chunks of the ring with samples from iq_file until it ends or the monitor is stopped"""
+        try:
+            while not self.stopped.is_set():
+                chunk = self.free_chunks.get()
+                buffer = memoryview(self.ring[chunk]).cast('B')
+                num_bytes = 0
+                while num_bytes < len(buffer):
+                    count = iq_file.readinto(buffer[num_bytes:])
+                    if not count:
+                        break
+                    num_bytes += count
+                # a trailing incomplete sample is ignored, as in open_iq_samples
+                num_samples = num_bytes // self.sample_size
+                if num_samples > 0:
+                    self.filled_chunks.put((chunk, num_samples))
+                if num_bytes < len(buffer):
+                    break
+        finally:
+            self.filled_chunks.put(None)
+
+    def run(self, iq_samples_file_name, is_writing = None, poll_interval = 0.1):
+        """Monitors the samples read from iq_samples_file_name until it ends or stop() is called
+
+        A FIFO is read once a writer has opened it, which it is waited for only while is_writing() returns True, so that
+        the monitor neither hangs if the writer fails before opening it nor if it is stopped before"""
+        if stat.S_ISFIFO(os.stat(iq_samples_file_name).st_mode):
+            iq_file = self.open_fifo(iq_samples_file_name, is_writing, poll_interval)
+            if iq_file is None:
+                print("ERROR: Nothing was written to {} to monitor.".format(iq_samples_file_name))
+                return
+        else:
+            iq_file = open(iq_samples_file_name, mode='rb')
+        with iq_file:
+            reader = threading.Thread(target=self.read, args=(iq_file,))
+            reader.daemon = True
+            reader.start()
+            while True:
+                item = self.filled_chunks.get()
+                if item is None:
+                    break
+                chunk, num_samples = item
+                power = analyzer.power_envelope(self.ring[chunk, :num_samples], out=self.power[:num_samples])
+                self.free_chunks.put(chunk)
+                self.data_length += num_samples
+                self.feed(power)
+        self.finish()
+
+    def open_fifo(self, fifo_name, is_writing = None, poll_interval = 0.1):
+        """Returns the FIFO opened for reading once a writer has written to it or closed it again, or None if is_writing()
+        returns False or stop() is called before"""
+        # opening a FIFO for reading blocks until a writer opens it, unless it is opened without blocking, and then it is
+        # only readable once the writer has written to it or closed it
+        fd = os.open(fifo_name, os.O_RDONLY | os.O_NONBLOCK)
+        poller = select.poll()
+        poller.register(fd, select.POLLIN)
+        while not poller.poll(poll_interval*1000):
+            # the writer may have written its last samples since the last poll, right before it stopped
+            if self.stopped.is_set() or (is_writing is not None and not is_writing() and not poller.poll(0)):
+                os.close(fd)
+                return None
+        os.set_blocking(fd, True)
+        return os.fdopen(fd, 'rb')
+
+    def stop(self):
+        self.stopped.set()
+
+    def feed(self, power):
+        self.detector.feed(power)
+
+        # no packet that is not closed yet can start before the open packet, or before the next chunk if there is none
+        frontier = self.detector.offset if self.detector.open_packet_start is None else self.detector.open_packet_start
+        self.add_packets(*self.detector.pop_packets(), frontier)
+
+    def finish(self):
+        if self.data_length == 0:
+            print("ERROR: No IQ samples to monitor.")
+            return
+        packet_start_indices, packet_end_indices = self.detector.finish()
+        # the last bucket is closed even if it is shorter than bucket_time
+        self.add_packets(packet_start_indices, packet_end_indices, self.bucket_length*int(math.ceil(self.data_length/self.bucket_length)))
+        print("Monitored {} samples".format(self.data_length))
+
+    def add_packets(self, packet_start_indices, packet_end_indices, frontier):
+        """Adds closed packets and summarizes the buckets that end at or before frontier"""
+        self.pending_start_indices = np.concatenate((self.pending_start_indices, packet_start_indices))
+        self.pending_end_indices = np.concatenate((self.pending_end_indices, packet_end_indices))
+        if (self.next_bucket + 1)*self.bucket_length > frontier:
+            return
+        while (self.next_bucket + 1)*self.bucket_length <= frontier:
+            count = np.searchsorted(self.pending_start_indices, (self.next_bucket + 1)*self.bucket_length)
+            self.buckets.append((self.next_bucket, self.analyzer.summarize(self.pending_start_indices[:count], self.pending_end_indices[:count])))
+            self.pending_start_indices = self.pending_start_indices[count:]
+            self.pending_end_indices = self.pending_end_indices[count:]
+            self.next_bucket += 1
+        self.report()
+
+    def get_window_summary(self, window):
+        """Returns the summary of the packets that start in the last window seconds of summarized buckets"""
+        first_bucket = self.next_bucket - int(round(window/self.bucket_time))
+        summary = self.analyzer.empty_summary()
+        for bucket, bucket_summary in self.buckets:
+            if bucket >= first_bucket:
+                # the buckets are contiguous, so the IFS between them follows from their sample indices
+                summary = self.analyzer.join(summary, bucket_summary, separator=False)
+        return summary
+
+    def report(self):
+        elapsed = self.next_bucket*self.bucket_time
+        for window in self.windows:
+            summary = self.get_window_summary(window)
+            self.results[window] = None if summary.is_empty() else self.analyzer.get_summary_results(summary)
+            print(format_window(elapsed, window, self.results[window]))
+        if self.status_file_name is not None:
+            self.write_status(elapsed)
+        if self.on_report is not None:
+            self.on_report(elapsed, self.results)
+
+    def write_status(self, elapsed):
+        """Overwrites the status file with the latest results of every window"""
+        status = {'elapsed': elapsed, 'access_category': self.analyzer.access_category, 'windows': {}}
+        for window, results in self.results.items():
+            if results is None:
+                status['windows'][str(window)] = None
+                continue
+            status['windows'][str(window)] = {
+                'packets': int(results.number_of_packets),
+                'txops': int(results.txop_stats.count),
+                'txop_violations': int(results.txop_stats.violations),
+                'backoffs': int(results.backoff_stats.count),
+                'txop_factor': float(results.txop_factor),
+                'backoff_kullback_leibler_divergence': float(results.backoff_kullback_leibler_divergence),
+                'aggressiveness_factor': float(results.aggressiveness_factor),
+                'norm_factor': float(results.norm_factor),
+                'geometric_factor': float(results.geometric_factor),
+                'backoff_bin_probabilities': [float(p) for p in results.backoff_bin_probabilities],
+                'interframe_spacing_quantiles': {str(q): results.interframe_spacing_sketch.quantile(q) for q in analyzer.REPORTED_QUANTILES},
+                'txop_quantiles': {str(q): results.txop_sketch.quantile(q) for q in analyzer.REPORTED_QUANTILES},
+                'bin_probability_compliant': not any(results.backoff_bin_probabilities > results.p_max),
+            }
+        # replace the file in one step, so that a reader never sees a partial status
+        temp_file_name = self.status_file_name + ".tmp"
+        with open(temp_file_name, 'w') as status_file:
+            json.dump(status, status_file, indent=4)
+        os.replace(temp_file_name, self.status_file_name)
+
+def format_window(elapsed, window, results):
+    """Returns one line with the latest results of a window, which are None if it has no complete TXOPs"""
+    if results is None:
+        return "{:.0f}s: no complete TXOPs in the last {}s".format(elapsed, window)
+    return "{:.0f}s: last {}s: {} packets, {} TXOPs, Txop factor {:.3f}, Backoff KL Divergence {:.3f}, Aggressiveness Factor {:.3f}, {}".format(
+        elapsed, window, results.number_of_packets, results.txop_stats.count, results.txop_factor,
+        results.backoff_kullback_leibler_divergence, results.aggressiveness_factor,
+        "bin probability violation" if any(results.backoff_bin_probabilities > results.p_max) else "bin probability compliant")
+
+def main():
+    # Monitor a capture or a FIFO with the detection threshold that noise_floor.py prints, e.g. ./monitor.py iqsamples.fifo 0.002 voice
+    if len(sys.argv) < 3:
+        print("Usage: monitor.py iq_samples_file_name threshold [access_category]")
+        return
+    iq_samples_file_name = sys.argv[1]
+    threshold = float(sys.argv[2])
+    access_category = sys.argv[3] if len(sys.argv) > 3 else "voice"
+
+    monitor = ANTS_Monitor("Supervising", access_category, threshold)
+    monitor.run(iq_samples_file_name)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+
+import json
+import math
+import os
+import socket
+import sys
+import time
+import numpy as np
+import analyzer
+
+# A noise-floor profile holds the mean power of the receiver noise of one rig at one gain and center frequency, measured
+# once from a capture of an idle channel. Detection then uses a threshold at a fixed margin above it, which needs no pass
+# over the capture beforehand and does not depend on how busy the channel is. The profiles of every rig, gain and center
+# frequency are kept together in a single JSON file
+NOISE_FLOOR_VERSION = 1
+
+# The margin of the threshold above the noise floor. The power of Gaussian noise is exponentially distributed, so a single
+# noise sample exceeds 20 times its mean power with a probability of e^-20, about 2e-9
+DEFAULT_MARGIN_DB = 13.0
+
+def get_profile_key(rig, gain, center_frequency):
+    """Returns the key of the profile of a rig at a gain (in dB) and a center frequency (in GHz), as strings or numbers"""
+    return "{}/{:g}dB/{:g}GHz".format(rig, float(gain), float(center_frequency))
+
+def get_rig_name():
+    # the USRP is always attached to the same host, so the host identifies the rig unless told otherwise
+    return socket.gethostname()
+
+def load_profiles(profile_file_name):
+    """Returns the profiles saved in profile_file_name by their key, or none if it does not exist yet"""
+    try:
+        with open(profile_file_name) as profile_file:
+            profiles = json.load(profile_file)
+    except FileNotFoundError:
+        return {}
+    if profiles.get("version") != NOISE_FLOOR_VERSION:
+        raise Exception("ERROR: {} is not a noise-floor profile file of version {}".format(profile_file_name, NOISE_FLOOR_VERSION))
+    return profiles["profiles"]
+
+def get_profile(profile_file_name, rig, gain, center_frequency):
+    """Returns the profile of a rig at a gain and center frequency, or None if it was never calibrated"""
+    return load_profiles(profile_file_name).get(get_profile_key(rig, gain, center_frequency))
+
+def save_profile(profile_file_name, profile):
+    """Adds a profile to profile_file_name, replacing an earlier one of the same rig, gain and center frequency"""
+    profiles = load_profiles(profile_file_name)
+    profiles[get_profile_key(profile["rig"], profile["gain"], profile["center_frequency"])] = profile
+    # written to a temporary file first so that an interrupted write never loses the other profiles
+    with open(profile_file_name + ".tmp", "w") as profile_file:
+        json.dump({"version": NOISE_FLOOR_VERSION, "profiles": profiles}, profile_file, indent=4, sort_keys=True)
+    os.replace(profile_file_name + ".tmp", profile_file_name)
+    print("Saved the noise floor of {} to {}".format(get_profile_key(profile["rig"], profile["gain"], profile["center_frequency"]), profile_file_name))
+
+def measure_noise_floor(iq_samples_file_name, rig, gain, center_frequency, sample_rate = 20e6, sample_format = "fc32"):
+    """Returns the profile of the noise in a capture of an idle channel"""
+    # the power of every sample format is scaled to fc32, so the profile applies to captures in any of them
+    power = analyzer.power_envelope(analyzer.open_iq_samples(iq_samples_file_name, sample_format))
+    # The mean power of exponentially distributed noise is its median over ln(2). Unlike the mean, the median barely moves
+    # if a few packets of a neighbouring network were captured as well
+    mean_power = float(np.median(power)) / math.log(2)
+    profile = {"rig": rig, "gain": float(gain), "center_frequency": float(center_frequency), "sample_rate": sample_rate,
+        "sample_format": sample_format, "mean_power": mean_power, "num_samples": len(power), "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}
+    print("Measured a noise floor of {:.2f} dB over {} samples".format(10*math.log10(mean_power), len(power)))
+    return profile
+
+def get_threshold(profile, margin_db = DEFAULT_MARGIN_DB):
+    """Returns the absolute power threshold for detection, margin_db above the noise floor of a profile"""
+    return profile["mean_power"] * 10**(margin_db/10)
+
+def main():
+    # e.g. ./noise_floor.py idle.bin ../tests/noise_floor.json 40 5.180
+    if len(sys.argv) < 5:
+        print("Usage: noise_floor.py iq_samples_file_name profile_file_name gain center_frequency [rig] [sample_format]")
+        return
+    rig = sys.argv[5] if len(sys.argv) > 5 else get_rig_name()
+    sample_format = sys.argv[6] if len(sys.argv) > 6 else "fc32"
+    profile = measure_noise_floor(sys.argv[1], rig, sys.argv[3], sys.argv[4], sample_format=sample_format)
+    save_profile(sys.argv[2], profile)
+    print("Detection threshold: {}".format(get_threshold(profile)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,375 @@
+import math
+import numpy as np
+import analyzer
+import instrumentation
+
+# The version of the summary files written by exportSummary
+SUMMARY_VERSION = 1
+
+class RunningStats():
+    """Count, min, mean and max of durations that are whole numbers of samples, kept so that they combine exactly"""
+    def __init__(self):
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+        # durations are summed as integer numbers of samples, apart from the 2 * sifs separators between runs which are
+        # summed in microseconds
+        self.sum_samples = 0
+        self.separator_sum = 0.0
+
+    def add(self, samples, us_per_sample):
+        if len(samples) == 0:
+            return
+        self.count += len(samples)
+        self.sum_samples += int(np.sum(samples, dtype=np.int64))
+        self.min = min(self.min, us_per_sample*np.min(samples))
+        self.max = max(self.max, us_per_sample*np.max(samples))
+
+    def add_separator(self, duration):
+        self.count += 1
+        self.separator_sum += duration
+        self.min = min(self.min, duration)
+        self.max = max(self.max, duration)
+
+    def merge(self, other):
+        self.count += other.count
+        self.sum_samples += other.sum_samples
+        self.separator_sum += other.separator_sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def mean(self, us_per_sample):
+        return (us_per_sample*self.sum_samples + self.separator_sum)/self.count
+
+    def to_arrays(self, name):
+        # the counts and sums of samples are kept as integers, so that the loaded statistics combine exactly as well
+        return {name + "_counts": np.array([self.count, self.sum_samples], dtype=np.int64),
+            name + "_durations": np.array([self.min, self.max, self.separator_sum], dtype=np.float64)}
+
+    def load_arrays(self, arrays, name):
+        self.count, self.sum_samples = (int(value) for value in arrays[name + "_counts"])
+        self.min, self.max, self.separator_sum = (float(value) for value in arrays[name + "_durations"])
+
+class QuantileSketch():
+    """Mergeable quantile sketch of positive values with a bounded relative error"""
+    def __init__(self, relative_accuracy=0.01):
+        # Values are counted in logarithmic buckets (gamma^(k-1), gamma^k], so every quantile is known to within the
+        # relative accuracy and the number of buckets only grows with the logarithm of the range of the values. Bucket
+        # counts are integers, so sketches combine exactly
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy)/(1 - relative_accuracy)
+        self.buckets = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        self.count += len(values)
+        positive = values[values > 0]
+        self.zero_count += len(values) - len(positive)
+        keys, counts = np.unique(np.ceil(np.log(positive)/math.log(self.gamma)).astype(np.int64), return_counts=True)
+        for key, count in zip(keys.tolist(), counts.tolist()):
+            self.buckets[key] = self.buckets.get(key, 0) + count
+
+    def merge(self, other):
+        if other.gamma != self.gamma:
+            raise Exception("ERROR: Cannot merge quantile sketches with different accuracies")
+        for key, count in other.buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+
+    def quantile(self, q):
+        if self.count == 0:
+            return None
+        rank = q*(self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if rank < seen:
+                # the point of the bucket with the smallest relative error to any value in it
+                return 2*self.gamma**key/(self.gamma + 1)
+        return 2*self.gamma**max(self.buckets)/(self.gamma + 1)
+
+    def to_arrays(self, name):
+        keys = sorted(self.buckets)
+        return {name + "_accuracy": np.array(self.relative_accuracy), name + "_counts": np.array([self.zero_count, self.count], dtype=np.int64),
+            name + "_bucket_keys": np.array(keys, dtype=np.int64), name + "_bucket_counts": np.array([self.buckets[key] for key in keys], dtype=np.int64)}
+
+    def load_arrays(self, arrays, name):
+        self.relative_accuracy = float(arrays[name + "_accuracy"])
+        self.gamma = (1 + self.relative_accuracy)/(1 - self.relative_accuracy)
+        self.zero_count, self.count = (int(value) for value in arrays[name + "_counts"])
+        self.buckets = dict(zip(arrays[name + "_bucket_keys"].tolist(), arrays[name + "_bucket_counts"].tolist()))
+
+class PacketSummary():
+    """Mergeable summary of the packets in a stretch of captured samples
+
+    Besides the statistics of the packets, IFSs, backoffs and complete TXOPs, a summary keeps the airtime before its first
+    COT (the prefix) and after its last one (the suffix), since those TXOPs are only complete once it is combined with its
+    neighbours. The prefix of the first and the suffix of the last summary are left out, like the first and last TXOP of a
+    batch analysis."""
+    def __init__(self, n, kp1):
+        self.packets = RunningStats()
+        self.interframe_spacing = RunningStats()
+        self.interframe_spacing_sketch = QuantileSketch()
+        self.back_offs = RunningStats()
+        self.back_off_violations = 0
+        self.b = np.zeros(n, dtype=np.int64)
+        self.b2 = np.zeros(kp1, dtype=np.int64)
+        self.txops = RunningStats()
+        self.txop_violations = 0
+        self.txop_sketch = QuantileSketch()
+
+        # TXOP airtime in samples before the first and after the last COT, if there is one
+        self.prefix = 0
+        self.has_cot = False
+        self.suffix = 0
+
+        # absolute sample indices of the start of the first packet and the end of the last one
+        self.first_start = None
+        self.last_end = None
+
+    def is_empty(self):
+        return self.packets.count == 0
+
+    def to_arrays(self):
+        """Returns the summary as a dict of arrays, as exportSummary writes it"""
+        arrays = {}
+        for stats in ("packets", "interframe_spacing", "interframe_spacing_sketch", "back_offs", "txops", "txop_sketch"):
+            arrays.update(getattr(self, stats).to_arrays(stats))
+        # a summary without packets has no first start or last end, which are stored as -1
+        arrays.update(b=self.b, b2=self.b2, violations=np.array([self.back_off_violations, self.txop_violations], dtype=np.int64),
+            airtime=np.array([self.prefix, int(self.has_cot), self.suffix], dtype=np.int64),
+            packet_span=np.array([-1 if self.first_start is None else self.first_start, -1 if self.last_end is None else self.last_end], dtype=np.int64))
+        return arrays
+
+    def load_arrays(self, arrays):
+        for stats in ("packets", "interframe_spacing", "interframe_spacing_sketch", "back_offs", "txops", "txop_sketch"):
+            getattr(self, stats).load_arrays(arrays, stats)
+        if arrays["b"].shape != self.b.shape or arrays["b2"].shape != self.b2.shape:
+            raise Exception("ERROR: The summary was made with the backoff bins of another access category")
+        self.b = arrays["b"].astype(np.int64)
+        self.b2 = arrays["b2"].astype(np.int64)
+        self.back_off_violations, self.txop_violations = (int(value) for value in arrays["violations"])
+        self.prefix, has_cot, self.suffix = (int(value) for value in arrays["airtime"])
+        self.has_cot = bool(has_cot)
+        self.first_start, self.last_end = (None if value < 0 else int(value) for value in arrays["packet_span"])
+
+class ANTS_Online_Analyzer(analyzer.ANTS_Analyzer):
+    """Analyzer that keeps mergeable summaries of the captures instead of their packets, so memory stays constant
+
+    Since the packets are not kept, the packet events of the captures cannot be exported. The summary can be exported
+    instead, and the summaries of captures analyzed separately, e.g. on other machines, combined with loadSummary."""
+    def __init__(self, uut_type, sample_rate = 20e6):
+        analyzer.ANTS_Analyzer.__init__(self, uut_type, sample_rate)
+        self.us_per_sample = 1e6/sample_rate
+        self.summary = None
+
+    def addPackets(self, access_category, packet_start_indices, packet_end_indices, file_name="", run=-1, data_length=-1, sample_format="fc32"):
+        if self.access_category is not None:
+            if self.access_category != access_category:
+                raise Exception("ERROR: Cannot mix samples from different access categories")
+        else:
+            self.set_access_category(access_category)
+
+        print("Found {} packets with {} IFSs in between".format(len(packet_start_indices), max(len(packet_start_indices) - 1, 0)))
+        # runs are separated by a 2 * sifs IFS, as in ANTS_Analyzer
+        self.merge(self.summarize(packet_start_indices, packet_end_indices))
+
+    def exportPacketEvents(self, events_file_name):
+        # only the summaries of the packets are kept, which cannot be analyzed again like the packets themselves
+        raise Exception("ERROR: The online analyzer keeps no packet events to export to {}".format(events_file_name))
+
+    def exportSummary(self, summary_file_name):
+        """Writes the summary of all captures added so far to a file that loadSummary can read"""
+        if self.summary is None:
+            raise Exception("ERROR: No captures were added to export the summary of to {}".format(summary_file_name))
+        summary = self.summary
+        with open(summary_file_name, mode='wb') as file:
+            np.savez_compressed(file,
+                format_version=np.array(SUMMARY_VERSION),
+                sample_rate=np.array(self.sample_rate),
+                access_category=np.array(self.access_category),
+                uut_type=np.array(self.uut_type),
+                **summary.to_arrays())
+        print("Exported the summary of {} packets to {}".format(summary.packets.count, summary_file_name))
+
+    def loadSummary(self, summary_file_name):
+        """Appends a summary written by exportSummary, as if its captures had been added after those added so far"""
+        with np.load(summary_file_name) as arrays:
+            if int(arrays["format_version"]) != SUMMARY_VERSION:
+                raise Exception("ERROR: Unsupported summary format version {} in {}".format(int(arrays["format_version"]), summary_file_name))
+            if float(arrays["sample_rate"]) != self.sample_rate:
+                raise Exception("ERROR: The summary in {} was made at a sample rate of {}, not {}".format(summary_file_name, float(arrays["sample_rate"]), self.sample_rate))
+            access_category = str(arrays["access_category"])
+            if self.access_category is not None:
+                if self.access_category != access_category:
+                    raise Exception("ERROR: Cannot mix samples from different access categories")
+            else:
+                self.set_access_category(access_category)
+            summary = self.empty_summary()
+            summary.load_arrays(arrays)
+        print("Loaded the summary of {} packets from {}".format(summary.packets.count, summary_file_name))
+        self.merge(summary)
+
+    def merge(self, summary, separator=True):
+        """Appends a summary of later samples, e.g. of another run or computed on another machine"""
+        if self.summary is None:
+            self.summary = self.empty_summary()
+        self.summary = self.join(self.summary, summary, separator)
+
+    def empty_summary(self):
+        return PacketSummary(self.n, self.kp1)
+
+    def summarize(self, packet_start_indices, packet_end_indices):
+        """Returns the summary of the packets detected in a stretch of samples"""
+        summary = self.empty_summary()
+        if len(packet_start_indices) == 0:
+            return summary
+        packet_start_indices = np.asarray(packet_start_indices, dtype=np.int64)
+        packet_end_indices = np.asarray(packet_end_indices, dtype=np.int64)
+
+        # packet durations and IFSs in samples, compared in microseconds exactly as ANTS_Analyzer does
+        packet_duration = packet_end_indices - packet_start_indices
+        interframe_spacing = packet_start_indices[1:] - packet_end_indices[:-1]
+        interframe_spacing_us = self.us_per_sample*interframe_spacing
+
+        summary.first_start = int(packet_start_indices[0])
+        summary.last_end = int(packet_end_indices[-1])
+        summary.packets.add(packet_duration, self.us_per_sample)
+        summary.interframe_spacing.add(interframe_spacing, self.us_per_sample)
+        summary.interframe_spacing_sketch.add(interframe_spacing_us)
+        self.add_back_offs(summary, interframe_spacing[interframe_spacing_us > self.get_back_off_threshold()])
+
+        # the TXOPs between consecutive COTs are complete, the airtime around them is kept for merging
+        COT = np.flatnonzero(interframe_spacing_us > self.sifs)
+        packet_duration_sum = np.concatenate(([0], np.cumsum(packet_duration)))
+        interframe_spacing_sum = np.concatenate(([0], np.cumsum(interframe_spacing)))
+        if len(COT) == 0:
+            summary.prefix = int(packet_duration_sum[-1] + interframe_spacing_sum[-1])
+            return summary
+        summary.has_cot = True
+        summary.prefix = int(packet_duration_sum[COT[0] + 1] + interframe_spacing_sum[COT[0]])
+        summary.suffix = int(packet_duration_sum[-1] - packet_duration_sum[COT[-1] + 1] + interframe_spacing_sum[-1] - interframe_spacing_sum[COT[-1] + 1])
+        start = COT[:-1] + 1
+        end = COT[1:]
+        txop_durations = packet_duration_sum[end + 1] - packet_duration_sum[start] + interframe_spacing_sum[end] - interframe_spacing_sum[start]
+        self.add_txops(summary, txop_durations)
+        return summary
+
+    def add_back_offs(self, summary, back_offs, separator=False):
+        # back_offs are in samples, or a single 2 * sifs separator in microseconds
+        if separator:
+            back_offs_us = np.array([back_offs])
+            summary.back_offs.add_separator(back_offs)
+        else:
+            back_offs_us = self.us_per_sample*back_offs
+            summary.back_offs.add(back_offs, self.us_per_sample)
+        BFmax = self.aifs + self.slot*(self.n-1) + self.slot/2
+        summary.back_off_violations += np.count_nonzero(back_offs_us > BFmax)
+        b, b2 = self.bin_back_offs(back_offs_us)
+        summary.b += b
+        summary.b2 += b2
+
+    def add_txops(self, summary, txop_durations):
+        txop_durations = np.asarray(txop_durations, dtype=np.int64)
+        summary.txops.add(txop_durations, self.us_per_sample)
+        if self.txop_limit != 0:
+            summary.txop_violations += np.count_nonzero(self.us_per_sample*txop_durations > self.txop_limit * 1e3)
+        summary.txop_sketch.add(self.us_per_sample*txop_durations)
+
+    def join(self, first, second, separator=True):
+        """Combines the summaries of two consecutive stretches of samples into a new summary
+
+        With separator, the stretches are separate runs with a 2 * sifs IFS in between, otherwise they are contiguous and
+        the IFS between them follows from their absolute sample indices."""
+        if second.is_empty():
+            return first
+        if first.is_empty():
+            return second
+
+        summary = self.empty_summary()
+        for stats in ("packets", "interframe_spacing", "interframe_spacing_sketch", "back_offs", "txops", "txop_sketch"):
+            getattr(summary, stats).merge(getattr(first, stats))
+            getattr(summary, stats).merge(getattr(second, stats))
+        summary.back_off_violations = first.back_off_violations + second.back_off_violations
+        summary.b = first.b + second.b
+        summary.b2 = first.b2 + second.b2
+        summary.txop_violations = first.txop_violations + second.txop_violations
+        summary.first_start = first.first_start
+        summary.last_end = second.last_end
+
+        # the IFS between the last packet of the first stretch and the first packet of the second
+        if separator:
+            gap = None
+            gap_us = 2 * self.sifs
+            summary.interframe_spacing.add_separator(gap_us)
+        else:
+            gap = second.first_start - first.last_end
+            gap_us = self.us_per_sample*gap
+            summary.interframe_spacing.add(np.array([gap]), self.us_per_sample)
+        summary.interframe_spacing_sketch.add([gap_us])
+        if gap_us > self.get_back_off_threshold():
+            if separator:
+                self.add_back_offs(summary, gap_us, separator=True)
+            else:
+                self.add_back_offs(summary, np.array([gap]))
+
+        summary.prefix = first.prefix
+        summary.has_cot = first.has_cot or second.has_cot or gap_us > self.sifs
+        if gap_us > self.sifs:
+            # the gap is a COT, which completes the open TXOP of the first stretch and opens the one of the second
+            if first.has_cot:
+                self.add_txops(summary, [first.suffix])
+            if second.has_cot:
+                self.add_txops(summary, [second.prefix])
+                summary.suffix = second.suffix
+            else:
+                summary.suffix = second.prefix
+        else:
+            # the open TXOP of the first stretch carries on into the second
+            joined = (first.suffix if first.has_cot else first.prefix) + gap + second.prefix
+            if not first.has_cot:
+                summary.prefix = joined
+                summary.suffix = second.suffix
+            elif second.has_cot:
+                self.add_txops(summary, [joined])
+                summary.suffix = second.suffix
+            else:
+                summary.suffix = joined
+        return summary
+
+    def get_results(self):
+        if self.summary is None or self.summary.is_empty():
+            print ("ERROR: No iq samples to analyze.")
+            return
+        return self.get_summary_results(self.summary)
+
+    def get_summary_results(self, summary):
+        """Returns the results of the analysis for a summary, with the same metrics as ANTS_Analyzer.get_results"""
+        results = analyzer.ANTS_Analyzer.Results()
+        results.interframe_spacing_sketch = summary.interframe_spacing_sketch
+        results.txop_sketch = summary.txop_sketch
+        results.last_iq_file = self.last_iq_file
+        results.number_of_packets = summary.packets.count
+        print("Analyzing {} packets, {} IFSs".format(summary.packets.count, summary.interframe_spacing.count))
+
+        txops = summary.txops
+        if txops.count == 0:
+            print("ERROR: No complete TXOPs to analyze.")
+            return
+        mean_txop = txops.mean(self.us_per_sample)
+        print("TXOP Min/Mean/Max: {:.3f}µs / {:.3f}µs / {:.3f}µs".format(txops.min, mean_txop, txops.max))
+        results.txop_stats = analyzer.ANTS_Analyzer.Stats(txops.count, txops.min, mean_txop, txops.max, summary.txop_violations)
+        txop_factor = summary.txop_violations/txops.count
+        print("Found {:d} violating durations (> {:d}ms)".format(summary.txop_violations, self.txop_limit))
+
+        back_offs = summary.back_offs
+        results.backoff_stats = analyzer.ANTS_Analyzer.Stats(back_offs.count, back_offs.min, back_offs.mean(self.us_per_sample),
+            back_offs.max, summary.back_off_violations)
+        self.set_compliance_factors(results, summary.b, summary.b2, back_offs.count, txop_factor)
+        results.instrumentation = instrumentation.get_stages()
+        return results
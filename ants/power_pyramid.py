@@ -0,0 +1,169 @@
+import json
+import os
+import numpy as np
+
+# The pyramid of a capture holds the min, max and mean power of buckets of 2^6 samples, then of 2^8, 2^10, ... samples, up
+# to the first level with at most PYRAMID_TOP_BUCKETS buckets. All levels are stored back to back as float32 rows of
+# (min, max, mean) in a .pyramid.npy sidecar, which takes about 3% of the size of the capture, and are described by a
+# .pyramid.json sidecar that also identifies the capture they were computed from
+PYRAMID_VERSION = 1
+PYRAMID_BASE_BUCKET_SIZE = 2**6
+PYRAMID_LEVEL_FACTOR = 4
+PYRAMID_TOP_BUCKETS = 1024
+
+def get_pyramid_file_names(iq_samples_file_name):
+    return iq_samples_file_name + ".pyramid.npy", iq_samples_file_name + ".pyramid.json"
+
+def get_bucket_sizes(data_length):
+    """Returns the number of samples per bucket of every level of the pyramid of a capture of data_length samples"""
+    bucket_sizes = [PYRAMID_BASE_BUCKET_SIZE]
+    while -(-data_length // bucket_sizes[-1]) > PYRAMID_TOP_BUCKETS:
+        bucket_sizes.append(bucket_sizes[-1] * PYRAMID_LEVEL_FACTOR)
+    return bucket_sizes
+
+def get_capture_key(iq_samples_file_name):
+    stat = os.stat(iq_samples_file_name)
+    return {"version": PYRAMID_VERSION, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+class PowerPyramid():
+    """The levels of a saved pyramid, memory-mapped so that only the buckets that are looked at are read"""
+    def __init__(self, levels, bucket_sizes):
+        self.levels = levels
+        self.bucket_sizes = bucket_sizes
+
+    def get_envelope(self, start, stop, num_buckets):
+        """Returns the center sample, min, max and mean power of at most num_buckets + 1 buckets covering [start:stop]
+
+        The buckets come from the finest level that is coarse enough, so the buckets at either end may reach outside the
+        window. Returns None if even the finest level is too coarse, in which case the samples themselves are needed."""
+        if stop - start < PYRAMID_BASE_BUCKET_SIZE * num_buckets:
+            return None
+        for level, bucket_size in enumerate(self.bucket_sizes):
+            if bucket_size * num_buckets >= stop - start:
+                break
+        first = start // bucket_size
+        buckets = self.levels[level][first:-(-stop // bucket_size)]
+        centers = np.clip((first + np.arange(len(buckets))) * bucket_size + bucket_size // 2, start, stop - 1)
+        return centers, buckets[:, 0], buckets[:, 1], buckets[:, 2]
+
+def load_pyramid(iq_samples_file_name):
+    """Returns the saved pyramid of a capture, or None if there is none or the capture has changed since"""
+    pyramid_file_name, description_file_name = get_pyramid_file_names(iq_samples_file_name)
+    try:
+        with open(description_file_name) as description_file:
+            description = json.load(description_file)
+        if description["capture"] != get_capture_key(iq_samples_file_name):
+            return None
+        data = np.load(pyramid_file_name, mmap_mode='r')
+    except (OSError, ValueError, KeyError):
+        return None
+    levels = [data[offset:offset + length] for offset, length in zip(description["offsets"], description["lengths"])]
+    return PowerPyramid(levels, description["bucket_sizes"])
+
+class PyramidBuilder():
+    """Writes the pyramid of a capture while its power is computed, e.g. for packet detection"""
+    def __init__(self, iq_samples_file_name, data_length):
+        self.iq_samples_file_name = iq_samples_file_name
+        self.bucket_sizes = get_bucket_sizes(data_length)
+        self.lengths = [-(-data_length // bucket_size) for bucket_size in self.bucket_sizes]
+        self.offsets = np.concatenate(([0], np.cumsum(self.lengths)[:-1])).astype(np.int64).tolist()
+
+        # the levels are written straight into the sidecar, under a temporary name until they are complete
+        pyramid_file_name, _ = get_pyramid_file_names(iq_samples_file_name)
+        self.data = np.lib.format.open_memmap(pyramid_file_name + ".tmp.npy", mode='w+', dtype=np.float32, shape=(sum(self.lengths), 3))
+        self.levels = [self.data[offset:offset + length] for offset, length in zip(self.offsets, self.lengths)]
+
+    def segment(self, offset = 0):
+        """Returns a PyramidSegment for the power of the samples from offset on, which must be a multiple of alignment()"""
+        if offset % self.alignment() != 0:
+            raise Exception("ERROR: Pyramid segments must start at a multiple of {} samples".format(self.alignment()))
+        return PyramidSegment(self, offset)
+
+    def alignment(self):
+        # a segment starting at a multiple of the largest bucket size only ever completes buckets of its own
+        return self.bucket_sizes[-1]
+
+    def save(self):
+        """Completes the sidecars once every segment is finished and returns the pyramid"""
+        pyramid_file_name, description_file_name = get_pyramid_file_names(self.iq_samples_file_name)
+        self.data.flush()
+        del self.data, self.levels
+        description = {"capture": get_capture_key(self.iq_samples_file_name), "bucket_sizes": self.bucket_sizes,
+            "offsets": self.offsets, "lengths": self.lengths}
+        try:
+            os.replace(pyramid_file_name + ".tmp.npy", pyramid_file_name)
+            # the description is written last, so that it never describes an incomplete pyramid
+            with open(description_file_name + ".tmp", "w") as description_file:
+                json.dump(description, description_file)
+            os.replace(description_file_name + ".tmp", description_file_name)
+        except OSError as e:
+            print("WARNING: Could not write the power pyramid {}: {}".format(pyramid_file_name, e))
+        return load_pyramid(self.iq_samples_file_name)
+
+class PyramidSegment():
+    """Fills the buckets of the pyramid for power that is fed in consecutive chunks"""
+    def __init__(self, builder, offset):
+        self.builder = builder
+        # the next bucket to write on every level
+        self.positions = [offset // bucket_size for bucket_size in builder.bucket_sizes]
+        # the buckets of every level that do not make up a whole bucket of the next level yet, as (min, max, sum, count)
+        self.pending = [None] * len(builder.bucket_sizes)
+        # the power of the samples of the first level that do not make up a whole bucket yet
+        self.partial = []
+
+    def feed(self, power_chunk):
+        bucket_size = self.builder.bucket_sizes[0]
+        position = 0
+        if self.partial:
+            # complete the bucket that the previous chunk started
+            partial_length = sum(len(partial) for partial in self.partial)
+            position = min(bucket_size - partial_length, len(power_chunk))
+            self.partial.append(power_chunk[:position].copy())
+            if partial_length + position < bucket_size:
+                return
+            self.add_partial()
+        complete = (len(power_chunk) - position) // bucket_size * bucket_size
+        if complete > 0:
+            buckets = power_chunk[position:position + complete].reshape(-1, bucket_size)
+            self.add_buckets(0, np.min(buckets, axis=1), np.max(buckets, axis=1), np.sum(buckets, axis=1, dtype=np.float64),
+                np.full(len(buckets), bucket_size, dtype=np.int64))
+        if position + complete < len(power_chunk):
+            self.partial = [power_chunk[position + complete:].copy()]
+
+    def add_partial(self):
+        partial = np.concatenate(self.partial)
+        self.partial = []
+        self.add_buckets(0, np.array([np.min(partial)]), np.array([np.max(partial)]), np.array([np.sum(partial, dtype=np.float64)]),
+            np.array([len(partial)], dtype=np.int64))
+
+    def add_buckets(self, level, mins, maxs, sums, counts):
+        level_data = self.builder.levels[level]
+        position = self.positions[level]
+        level_data[position:position + len(mins), 0] = mins
+        level_data[position:position + len(mins), 1] = maxs
+        level_data[position:position + len(mins), 2] = sums / counts
+        self.positions[level] += len(mins)
+        if level + 1 == len(self.builder.bucket_sizes):
+            return
+
+        # every PYRAMID_LEVEL_FACTOR buckets make up a bucket of the next level
+        if self.pending[level] is not None:
+            mins, maxs, sums, counts = (np.concatenate((pending, new)) for pending, new in zip(self.pending[level], (mins, maxs, sums, counts)))
+        complete = len(mins) // PYRAMID_LEVEL_FACTOR * PYRAMID_LEVEL_FACTOR
+        self.pending[level] = None if complete == len(mins) else (mins[complete:], maxs[complete:], sums[complete:], counts[complete:])
+        if complete > 0:
+            self.add_buckets(level + 1, *self.group(mins[:complete], maxs[:complete], sums[:complete], counts[:complete], PYRAMID_LEVEL_FACTOR))
+
+    def group(self, mins, maxs, sums, counts, group_size):
+        return (np.min(mins.reshape(-1, group_size), axis=1), np.max(maxs.reshape(-1, group_size), axis=1),
+            np.sum(sums.reshape(-1, group_size), axis=1), np.sum(counts.reshape(-1, group_size), axis=1))
+
+    def finish(self):
+        """Writes the buckets at the end of the segment, which are only partially filled if it ends mid-bucket"""
+        if self.partial:
+            self.add_partial()
+        for level in range(len(self.builder.bucket_sizes) - 1):
+            if self.pending[level] is not None:
+                mins, maxs, sums, counts = self.pending[level]
+                self.pending[level] = None
+                self.add_buckets(level + 1, *self.group(mins, maxs, sums, counts, len(mins)))
@@ -0,0 +1,135 @@
+#!/usr/bin/python3
+
+import bisect
+import datetime
+import json
+import os
+import re
+import sys
+
+# A SigMF recording is a .sigmf-data file holding the raw samples, exactly like a legacy .bin capture, and a .sigmf-meta
+# JSON file describing them: the sample rate, format, center frequency and gain, when the capture started and, under the
+# ants: namespace, the access category and run that legacy captures only give in their file name. Its capture segments
+# are the index of the recording: each one gives the sample and the time at which a contiguous stretch of samples starts,
+# so any time offset maps to a sample without reading the samples
+SIGMF_VERSION = "1.0.0"
+SIGMF_DATA_EXTENSION = ".sigmf-data"
+SIGMF_META_EXTENSION = ".sigmf-meta"
+
+# The SigMF datatype of each sample format of writeIQ.py
+DATATYPES = {"fc32": "cf32_le", "sc16": "ci16_le", "sc8": "ci8"}
+
+DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+
+def is_sigmf(iq_samples_file_name):
+    return iq_samples_file_name.endswith(SIGMF_DATA_EXTENSION) or iq_samples_file_name.endswith(SIGMF_META_EXTENSION)
+
+def get_sigmf_file_names(iq_samples_file_name):
+    """Returns the data and metadata file names of a recording, given either of them"""
+    base_name = re.sub(r"\.sigmf-(data|meta)$", "", iq_samples_file_name)
+    return base_name + SIGMF_DATA_EXTENSION, base_name + SIGMF_META_EXTENSION
+
+def write_metadata(iq_samples_file_name, sample_rate, sample_format, center_frequency, gain, access_category, run, start_time = None,
+        recorder = "ANTS writeIQ.py"):
+    """Writes the .sigmf-meta file of a recording, with the center frequency in GHz and the start time as a UTC datetime. The
+    center frequency, gain and start time are left out if they are None"""
+    if sample_format not in DATATYPES:
+        raise Exception("ERROR: Unknown sample format {}".format(sample_format))
+    _, meta_file_name = get_sigmf_file_names(iq_samples_file_name)
+    capture = {"core:sample_start": 0}
+    if center_frequency is not None:
+        capture["core:frequency"] = float(center_frequency)*1e9
+    if start_time is not None:
+        capture["core:datetime"] = start_time.strftime(DATETIME_FORMAT)
+    metadata = {
+        "global": {
+            "core:datatype": DATATYPES[sample_format],
+            "core:sample_rate": float(sample_rate),
+            "core:version": SIGMF_VERSION,
+            "core:recorder": recorder,
+            "core:extensions": [{"name": "ants", "version": "1.0.0", "optional": True}],
+            "ants:access_category": access_category,
+            "ants:run": int(run),
+        },
+        "captures": [capture],
+        "annotations": [],
+    }
+    if gain is not None:
+        metadata["global"]["ants:gain"] = float(gain)
+    with open(meta_file_name + ".tmp", "w") as meta_file:
+        json.dump(metadata, meta_file, indent=4)
+    os.replace(meta_file_name + ".tmp", meta_file_name)
+
+def load_metadata(iq_samples_file_name):
+    """Returns the description of a recording as a dict with the sample_rate, sample_format, center_frequency (in GHz),
+    gain, access_category, run and start_time, any of which is None if the recording does not give it, and its
+    capture segments"""
+    _, meta_file_name = get_sigmf_file_names(iq_samples_file_name)
+    with open(meta_file_name) as meta_file:
+        metadata = json.load(meta_file)
+    datatype = metadata["global"]["core:datatype"]
+    sample_formats = {datatype: sample_format for sample_format, datatype in DATATYPES.items()}
+    if datatype not in sample_formats:
+        raise Exception("ERROR: {} holds {} samples, which are not supported".format(meta_file_name, datatype))
+
+    captures = sorted(metadata.get("captures", [{"core:sample_start": 0}]), key=lambda capture: capture["core:sample_start"])
+    first_capture = captures[0] if captures else {}
+    description = {
+        "sample_rate": metadata["global"]["core:sample_rate"],
+        "sample_format": sample_formats[datatype],
+        "center_frequency": first_capture["core:frequency"]/1e9 if "core:frequency" in first_capture else None,
+        "gain": metadata["global"].get("ants:gain"),
+        "access_category": metadata["global"].get("ants:access_category"),
+        "run": metadata["global"].get("ants:run"),
+        "start_time": parse_datetime(first_capture.get("core:datetime")),
+        "captures": captures,
+    }
+    return description
+
+def parse_datetime(value):
+    if value is None:
+        return None
+    # SigMF allows any number of fractional digits, or none at all
+    match = re.match(r"(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})(?:\.(\d+))?Z$", value)
+    if not match:
+        raise Exception("ERROR: Could not parse the SigMF datetime {}".format(value))
+    start_time = datetime.datetime.strptime(match.group(1), "%Y-%m-%dT%H:%M:%S")
+    return start_time + datetime.timedelta(microseconds=int((match.group(2) or "0")[:6].ljust(6, "0")))
+
+def get_sample_index(description, time_offset):
+    """Returns the sample recorded time_offset seconds after the start of a recording"""
+    # every capture segment that has a time restarts the clock, e.g. after samples were dropped, while the others follow on
+    # from the one before
+    captures = [capture for capture in description["captures"] if "core:datetime" in capture]
+    if len(captures) <= 1:
+        return int(round(time_offset*description["sample_rate"]))
+    start_time = parse_datetime(captures[0]["core:datetime"])
+    offsets = [(parse_datetime(capture["core:datetime"]) - start_time).total_seconds() for capture in captures]
+    segment = max(bisect.bisect_right(offsets, time_offset) - 1, 0)
+    return captures[segment]["core:sample_start"] + int(round((time_offset - offsets[segment])*description["sample_rate"]))
+
+def convert_legacy_capture(iq_samples_file_name, sample_rate = 20e6, sample_format = "fc32", center_frequency = None, gain = None):
+    """Turns a legacy iqsamples_<access category>_run<N>.bin capture into a SigMF recording in place and returns the name of
+    its .sigmf-data file. The samples are renamed rather than copied"""
+    match = re.search(r"iqsamples_(video|voice|best_effort|background)_run(\d+)\.bin$", iq_samples_file_name)
+    if not match:
+        raise Exception("ERROR: Could not parse file name {} to ac and run#".format(iq_samples_file_name))
+    data_file_name, _ = get_sigmf_file_names(iq_samples_file_name[:-len(".bin")])
+    # a legacy capture does not record when it started, so the recording has no start time either
+    write_metadata(data_file_name, sample_rate, sample_format, center_frequency, gain, match.group(1), int(match.group(2)),
+        recorder="ANTS legacy capture")
+    os.rename(iq_samples_file_name, data_file_name)
+    print("Converted {} to {}".format(iq_samples_file_name, data_file_name))
+    return data_file_name
+
+def main():
+    # e.g. ./sigmf_capture.py ../tests/run/iqsamples_voice_run0.bin 20e6 fc32
+    if len(sys.argv) < 2:
+        print("Usage: sigmf_capture.py iq_samples_file_name.bin [sample_rate] [sample_format] [center_frequency] [gain]")
+        return
+    convert_legacy_capture(sys.argv[1], sample_rate=float(sys.argv[2]) if len(sys.argv) > 2 else 20e6,
+        sample_format=sys.argv[3] if len(sys.argv) > 3 else "fc32",
+        center_frequency=float(sys.argv[4]) if len(sys.argv) > 4 else None, gain=float(sys.argv[5]) if len(sys.argv) > 5 else None)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+#!/usr/bin/python3
+
+import argparse
+import os
+import numpy as np
+import analyzer
+
+# The packet length distributions of get_packet_length_sampler and the number of parameters each takes, in microseconds
+PACKET_LENGTH_DISTRIBUTIONS = {"uniform": 2, "fixed": 1, "exponential": 1, "normal": 2}
+
+def get_packet_length_sampler(distribution, *parameters):
+    """Returns a packet length sampler for generate_packets, which draws packet lengths in microseconds
+
+    uniform takes the shortest and longest length, fixed the length, exponential the mean length and normal the mean and
+    standard deviation."""
+    if distribution not in PACKET_LENGTH_DISTRIBUTIONS:
+        raise Exception("ERROR: Unknown packet length distribution {}, expected one of {}".format(distribution, ", ".join(PACKET_LENGTH_DISTRIBUTIONS)))
+    if len(parameters) != PACKET_LENGTH_DISTRIBUTIONS[distribution]:
+        raise Exception("ERROR: A {} packet length distribution takes {} parameters".format(distribution, PACKET_LENGTH_DISTRIBUTIONS[distribution]))
+    parameters = [float(parameter) for parameter in parameters]
+    if distribution == "uniform":
+        return lambda rng, size: rng.uniform(parameters[0], parameters[1], size=size)
+    if distribution == "fixed":
+        return lambda rng, size: np.full(size, parameters[0])
+    if distribution == "exponential":
+        return lambda rng, size: rng.exponential(parameters[0], size=size)
+    return lambda rng, size: rng.normal(parameters[0], parameters[1], size=size)
+
+def generate_packets(access_category, num_samples, sample_rate = 20e6, packet_length = (100, 1500), burst_packets = (1, 4),
+        back_off_weights = None, txop_limit = None, sifs = 16, aifs = None, rng = None):
+    """Returns the start and end sample indices of the packets of a single EDCA transmitter saturating the medium
+
+    Every TXOP follows an AIFS plus a backoff of 0 to n - 1 slots, uniform unless back_off_weights gives the probability of
+    each slot count, and holds burst_packets packets (an inclusive range) separated by SIFS for as long as they fit in the
+    TXOP limit (in ms, 0 for no limit). The AIFS and TXOP limit are those of the access category unless given. Packet
+    lengths are uniform over packet_length, or drawn by it if it is a sampler from get_packet_length_sampler, and are at
+    least one sample. All durations are in microseconds like in ANTS_Analyzer. The end indices are the last sample of each
+    packet, as the detector reports them."""
+    if rng is None:
+        rng = np.random.default_rng()
+
+    # the AIFS, slot time, contention window and TXOP limit of the access category, as the analyzer expects them
+    edca = analyzer.ANTS_Analyzer("Supervising", sample_rate)
+    edca.set_access_category(access_category)
+    if txop_limit is None:
+        txop_limit = edca.txop_limit
+    if aifs is None:
+        aifs = edca.aifs
+    if back_off_weights is not None:
+        back_off_weights = np.asarray(back_off_weights, dtype=np.float64)
+        if len(back_off_weights) != edca.n:
+            raise Exception("ERROR: {} needs backoff weights for {} slot counts".format(access_category, edca.n))
+        back_off_weights = back_off_weights/np.sum(back_off_weights)
+
+    samples_per_us = sample_rate/1e6
+    aifs_length = int(round(aifs*samples_per_us))
+    slot_length = int(round(edca.slot*samples_per_us))
+    sifs_length = int(round(sifs*samples_per_us))
+    txop_limit_length = int(round(txop_limit*1e3*samples_per_us)) if txop_limit != 0 else num_samples
+    if not callable(packet_length):
+        min_packet_length = max(1, int(round(packet_length[0]*samples_per_us)))
+        max_packet_length = max(min_packet_length, int(round(packet_length[1]*samples_per_us)))
+
+    # the random numbers are drawn for batches of TXOPs at a time, only the TXOP limit is checked per packet
+    batch_size = 4096
+    packet_start_indices = []
+    packet_end_indices = []
+    position = 0
+    while position < num_samples:
+        back_offs = rng.choice(edca.n, size=batch_size, p=back_off_weights).tolist()
+        bursts = rng.integers(burst_packets[0], burst_packets[1] + 1, size=batch_size).tolist()
+        if callable(packet_length):
+            lengths = np.maximum(np.rint(packet_length(rng, (batch_size, burst_packets[1]))*samples_per_us), 1).astype(np.int64).tolist()
+        else:
+            lengths = rng.integers(min_packet_length, max_packet_length + 1, size=(batch_size, burst_packets[1])).tolist()
+        for back_off, burst, burst_lengths in zip(back_offs, bursts, lengths):
+            position += aifs_length + back_off*slot_length
+            txop_end = position + txop_limit_length
+            for packet in range(burst):
+                if packet > 0:
+                    if position + sifs_length + burst_lengths[packet] > txop_end:
+                        break
+                    position += sifs_length
+                packet_start_indices.append(position)
+                position += burst_lengths[packet]
+                packet_end_indices.append(position - 1)
+            if position >= num_samples:
+                break
+
+    # the capture cuts off the packets that are still being sent when it ends
+    packet_start_indices = np.array(packet_start_indices, dtype=np.int64)
+    packet_end_indices = np.array(packet_end_indices, dtype=np.int64)
+    in_capture = packet_start_indices < num_samples
+    return packet_start_indices[in_capture], np.minimum(packet_end_indices[in_capture], num_samples - 1)
+
+def write_iq_samples(iq_samples_file_name, packet_start_indices, packet_end_indices, num_samples, noise_power = 1e-4,
+        signal_power = 1.0, rng = None, chunk_size = 2**20, sample_format = "fc32"):
+    """Writes a capture, as writeIQ.py records it, of constant-envelope QPSK packets over complex Gaussian noise"""
+    if rng is None:
+        rng = np.random.default_rng()
+    noise_amplitude = np.float32(np.sqrt(noise_power/2))
+    constellation = (np.sqrt(signal_power/2)*np.array([1+1j, 1-1j, -1+1j, -1-1j])).astype(np.complex64)
+
+    # the samples are generated and written a chunk at a time, so captures of any size take the same memory
+    with open(iq_samples_file_name, mode='wb') as file:
+        for chunk_start in range(0, num_samples, chunk_size):
+            chunk_stop = min(chunk_start + chunk_size, num_samples)
+            samples = rng.standard_normal(2*(chunk_stop - chunk_start), dtype=np.float32).view(np.complex64)
+            samples *= noise_amplitude
+
+            # mark the samples of the packets that overlap the chunk with +1 at their start and -1 after their end
+            first = np.searchsorted(packet_end_indices, chunk_start)
+            last = np.searchsorted(packet_start_indices, chunk_stop)
+            edges = np.zeros(chunk_stop - chunk_start + 1, dtype=np.int64)
+            np.add.at(edges, np.maximum(packet_start_indices[first:last], chunk_start) - chunk_start, 1)
+            np.add.at(edges, np.minimum(packet_end_indices[first:last] + 1, chunk_stop) - chunk_start, -1)
+            in_packet = np.cumsum(edges[:-1]) > 0
+            samples[in_packet] += constellation[rng.integers(0, 4, size=np.count_nonzero(in_packet))]
+            if sample_format != "fc32":
+                # quantized as UHD converts fc32 to sc16 or sc8
+                full_scale = analyzer.FULL_SCALE[analyzer.get_sample_dtype(sample_format).base]
+                samples = np.clip(np.rint(samples.view(np.float32)*full_scale), -full_scale, full_scale).astype(analyzer.get_sample_dtype(sample_format).base)
+            samples.tofile(file)
+
+def generate_runs(data_dir, access_category, duration, num_runs = 1, sample_rate = 20e6, noise_power = 1e-4, signal_power = 1.0,
+        packet_length = (100, 1500), burst_packets = (1, 4), back_off_weights = None, txop_limit = None, sifs = 16, aifs = None,
+        seed = None, sample_format = "fc32"):
+    """Writes num_runs synthetic captures of duration seconds, named as ANTS_Controller names them, and their ground truth
+
+    The packets are generated by generate_packets, which takes the packet_length, burst_packets, back_off_weights,
+    txop_limit, sifs and aifs, and written over noise of noise_power by write_iq_samples.
+    The ground truth is written to data_dir/ground_truth_<access category>.npz in the format of exportPacketEvents, so it
+    can be compared with the packets the analyzer detects or loaded with loadPacketEvents."""
+    rng = np.random.default_rng(seed)
+    num_samples = int(round(duration*sample_rate))
+    ground_truth = analyzer.ANTS_Analyzer("Supervising", sample_rate)
+    iq_samples_file_names = []
+    for run in range(num_runs):
+        iq_samples_file_name = os.path.join(data_dir, "iqsamples_" + access_category + "_run" + str(run) + ".bin")
+        packet_start_indices, packet_end_indices = generate_packets(access_category, num_samples, sample_rate=sample_rate,
+            packet_length=packet_length, burst_packets=burst_packets, back_off_weights=back_off_weights, txop_limit=txop_limit,
+            sifs=sifs, aifs=aifs, rng=rng)
+        print("Writing {} packets in {} samples to {}".format(len(packet_start_indices), num_samples, iq_samples_file_name))
+        write_iq_samples(iq_samples_file_name, packet_start_indices, packet_end_indices, num_samples, noise_power=noise_power,
+            signal_power=signal_power, rng=rng, sample_format=sample_format)
+        ground_truth.addPackets(access_category, packet_start_indices, packet_end_indices, file_name=iq_samples_file_name,
+            run=run, data_length=num_samples, sample_format=sample_format)
+        iq_samples_file_names.append(iq_samples_file_name)
+    ground_truth.exportPacketEvents(os.path.join(data_dir, "ground_truth_{}.npz".format(access_category)))
+    return iq_samples_file_names
+
+def main():
+    # e.g. ./synthetic_iq.py ../tests/synthetic voice 0.5 --runs 3 --packet-length exponential 400 --noise-power 1e-3
+    parser = argparse.ArgumentParser(description="Writes synthetic captures of a single EDCA transmitter and their ground truth.")
+    parser.add_argument("data_dir")
+    parser.add_argument("access_category", choices=["voice", "video", "best_effort", "background"])
+    parser.add_argument("duration", type=float, help="in seconds")
+    parser.add_argument("--runs", type=int, default=1, help="the number of captures (default: %(default)s)")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--sample-rate", type=float, default=20e6, help="in samples per second (default: %(default)g)")
+    parser.add_argument("--sample-format", choices=["fc32", "sc16", "sc8"], default="fc32")
+    parser.add_argument("--noise-power", type=float, default=1e-4, help="(default: %(default)g)")
+    parser.add_argument("--signal-power", type=float, default=1.0, help="(default: %(default)g)")
+    parser.add_argument("--packet-length", nargs="+", default=["uniform", "100", "1500"], metavar=("DISTRIBUTION", "PARAMETER"),
+        help="uniform MIN MAX, fixed LENGTH, exponential MEAN or normal MEAN STD, in us (default: uniform 100 1500)")
+    parser.add_argument("--burst-packets", nargs=2, type=int, default=[1, 4], metavar=("MIN", "MAX"),
+        help="the number of packets per TXOP (default: 1 4)")
+    parser.add_argument("--back-off-weights", nargs="+", type=float,
+        help="the relative probability of each backoff slot count (default: uniform)")
+    parser.add_argument("--txop-limit", type=float, help="in ms, 0 for no limit (default: that of the access category)")
+    parser.add_argument("--sifs", type=float, default=16, help="in us (default: %(default)s)")
+    parser.add_argument("--aifs", type=float, help="in us (default: that of the access category)")
+    args = parser.parse_args()
+
+    # a uniform distribution is passed as a range, which draws the same packets for a seed as generate_runs does by default
+    if args.packet_length[0] == "uniform" and len(args.packet_length) == 3:
+        packet_length = (float(args.packet_length[1]), float(args.packet_length[2]))
+    else:
+        packet_length = get_packet_length_sampler(*args.packet_length)
+
+    if not os.path.exists(args.data_dir):
+        os.makedirs(args.data_dir)
+    generate_runs(args.data_dir, args.access_category, args.duration, num_runs=args.runs, sample_rate=args.sample_rate,
+        noise_power=args.noise_power, signal_power=args.signal_power, packet_length=packet_length,
+        burst_packets=tuple(args.burst_packets), back_off_weights=args.back_off_weights, txop_limit=args.txop_limit, sifs=args.sifs,
+        aifs=args.aifs, seed=args.seed, sample_format=args.sample_format)
+
+if __name__ == "__main__":
+    main()
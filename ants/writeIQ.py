@@ -14,32 +14,49 @@ from fcntl import ioctl
 
 USBDEVFS_RESET = ord("U") << (4*2) | 20
 
+# The size of one sample in each format the samples can be written in: float32, int16 or int8 in-phase/quadrature pairs.
+# sc16 and sc8 are written as they come over the wire, at a half and a quarter of the disk bandwidth of fc32
+ITEM_SIZES = {"fc32": gr.sizeof_gr_complex, "sc16": 2*gr.sizeof_short, "sc8": 2*gr.sizeof_char}
+
+# The sample rate and bandwidth the USRP is set to, and the antenna it receives on
+SAMPLE_RATE = 20e6
+BANDWIDTH = 20e6
+ANTENNA = "RX2"
+
+# Returns the USRP source streaming samples in cpu_format, before it is tuned and its gain is set. Also used by
+# capture_daemon.py
+def make_usrp_source(cpu_format="fc32"):
+	if cpu_format not in ITEM_SIZES:
+		raise Exception("ERROR: Unknown sample format {}".format(cpu_format))
+	# sc8 samples have to be sent as sc8 over the wire as well, the other formats are converted from sc16
+	otw_format = "sc8" if cpu_format == "sc8" else "sc16"
+	print("Set sample format to {}".format(cpu_format))
+	usrpSource = uhd.usrp_source(",".join(("", "")), uhd.stream_args(cpu_format=cpu_format, otw_format=otw_format, channels=range(1)))
+	print("Set sample rate to {}".format(SAMPLE_RATE))
+	usrpSource.set_samp_rate(SAMPLE_RATE)
+	print("Set antenna to {}".format(ANTENNA))
+	usrpSource.set_antenna(ANTENNA, 0)
+	print("Set bandwidth to {}".format(BANDWIDTH))
+	usrpSource.set_bandwidth(BANDWIDTH, 0)
+	return usrpSource
+
 class WriteIQ(gr.top_block):
-	def __init__(self, runFor, center_frequency, gain, file_name):
+	def __init__(self, runFor, center_frequency, gain, file_name, cpu_format="fc32"):
 		gr.top_block.__init__(self)
 		
 		# Define variables
-		sample_rate = 20e6
-		bandwidth = 20e6
-		antenna = "RX2"
 		file_name = file_name
 
 		# Define blocks
 		# 1) USRP Source
-		self.usrpSource = uhd.usrp_source(",".join(("", "")), uhd.stream_args(cpu_format="fc32", channels=range(1)))
-		print("Set sample rate to {}".format(sample_rate))
-		self.usrpSource.set_samp_rate(sample_rate)
+		self.usrpSource = make_usrp_source(cpu_format)
 		print("Set center frequency to {}".format(center_frequency))
 		self.usrpSource.set_center_freq(center_frequency, 0)
 		print("Set gain to {}".format(gain))
 		self.usrpSource.set_gain(gain, 0)
-		print("Set antenna to {}".format(antenna))
-		self.usrpSource.set_antenna(antenna, 0)
-		print("Set bandwidth to {}".format(bandwidth))
-		self.usrpSource.set_bandwidth(bandwidth, 0)
 
 		# 2) File Sink
-		self.fileSnk = blocks.file_sink(gr.sizeof_gr_complex*1, file_name, False)
+		self.fileSnk = blocks.file_sink(ITEM_SIZES[cpu_format], file_name, False)
 		print("Write IQ samples to {}".format(file_name))
 
 		# Define connections
@@ -51,8 +68,9 @@ def main():
 	runFor = float(sys.argv[2]) # sec
 	center_frequency = float(sys.argv[3])*1e9
 	gain = int(sys.argv[4])
+	cpu_format = sys.argv[5] if len(sys.argv) > 5 else "fc32"
 	
-	writeIq = WriteIQ(runFor, center_frequency, gain, file_name)
+	writeIq = WriteIQ(runFor, center_frequency, gain, file_name, cpu_format)
 	t = threading.Thread(target=writeIq.run)
 	t.daemon = True
 	t.start()
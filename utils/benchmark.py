@@ -0,0 +1,169 @@
+#!/usr/bin/python3
+
+# Times and memory-profiles each stage of the analysis on synthetic captures, e.g.
+#   ./benchmark.py --sizes 100M 1G --runs 1 4 --output bench.json
+#   ./benchmark.py --sizes 100M 1G --runs 1 4 --output bench.json --baseline baseline.json
+# Each case runs in its own process, so the peak memory of one case does not carry over into the next
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ants"))
+
+ACCESS_CATEGORIES = ["voice", "video", "best_effort", "background"]
+SIZE_UNITS = {"K": 1e3, "M": 1e6, "G": 1e9}
+STAGES = ["detect", "load", "results", "plot"]
+
+def parse_size(size):
+    """Converts a size like 100M or 20G to bytes"""
+    if size[-1].upper() in SIZE_UNITS:
+        return int(float(size[:-1])*SIZE_UNITS[size[-1].upper()])
+    return int(size)
+
+def reset_peak_rss():
+    # Linux resets the peak resident set size of the process when 5 is written to clear_refs
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        pass
+
+def get_peak_rss():
+    """Returns the peak resident set size of the process in bytes since the last reset_peak_rss"""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])*1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+
+def get_capture_file_names(work_dir, access_category, size, num_runs, seed):
+    """Generates the captures of a case unless an earlier benchmark already did, and returns their names"""
+    import synthetic_iq
+    case_dir = os.path.join(work_dir, "{}_{}_seed{}".format(access_category, size, seed))
+    duration = size/8/20e6
+    iq_samples_file_names = [os.path.join(case_dir, "iqsamples_" + access_category + "_run" + str(run) + ".bin") for run in range(num_runs)]
+    if not all(os.path.exists(iq_samples_file_name) for iq_samples_file_name in iq_samples_file_names):
+        if not os.path.exists(case_dir):
+            os.makedirs(case_dir)
+        synthetic_iq.generate_runs(case_dir, access_category, duration, num_runs=num_runs, seed=seed)
+    return iq_samples_file_names
+
+def run_case(case):
+    """Runs every stage of one case in this process and returns the wall time, CPU time and peak memory of each"""
+    import analyzer
+    iq_samples_file_names = case["iq_samples_file_names"]
+    ants_analyzer = analyzer.ANTS_Analyzer("Supervising")
+    stages = {}
+    def measure(stage, function):
+        reset_peak_rss()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        result = function()
+        stages[stage] = {"wall": time.perf_counter() - wall_start, "cpu": time.process_time() - cpu_start, "peak_rss": get_peak_rss()}
+        return result
+
+    # thresholding and burst detection, bypassing the packet cache, then opening the captures and adding their packets to
+    # the analysis
+    packet_indices = measure("detect", lambda: [analyzer.detect_packets(iq_samples_file_name, 20e6, 0.02, case["max_memory"], case["workers"], cache=False)
+        for iq_samples_file_name in iq_samples_file_names])
+    measure("load", lambda: [ants_analyzer.addIqFile(analyzer.IQSamplesFile(iq_samples_file_name, packet_indices=indices))
+        for iq_samples_file_name, indices in zip(iq_samples_file_names, packet_indices)])
+    results = measure("results", ants_analyzer.get_results)
+    with tempfile.TemporaryDirectory() as plot_dir:
+        measure("plot", lambda: results.plot(plot_dir))
+    return {"packets": int(results.number_of_packets), "stages": stages}
+
+def get_case_key(case):
+    return "{}/{}/{}".format(case["access_category"], case["size"], case["runs"])
+
+def compare(results, baseline, tolerance, min_time):
+    """Prints every stage that got slower or used more memory than in the baseline and returns how many did"""
+    # stages that take less than min_time seconds either way are too short to time reliably
+    baseline_cases = {get_case_key(case): case for case in baseline["cases"]}
+    regressions = 0
+    for case in results["cases"]:
+        baseline_case = baseline_cases.get(get_case_key(case))
+        if baseline_case is None:
+            print("{}: not in the baseline".format(get_case_key(case)))
+            continue
+        for stage in STAGES:
+            for metric in ("wall", "peak_rss"):
+                value = case["stages"][stage][metric]
+                baseline_value = baseline_case["stages"][stage][metric]
+                ratio = value/baseline_value if baseline_value > 0 else 1.0
+                status = "REGRESSION" if ratio > 1 + tolerance else "ok"
+                if metric == "wall" and max(value, baseline_value) < min_time:
+                    status = "ok"
+                if status != "ok":
+                    regressions += 1
+                print("{}: {} {} {:.4g} vs {:.4g} ({:+.1f}%) {}".format(get_case_key(case), stage, metric, value, baseline_value, (ratio - 1)*100, status))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ANTS analyzer on synthetic captures")
+    parser.add_argument("--sizes", nargs="+", default=["100M", "1G", "20G"], help="capture sizes per run, e.g. 100M 20G")
+    parser.add_argument("--access-categories", nargs="+", default=ACCESS_CATEGORIES, choices=ACCESS_CATEGORIES)
+    parser.add_argument("--runs", nargs="+", type=int, default=[1, 4], help="numbers of runs per case")
+    parser.add_argument("--max-memory", type=int, default=None, help="max_memory passed to the packet detection, in bytes")
+    parser.add_argument("--workers", type=int, default=None, help="worker threads passed to the packet detection")
+    parser.add_argument("--work-dir", default=os.path.join(tempfile.gettempdir(), "ants_benchmark"), help="where the captures are generated and kept")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--baseline", default=None, help="results of an earlier benchmark to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="relative slowdown or memory growth reported as a regression")
+    parser.add_argument("--min-time", type=float, default=0.01, help="stages faster than this many seconds are not compared")
+    parser.add_argument("--case", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case is not None:
+        # run a single case, in the process started for it below, and hand the measurements back through a file
+        case = json.loads(args.case)
+        measurements = run_case(case)
+        with open(case["output"], "w") as output:
+            json.dump(measurements, output)
+        return
+
+    results = {"python": platform.python_version(), "machine": platform.machine(), "processor": platform.processor(),
+        "cpus": os.cpu_count(), "cases": []}
+    for access_category in args.access_categories:
+        for size in args.sizes:
+            for runs in args.runs:
+                case = {"access_category": access_category, "size": parse_size(size), "runs": runs, "seed": args.seed,
+                    "work_dir": args.work_dir, "max_memory": args.max_memory, "workers": args.workers}
+                print("Benchmarking {}...".format(get_case_key(case)))
+                # the captures are generated here rather than in the process of the case, so that it only measures the analysis
+                case["iq_samples_file_names"] = get_capture_file_names(args.work_dir, access_category, case["size"], runs, args.seed)
+                with tempfile.NamedTemporaryFile(suffix=".json") as output:
+                    case["output"] = output.name
+                    subprocess.run([sys.executable, os.path.abspath(__file__), "--case", json.dumps(case)], check=True, stdout=subprocess.DEVNULL)
+                    with open(output.name) as case_output:
+                        measurements = json.load(case_output)
+                del case["output"]
+                del case["iq_samples_file_names"]
+                case.update(measurements)
+                results["cases"].append(case)
+                print(", ".join("{} {:.3f}s {:.0f}MB".format(stage, case["stages"][stage]["wall"], case["stages"][stage]["peak_rss"]/1e6) for stage in STAGES))
+
+    with open(args.output, "w") as output:
+        json.dump(results, output, indent=4)
+    print("Wrote the results to {}".format(args.output))
+
+    if args.baseline is not None:
+        with open(args.baseline) as baseline:
+            regressions = compare(results, json.load(baseline), args.tolerance, args.min_time)
+        if regressions > 0:
+            print("{} regressions against {}".format(regressions, args.baseline))
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/python3
+
+# Checks capture_daemon.py and capture_client.py without a USRP, through the null and file sources of the daemon, e.g.
+#   ./daemon_check.py --sample-format sc16
+# For each source the daemon is started as ANTS_Controller starts it and asked for a capture of a number of samples,
+# which must hold exactly that many, and for one of a duration. The null source writes zeros and the file source plays a
+# synthetic capture back in a loop, so each of its captures must be a stretch of that capture. Asking for another sample
+# format must fail without stopping the daemon, and shutting the daemon down must remove its socket
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+ANTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ants")
+sys.path.insert(0, ANTS_DIR)
+
+import analyzer
+import capture_client
+import synthetic_iq
+
+SAMPLE_FORMATS = ["fc32", "sc16", "sc8"]
+
+def check_capture(capture_file_name, reply, item_size, source_data, num_samples = None):
+    """Checks that a capture holds the samples the daemon replied it wrote, and that they are a stretch of source_data
+    played back in a loop, or zeros if source_data is None"""
+    size = os.path.getsize(capture_file_name)
+    if size != reply["num_samples"]*item_size:
+        raise Exception("ERROR: The daemon wrote {} samples to {}, but replied it wrote {}".format(size // item_size, capture_file_name, reply["num_samples"]))
+    if num_samples is not None and reply["num_samples"] != num_samples:
+        raise Exception("ERROR: Asked for {} samples, the daemon wrote {}".format(num_samples, reply["num_samples"]))
+    if reply["num_samples"] == 0:
+        raise Exception("ERROR: The daemon wrote no samples to {}".format(capture_file_name))
+    with open(capture_file_name, "rb") as capture_file:
+        data = capture_file.read()
+    if source_data is None:
+        if data.count(0) != len(data):
+            raise Exception("ERROR: The null source wrote samples other than zeros to {}".format(capture_file_name))
+        return
+    # the capture starts anywhere in the loop and may wrap around it several times
+    looped = source_data*(len(data)//len(source_data) + 2)
+    offset = looped.find(data[:min(len(data), 4096)])
+    if offset < 0 or offset % item_size != 0 or looped[offset:offset + len(data)] != data:
+        raise Exception("ERROR: {} is not a stretch of the source file played back in a loop".format(capture_file_name))
+
+def check_source(work_dir, source, sample_format, source_file_name = None):
+    socket_name = os.path.join(work_dir, "capture_daemon.sock")
+    item_size = analyzer.get_sample_dtype(sample_format).itemsize
+    source_data = None
+    capture_daemon_args = [sys.executable, os.path.join(ANTS_DIR, "capture_daemon.py"), socket_name, "--center-frequency", "5.18",
+        "--gain", "40", "--sample-format", sample_format, "--source", source]
+    if source_file_name is not None:
+        capture_daemon_args += ["--source-file", source_file_name]
+        with open(source_file_name, "rb") as source_file:
+            source_data = source_file.read()
+
+    print("Checking the {} source in {}".format(source, sample_format))
+    daemon_proc = subprocess.Popen(capture_daemon_args)
+    try:
+        status = capture_client.wait_for_daemon(socket_name, lambda: daemon_proc.poll() is None)
+        if status["source"] != source or status["sample_format"] != sample_format:
+            raise Exception("ERROR: Started a daemon reading {} from a {} source, it reports {}".format(sample_format, source, status))
+
+        # a capture of a number of samples, retuned on the way
+        capture_file_name = os.path.join(work_dir, "capture_samples.bin")
+        num_samples = 123457
+        capture = capture_client.start_capture(socket_name, capture_file_name, num_samples=num_samples, center_frequency=2.437,
+            gain=30, sample_format=sample_format)
+        check_capture(capture_file_name, capture.wait(), item_size, source_data, num_samples)
+        status = capture_client.get_status(socket_name)
+        if status["center_frequency"] != 2.437 or status["gain"] != 30:
+            raise Exception("ERROR: The daemon did not retune for the capture, it reports {}".format(status))
+
+        # a capture of a duration, polled as the controller polls it
+        capture_file_name = os.path.join(work_dir, "capture_duration.bin")
+        capture = capture_client.start_capture(socket_name, capture_file_name, duration=0.1)
+        while capture.poll() is None:
+            pass
+        check_capture(capture_file_name, capture.result, item_size, source_data)
+        print("Captured {} samples in 0.1s".format(capture.result["num_samples"]))
+
+        # another sample format is refused, and the daemon keeps taking commands
+        other_format = SAMPLE_FORMATS[(SAMPLE_FORMATS.index(sample_format) + 1) % len(SAMPLE_FORMATS)]
+        try:
+            capture_client.start_capture(socket_name, os.path.join(work_dir, "capture_refused.bin"), duration=0.1, sample_format=other_format)
+        except Exception as e:
+            print("Refused a capture in {}: {}".format(other_format, e))
+        else:
+            raise Exception("ERROR: The daemon took a capture in {} while reading {}".format(other_format, sample_format))
+        capture_client.get_status(socket_name)
+
+        capture_client.shutdown(socket_name)
+        if daemon_proc.wait(timeout=10) != 0:
+            raise Exception("ERROR: The daemon exited with {}".format(daemon_proc.returncode))
+        if os.path.exists(socket_name):
+            raise Exception("ERROR: The daemon left its socket {} behind".format(socket_name))
+    finally:
+        if daemon_proc.poll() is None:
+            daemon_proc.terminate()
+            daemon_proc.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the capture daemon and its client with the null and file sources of the daemon")
+    parser.add_argument("--sample-format", default="fc32", choices=SAMPLE_FORMATS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--work-dir", help="where to write the captures (default: a temporary directory that is removed afterwards)")
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="ants_daemon_")
+    if not os.path.exists(work_dir):
+        os.makedirs(work_dir)
+    try:
+        check_source(work_dir, "null", args.sample_format)
+        source_file_name, = synthetic_iq.generate_runs(work_dir, "voice", 0.05, seed=args.seed, sample_format=args.sample_format)
+        check_source(work_dir, "file", args.sample_format, source_file_name)
+        print("The capture daemon wrote the samples of both sources as asked")
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/python3
+
+# Checks follow mode (ants/follow_capture.py) against a local writer standing in for the USRP, e.g.
+#   ./follow_check.py --duration 2 --rate 160M
+# As in the GUI, follow mode is refused until the noise floor is calibrated, which is done from a synthetic capture of the
+# idle channel, and the detection threshold is then taken from the saved profile. A synthetic capture that starts with
+# --idle-time seconds of idle channel is copied to a new file by a separate process at --rate bytes per second, 160MB/s
+# being what writeIQ.py writes at 20 MS/s in fc32, while CaptureFollower detects the packets in the copy. They must be
+# exactly the packets that were written, and that IQSamplesFile detects in the complete capture with the same threshold
+# as the GUI does when it analyzes the capture afterwards
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ants"))
+
+from benchmark import parse_size
+
+WRITE_BLOCK_SIZE = 2**20
+
+# The rig, gain and center frequency the noise floor is calibrated for
+RIG_NAME = "follow_check"
+GAIN = 40
+CENTER_FREQUENCY = 5.18
+
+def write_throttled(source_file_name, iq_samples_file_name, rate):
+    """Copies source_file_name to iq_samples_file_name at rate bytes per second, a block at a time like a file sink"""
+    start = time.time()
+    num_bytes = 0
+    with open(source_file_name, "rb") as source_file, open(iq_samples_file_name, "wb") as iq_file:
+        while True:
+            block = source_file.read(WRITE_BLOCK_SIZE)
+            if not block:
+                break
+            iq_file.write(block)
+            iq_file.flush()
+            num_bytes += len(block)
+            delay = num_bytes/rate - (time.time() - start)
+            if delay > 0:
+                time.sleep(delay)
+    print("Wrote {:.1f}MB at {:.1f}MB/s".format(num_bytes/1e6, num_bytes/(time.time() - start)/1e6))
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that following a capture while it is written finds the same packets as analyzing it afterwards")
+    parser.add_argument("--duration", type=float, default=2.0, help="seconds of samples to write (default: %(default)s)")
+    parser.add_argument("--idle-time", type=float, default=0.06, help="seconds of idle channel the capture starts with (default: %(default)s)")
+    parser.add_argument("--rate", default="160M", help="bytes per second to write at (default: %(default)s)")
+    parser.add_argument("--access-category", default="video", choices=["voice", "video", "best_effort", "background"])
+    parser.add_argument("--sample-format", default="fc32", choices=["fc32", "sc16", "sc8"])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--work-dir", help="where to write the captures (default: a temporary directory that is removed afterwards)")
+    parser.add_argument("--write", nargs=2, metavar=("SOURCE", "DESTINATION"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.write:
+        # the writer runs in its own process, like writeIQ.py
+        write_throttled(args.write[0], args.write[1], parse_size(args.rate))
+        return
+
+    import numpy as np
+    import analyzer
+    import follow_capture
+    import noise_floor
+    import synthetic_iq
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="ants_follow_")
+    if not os.path.exists(work_dir):
+        os.makedirs(work_dir)
+    try:
+        rng = np.random.default_rng(args.seed)
+        sample_rate = 20e6
+        followed_file_name = os.path.join(work_dir, "followed.bin")
+        if os.path.exists(followed_file_name):
+            os.remove(followed_file_name)
+
+        # Without a calibrated noise floor there is no threshold to follow with, as in ANTS_Controller.get_detection_threshold
+        profile_file_name = os.path.join(work_dir, "noise_floor.json")
+        if os.path.exists(profile_file_name):
+            os.remove(profile_file_name)
+        if noise_floor.get_profile(profile_file_name, RIG_NAME, GAIN, CENTER_FREQUENCY) is not None:
+            raise Exception("ERROR: A noise floor was found before it was calibrated")
+        try:
+            follow_capture.CaptureFollower(followed_file_name, None, sample_format=args.sample_format)
+        except Exception as e:
+            print("Following without a calibrated noise floor is refused: {}".format(e))
+        else:
+            raise Exception("ERROR: Following was not refused without a calibrated noise floor")
+
+        # calibrate the noise floor from the idle channel as ANTS_Controller.calibrate_noise_floor does
+        idle_file_name = os.path.join(work_dir, "noise_floor.bin")
+        num_idle_samples = int(round(0.1*sample_rate))
+        synthetic_iq.write_iq_samples(idle_file_name, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), num_idle_samples, rng=rng,
+            sample_format=args.sample_format)
+        noise_floor.save_profile(profile_file_name, noise_floor.measure_noise_floor(idle_file_name, RIG_NAME, GAIN, CENTER_FREQUENCY,
+            sample_rate=sample_rate, sample_format=args.sample_format))
+        threshold = noise_floor.get_threshold(noise_floor.get_profile(profile_file_name, RIG_NAME, GAIN, CENTER_FREQUENCY))
+        print("Calibrated a detection threshold of {}".format(threshold))
+
+        # the capture starts on an idle channel, so the mean power of its first samples is that of the noise alone
+        num_samples = int(round(args.duration*sample_rate))
+        idle_length = int(round(args.idle_time*sample_rate))
+        packet_start_indices, packet_end_indices = synthetic_iq.generate_packets(args.access_category, num_samples - idle_length,
+            sample_rate=sample_rate, rng=rng)
+        packet_start_indices += idle_length
+        packet_end_indices += idle_length
+        source_file_name = os.path.join(work_dir, "iqsamples_" + args.access_category + "_run0.bin")
+        print("Writing {} packets after {}s of idle channel to {}".format(len(packet_start_indices), args.idle_time, source_file_name))
+        synthetic_iq.write_iq_samples(source_file_name, packet_start_indices, packet_end_indices, num_samples, rng=rng,
+            sample_format=args.sample_format)
+
+        writer = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--write", source_file_name, followed_file_name, "--rate", args.rate])
+        follower = follow_capture.CaptureFollower(followed_file_name, threshold, sample_rate=sample_rate, sample_format=args.sample_format)
+        writer_stopped = []
+        def is_running():
+            if writer.poll() is None:
+                return True
+            writer_stopped.append(time.time())
+            return False
+        followed_start_indices, followed_end_indices = follower.follow(is_running)
+        lag = time.time() - writer_stopped[0]
+        if writer.returncode != 0:
+            raise Exception("ERROR: The writer exited with {}".format(writer.returncode))
+        print("Packets were ready {:.3f}s after the writer stopped".format(lag))
+
+        if not (np.array_equal(followed_start_indices, packet_start_indices) and np.array_equal(followed_end_indices, packet_end_indices)):
+            raise Exception("ERROR: Following found {} packets, {} were written".format(len(followed_start_indices), len(packet_start_indices)))
+        iqFile = analyzer.IQSamplesFile(source_file_name, sample_rate=sample_rate, threshold=threshold, cache=False, sample_format=args.sample_format)
+        if not (np.array_equal(followed_start_indices, iqFile.packet_start_indices) and np.array_equal(followed_end_indices, iqFile.packet_end_indices)):
+            raise Exception("ERROR: Following found {} packets, analyzing the complete capture found {}".format(len(followed_start_indices),
+                len(iqFile.packet_start_indices)))
+        print("Following found the {} packets written, the same as analyzing the complete capture".format(len(followed_start_indices)))
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+#!/usr/bin/python3
+
+# Replaces captures with only the samples around their packets, e.g.
+#   ./gate_captures.py ../tests/run_2020-01-01/iqsamples_background_run*.bin --guard 400
+# The analyzer and the plots read gated captures like full ones, with the same packets, IFSs and TXOPs
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ants"))
+
+def main():
+    import analyzer
+    import sigmf_capture
+    parser = argparse.ArgumentParser(description="Keep only the IQ samples around the packets of ANTS captures")
+    parser.add_argument("iq_samples_file_names", nargs="+")
+    parser.add_argument("--pre-guard", type=int, default=analyzer.DEFAULT_GUARD, help="samples kept before every packet")
+    parser.add_argument("--post-guard", type=int, default=analyzer.DEFAULT_GUARD, help="samples kept after every packet")
+    parser.add_argument("--sample-format", default="fc32", choices=sorted(analyzer.SAMPLE_FORMATS))
+    parser.add_argument("--sample-rate", type=float, default=20e6)
+    parser.add_argument("--noise-threshold", type=float, default=0.02)
+    parser.add_argument("--max-memory", type=int, default=2**28, help="memory used to detect the packets, in bytes")
+    args = parser.parse_args()
+
+    total_size = 0
+    total_gated_size = 0
+    for iq_samples_file_name in args.iq_samples_file_names:
+        if sigmf_capture.is_sigmf(iq_samples_file_name):
+            # the metadata of a SigMF recording would no longer describe its samples
+            print("{} is a SigMF recording, which cannot be gated".format(iq_samples_file_name))
+            continue
+        iqFile = analyzer.IQSamplesFile(iq_samples_file_name, sample_rate=args.sample_rate, noise_threshold=args.noise_threshold,
+            max_memory=args.max_memory, sample_format=args.sample_format)
+        if iqFile.gated:
+            print("{} is already gated".format(iq_samples_file_name))
+            continue
+        size = os.path.getsize(iq_samples_file_name)
+        analyzer.gate_capture(iq_samples_file_name, iqFile.packet_start_indices, iqFile.packet_end_indices, pre_guard=args.pre_guard,
+            post_guard=args.post_guard, sample_format=args.sample_format)
+        total_size += size
+        total_gated_size += os.path.getsize(iq_samples_file_name)
+    if total_size > 0:
+        print("Reduced {:.1f}MB to {:.1f}MB".format(total_size/1e6, total_gated_size/1e6))
+
+if __name__ == "__main__":
+    main()
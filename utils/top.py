@@ -2,8 +2,12 @@ import numpy as np
 import matplotlib.pyplot as plt
 import numpy
 import math
+import os
 import sys
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ants"))
+import analyzer
+
 
 # Input arguments:
 # ----------------
@@ -68,30 +72,14 @@ with open(file_name, mode='rb') as file: # b is important -> binary
 	data = np.fromfile(file, dtype=np.float32)
 file.close()
 
-# the data is divided into inphase and quadrature data
-# inphase data are at the even indices, cos(wt)
-file_length = len(data) #added
-inphase_data = data[0:file_length:2]
-# quadrature data are at the odd indices, sin(wt)
-quadrature_data = data[1:file_length:2]
-
-# delete data to free some space, inphase and quadrature have the needed data
+# find the power of the signal, the square of the magnitude of the complex data, straight from the interleaved
+# inphase (cos(wt), even indices) and quadrature (sin(wt), odd indices) data
+power_data = analyzer.power_envelope(data)
 del data
-# find the common length of the inphase and quadrature data
-data_length = min(len(inphase_data), len(quadrature_data))
+data_length = len(power_data)
 duration = data_length/sampling_rate
-# have both vectors to be of the same length, the length of the shorter vector
-inphase_data = inphase_data[0:data_length]
-quadrature_data = quadrature_data[0:data_length]
 # set the time axis from the data length and the total duration
 time = np.linspace(0, duration, num=data_length)
-# combine inphase and quadrature components as a complex number, cos(wt) + 1j*sin(wt)
-complex_data = inphase_data + (1j*quadrature_data)
-del inphase_data
-del quadrature_data
-# find the power of the signal using the square of the magnitude of the complex data
-power_data = abs(complex_data)**2
-del complex_data
 # set a minimum threshold value for noise
 f = 0.02
 threshold = f * np.mean(power_data)